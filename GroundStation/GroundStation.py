@@ -6,22 +6,18 @@ Tomas Manterola
 Receives data from RFM96W receiver (connected to Arduino/Microcontroller), displays information about capsule, and sends data to HabHub.
 
 Dependencies:
- - crcmod
  - pyqrcode
  - pyserial
 
 '''
 
 
-import glob
 import logging
-import re
-import sys
+import time
+import tkFileDialog
 import tkFont
 import tkMessageBox
-import time
 import ttk
-import urllib
 import webbrowser
 
 import Tkinter as tk
@@ -29,9 +25,9 @@ from ScrolledText import ScrolledText
 
 # Install missing packages if necessary
 try:
-    import crcmod.predefined
     import pyqrcode
     import serial
+    del serial      # Only checked for here: pyserial is used by 'ingest' and 'ports'
 
 except ImportError:
     try:
@@ -43,12 +39,22 @@ except ImportError:
         quit()
     
     print("Installing necessary packages...")
-    pip.main(['install', 'crcmod'])
     pip.main(['install', 'pyqrcode'])
     pip.main(['install', 'pyserial'])
     raw_input("Press any key to exit...")
     quit()
 
+import charts
+import console
+import ingest
+import metrics
+import ports
+import qrrender
+import receiver
+import replay
+import telemetry
+import uplink
+
 
 __version__ = "1.1.0"
 
@@ -59,8 +65,6 @@ SERIAL_PORT_NOT_CONNECTED   = ["Serial Port Not Connected", "To send a command t
 
 CALLSIGN_LENGTH_ERROR       = ["Callsign Length Error", "Callsign must have 3 or more characters."]
 
-CONNECTION_ERROR            = ["Connection Error", "An error occurred while sending data to HabHub. Check your Internet connection.\nRetry, or set to offline?"]
-
 HELP_MESSAGE                = ["Help", "This program is designed to be used with a LoRa module and an Arduino connected through a serial connection.\nStart by connecting your receiver to your computer using a USB cable."]
 ABOUT_MESSAGE               = ["About", "Argo 2 Ground Station\n\nTool for communicating with Argo 2 transceiver and uploading data to HabHub tracker.\n\nAuthor: Tomas Manterola\nVersion: " + __version__ + "\n"]
 
@@ -80,49 +84,96 @@ GENERAL_COMMANDS            = [
 global app
 global callsign
 global callsign_temp
+global charts_window
 global command_desc
 global command_raw
+global engine
 global last_command
-global last_data_sentence
 global logger
+global metrics_file
 global online
-global parsed_data
-global rssi
+global payload_view
+global payload_views
+global lost_receivers
+global port_monitor
+global qr_renderer
+global receiver_identities
+global record_raw
+global repair_errors
+global replay_engine
+global replay_speed
+global replayer
+global selected_payload
 global sent_logger
-global ser
 global serial_port
 global serial_port_wait
+global status_window
 global tx_power
+global view_refresh
+global view_refresh_scheduled
 
 global callsign_textbox
 global command_listbox
 global connect_button
-global crc_label
+global data_console
 global data_textbox
 global qrcode_label
 
-ser = serial.Serial()
-serial_port_wait = 1000
+serial_port_wait = 20       # Interval (ms) at which the UI picks up frames read by 'engine'
+view_refresh = 200          # Shortest interval (ms) between updates of the data shown (see 'refresh_views()')
 
 
 
-class StatusWindow(tk.Toplevel):
+# Display state of one payload
+# Latest values (as text) of the fields defined in 'telemetry.SCHEMA'. Frames only store their data here: the status
+# window and QR code are updated from it together, at most every 'view_refresh' ms (see 'refresh_views()')
+class PayloadView(object):
     
-    def __init__(self):
-        global crc_label
-        global parsed_data
-        global rssi
+    def __init__(self, callsign):
+        self.callsign = callsign
+        self.values = [""] * len(telemetry.SCHEMA)
+        self.rssi = ""                  # RSSI: Signal Strength noted by receiver (dBm - Formula: -137 + dBm)
+        self.crc_ok = None
+        self.changed = False            # Data changed since it was last shown
+        self.moved = False              # New position since the last QR code
+    
+    
+    # Store data of a Reception from this payload
+    def update(self, reception):
+        if reception.rssi is not None:
+            self.rssi = str(reception.rssi)
+        
+        if reception.fields is not None:
+            self.values = list(reception.fields)
+            self.moved = True
+        elif reception.check_sum is not None:
+            self.values[17] = reception.check_sum
         
+        if reception.check_sum is not None:
+            self.crc_ok = reception.crc_ok
+        
+        self.changed = True
+
+
+
+# Window showing the latest data of the payload selected (there is only one: see 'show_status_window()')
+# Labels are only changed when the text they show changes
+class StatusWindow(tk.Toplevel):
+    
+    def __init__(self, view):
         # Create Window
         tk.Toplevel.__init__(self)
-        self.title("Status")
         self.geometry("210x530+100+100")
         
+        self.view = None
+        self.value_labels = {}          # Field (index in 'telemetry.SCHEMA') -> label showing its value
+        self.shown = {}                 # Field -> text shown
+        
         
         # Add UI components
         
         # Bigger Font
-        big_font = tkFont.Font(size=10)
+        big_font = self.big_font = tkFont.Font(size=10)
         
         
         # Frames
@@ -134,9 +185,9 @@ class StatusWindow(tk.Toplevel):
         
         
         # General Frame
-        callsign_label  = tk.Label(general_frame, font=big_font, textvariable=parsed_data[0][1])
-        sentence_label  = tk.Label(general_frame, font=big_font, textvariable=parsed_data[1][1])
-        time_label      = tk.Label(general_frame, font=big_font, textvariable=parsed_data[2][1])
+        callsign_label  = self.value_label(general_frame, 0)
+        sentence_label  = self.value_label(general_frame, 1)
+        time_label      = self.value_label(general_frame, 2)
         
         tk.Label(general_frame, font=big_font, text="Callsign:").grid(row=0, column=0, sticky='w')
         tk.Label(general_frame, font=big_font, text="Sentence #:").grid(row=1, column=0, sticky='w')
@@ -151,12 +202,12 @@ class StatusWindow(tk.Toplevel):
         
         
         # Tracking Frame
-        latitude_label  = tk.Label(tracking_frame, font=big_font, textvariable=parsed_data[3][1])
-        longitude_label = tk.Label(tracking_frame, font=big_font, textvariable=parsed_data[4][1])
-        altitude_label  = tk.Label(tracking_frame, font=big_font, textvariable=parsed_data[5][1])
-        v_speed_label   = tk.Label(tracking_frame, font=big_font, textvariable=parsed_data[6][1])
-        speed_label     = tk.Label(tracking_frame, font=big_font, textvariable=parsed_data[7][1])
-        course_label    = tk.Label(tracking_frame, font=big_font, textvariable=parsed_data[8][1])
+        latitude_label  = self.value_label(tracking_frame, 3)
+        longitude_label = self.value_label(tracking_frame, 4)
+        altitude_label  = self.value_label(tracking_frame, 5)
+        v_speed_label   = self.value_label(tracking_frame, 6)
+        speed_label     = self.value_label(tracking_frame, 7)
+        course_label    = self.value_label(tracking_frame, 8)
         
         tk.Label(tracking_frame, font=big_font, text="Latitude:").grid(row=0, column=0, sticky='w')
         tk.Label(tracking_frame, font=big_font, text="Longitude:").grid(row=1, column=0, sticky='w')
@@ -172,10 +223,10 @@ class StatusWindow(tk.Toplevel):
         speed_label.grid(row=4, column=1, sticky='e')
         course_label.grid(row=5, column=1, sticky='e')
         
-        tk.Label(tracking_frame, font=big_font, text=parsed_data[5][2]).grid(row=2, column=2, sticky='e')
-        tk.Label(tracking_frame, font=big_font, text=parsed_data[6][2]).grid(row=3, column=2, sticky='e')
-        tk.Label(tracking_frame, font=big_font, text=parsed_data[7][2]).grid(row=4, column=2, sticky='e')
-        tk.Label(tracking_frame, font=big_font, text=parsed_data[8][2]).grid(row=5, column=2, sticky='e')
+        tk.Label(tracking_frame, font=big_font, text=telemetry.SCHEMA[5][2]).grid(row=2, column=2, sticky='e')
+        tk.Label(tracking_frame, font=big_font, text=telemetry.SCHEMA[6][2]).grid(row=3, column=2, sticky='e')
+        tk.Label(tracking_frame, font=big_font, text=telemetry.SCHEMA[7][2]).grid(row=4, column=2, sticky='e')
+        tk.Label(tracking_frame, font=big_font, text=telemetry.SCHEMA[8][2]).grid(row=5, column=2, sticky='e')
         
         tracking_frame.columnconfigure(1, weight=1)
         tracking_frame.columnconfigure(2, weight=1)
@@ -183,10 +234,10 @@ class StatusWindow(tk.Toplevel):
          
         
         # Sensors Frame
-        ext_temp_label  = tk.Label(sensors_frame, font=big_font, textvariable=parsed_data[9][1])
-        int_temp_label  = tk.Label(sensors_frame, font=big_font, textvariable=parsed_data[10][1])
-        pressure_label  = tk.Label(sensors_frame, font=big_font, textvariable=parsed_data[11][1])
-        humidity_label  = tk.Label(sensors_frame, font=big_font, textvariable=parsed_data[12][1])
+        ext_temp_label  = self.value_label(sensors_frame, 9)
+        int_temp_label  = self.value_label(sensors_frame, 10)
+        pressure_label  = self.value_label(sensors_frame, 11)
+        humidity_label  = self.value_label(sensors_frame, 12)
         
         tk.Label(sensors_frame, font=big_font, text="Ext. Temp:").grid(row=0, column=0, sticky='w')
         tk.Label(sensors_frame, font=big_font, text="Int. Temp:").grid(row=1, column=0, sticky='w')
@@ -198,10 +249,10 @@ class StatusWindow(tk.Toplevel):
         pressure_label.grid(row=2, column=1, sticky='e')
         humidity_label.grid(row=3, column=1, sticky='e')
         
-        tk.Label(sensors_frame, font=big_font, text=parsed_data[9][2]).grid(row=0, column=2, sticky='e')
-        tk.Label(sensors_frame, font=big_font, text=parsed_data[10][2]).grid(row=1, column=2, sticky='e')
-        tk.Label(sensors_frame, font=big_font, text=parsed_data[11][2]).grid(row=2, column=2, sticky='e')
-        tk.Label(sensors_frame, font=big_font, text=parsed_data[12][2]).grid(row=3, column=2, sticky='e')
+        tk.Label(sensors_frame, font=big_font, text=telemetry.SCHEMA[9][2]).grid(row=0, column=2, sticky='e')
+        tk.Label(sensors_frame, font=big_font, text=telemetry.SCHEMA[10][2]).grid(row=1, column=2, sticky='e')
+        tk.Label(sensors_frame, font=big_font, text=telemetry.SCHEMA[11][2]).grid(row=2, column=2, sticky='e')
+        tk.Label(sensors_frame, font=big_font, text=telemetry.SCHEMA[12][2]).grid(row=3, column=2, sticky='e')
         
         sensors_frame.columnconfigure(1, weight=1)
         sensors_frame.columnconfigure(2, weight=1)
@@ -209,12 +260,12 @@ class StatusWindow(tk.Toplevel):
         
         
         # Status Frame
-        v_bat_label     = tk.Label(status_frame, font=big_font, textvariable=parsed_data[13][1])
-        sat_num_label   = tk.Label(status_frame, font=big_font, textvariable=parsed_data[14][1])
-        status_label    = tk.Label(status_frame, font=big_font, textvariable=parsed_data[15][1])
-        ack_label       = tk.Label(status_frame, font=big_font, textvariable=parsed_data[16][1])
-        crc_label       = tk.Label(status_frame, font=big_font, textvariable=parsed_data[17][1])
-        rssi_label      = tk.Label(status_frame, font=big_font, textvariable=rssi)
+        v_bat_label     = self.value_label(status_frame, 13)
+        sat_num_label   = self.value_label(status_frame, 14)
+        status_label    = self.value_label(status_frame, 15)
+        ack_label       = self.value_label(status_frame, 16)
+        crc_label       = self.value_label(status_frame, 17)
+        rssi_label      = self.rssi_label = tk.Label(status_frame, font=big_font)
         
         tk.Label(status_frame, font=big_font, text="Batt. Voltage:").grid(row=0, column=0, sticky='w') 
         tk.Label(status_frame, font=big_font, text="Satellite #:").grid(row=1, column=0, sticky='w')
@@ -230,13 +281,128 @@ class StatusWindow(tk.Toplevel):
         crc_label.grid(row=4, column=1, sticky='e')
         rssi_label.grid(row=5, column=1, sticky='e')
         
-        tk.Label(status_frame, font=big_font, text=parsed_data[13][2]).grid(row=0, column=2, sticky='w')
+        tk.Label(status_frame, font=big_font, text=telemetry.SCHEMA[13][2]).grid(row=0, column=2, sticky='w')
         tk.Label(status_frame, font=big_font, text="dBm").grid(row=5, column=2, sticky='w')
         
         status_frame.columnconfigure(2, weight=1)
         status_frame.grid(row=3, column=0, sticky='nws', padx=(5, 5), pady=(5, 5))
         
+        self.crc_label = crc_label
+        self.show(view)
+    
+    
+    # Label showing the value of field 'index' (see 'telemetry.SCHEMA')
+    def value_label(self, frame, index):
+        label = self.value_labels[index] = tk.Label(frame, font=self.big_font)
+        return label
+    
+    
+    # Show data of payload 'view' (only labels whose text changed are updated)
+    def show(self, view):
+        if view is not self.view:
+            self.view = view
+            self.shown = {}
+            self.title("Status - " + view.callsign if view.callsign else "Status")
+        
+        for index, label in self.value_labels.iteritems():
+            if self.shown.get(index) != view.values[index]:
+                label.config(text=view.values[index])
+                self.shown[index] = view.values[index]
+        
+        if self.shown.get("rssi") != view.rssi:
+            self.rssi_label.config(text=view.rssi)
+            self.shown["rssi"] = view.rssi
+        
+        # Color checksum depending on whether the last one received is correct
+        if view.crc_ok is not None and self.shown.get("crc_ok") != view.crc_ok:
+            self.crc_label.config(fg='dark green' if view.crc_ok else 'red')
+            self.shown["crc_ok"] = view.crc_ok
+        
+        view.changed = False
+
+
+
+# Live counters and latency of each stage frames go through (see 'metrics')
+# Opening it starts collecting metrics, which are also written to 'metrics.prom' (Prometheus' text format)
+class PerformanceWindow(tk.Toplevel):
+    
+    def __init__(self):
+        global metrics_file
+        
+        tk.Toplevel.__init__(self)
+        self.title("Performance")
+        self.geometry("420x460+150+150")
+        
+        if not metrics.METRICS.enabled:
+            metrics.METRICS.enable()
+            write_log(logging.INFO, "Collecting performance metrics (written to metrics.prom)")
+        if metrics_file is None:
+            metrics_file = metrics.MetricsFile("metrics.prom")
+            metrics_file.start()
+        
+        self.stats_label = tk.Label(self, font="TkFixedFont", justify=tk.LEFT, anchor='nw')
+        self.stats_label.grid(row=0, column=0, sticky='news', padx=(5, 5), pady=(5, 5))
+        tk.Button(self, text="Reset", command=metrics.METRICS.reset).grid(row=1, column=0, sticky='e', padx=(5, 5), pady=(0, 5))
         
+        self.columnconfigure(0, weight=1)
+        self.rowconfigure(0, weight=1)
+        
+        self.refresh()
+    
+    
+    # Show current metrics (every second while the window is open)
+    def refresh(self):
+        if not self.winfo_exists():
+            return
+        self.stats_label.config(text="\n".join(metrics.METRICS.describe()))
+        self.after(1000, self.refresh)
+
+
+
+# Charts of the history of the payload selected: altitude, vertical speed, temperatures, pressure and RSSI (see 'charts')
+# Redrawn every second while open, if anything new was received (or the window was resized)
+class ChartsWindow(tk.Toplevel):
+    
+    def __init__(self):
+        tk.Toplevel.__init__(self)
+        self.title("Charts")
+        self.geometry("520x680+150+150")
+        
+        self.charts = {}                # Field -> Chart
+        self.drawn = None               # What was drawn last (payload, rows received, size)
+        
+        for row, (name, title, unit, color) in enumerate(charts.FIELDS):
+            canvas = charts.chart_canvas(self)
+            canvas.grid(row=row, column=0, sticky='news', padx=(5, 5), pady=(5, 0))
+            self.rowconfigure(row, weight=1)
+            self.charts[name] = charts.Chart(canvas, title, unit, color)
+        
+        self.columnconfigure(0, weight=1)
+        
+        self.refresh()
+    
+    
+    # Draw history of the payload selected (every second while the window is open)
+    def refresh(self):
+        global payload_view
+        
+        if not self.winfo_exists():
+            return
+        
+        payload = find_payload(payload_view.callsign)
+        if payload is not None:
+            history = payload.history
+            drawn = (payload.callsign, history.total, self.winfo_width(), self.winfo_height())
+            if drawn != self.drawn:
+                self.title("Charts - " + payload.callsign)
+                received = history.window("received")
+                for name, chart in self.charts.iteritems():
+                    chart.draw(received, history.window(name))
+                self.drawn = drawn
+        
+        self.after(1000, self.refresh)
+
+
 
 class MainApplication(tk.Frame):
     
@@ -248,7 +414,7 @@ class MainApplication(tk.Frame):
         global command_raw
         global last_command
         global logger
-        global parsed_data
+        global repair_errors
         global tx_power
         
         global serial_port
@@ -258,6 +424,7 @@ class MainApplication(tk.Frame):
         global callsign_entry
         global command_listbox
         global connect_button
+        global data_console
         global data_textbox
         global qrcode_label
         
@@ -275,17 +442,46 @@ class MainApplication(tk.Frame):
         
         # File Menu
         self.file_menu = tk.Menu(self.menu_bar)
+        self.file_menu.add_command(label="Replay Flight...", underline=0, command=start_replay)
+        
+        # Replay Speed Submenu - how many times faster than it was received a flight is replayed
+        self.replay_speed_menu = tk.Menu(self.file_menu)
+        self.replay_speed_menu.add_radiobutton(label="Real Time", underline=0, value=1, variable=replay_speed)
+        self.replay_speed_menu.add_radiobutton(label="10x", underline=0, value=10, variable=replay_speed)
+        self.replay_speed_menu.add_radiobutton(label="100x", underline=1, value=100, variable=replay_speed)
+        self.replay_speed_menu.add_radiobutton(label="As Fast As Possible", underline=0, value=0, variable=replay_speed)
+        self.file_menu.add_cascade(label="Replay Speed", underline=7, menu=self.replay_speed_menu)
+        
+        self.file_menu.add_checkbutton(label="Record Raw Data", underline=7, offvalue=0, onvalue=1, variable=record_raw)
+        self.file_menu.add_separator()
         self.file_menu.add_command(label="Exit", underline=0, command=on_exit)
         
         # Receiver Menu
         self.capsule_menu = tk.Menu(self.menu_bar)
         self.capsule_menu.add_command(label="Capsule Status", underline=0, command=show_status_window)
+        self.capsule_menu.add_command(label="Charts", underline=1, command=show_charts_window)
+        
+        # Payload Submenu - payload shown in the main window and status window (rebuilt from payloads heard when opened)
+        self.payload_menu = tk.Menu(self.capsule_menu, postcommand=self.update_payload_menu)
+        self.capsule_menu.add_cascade(label="Payload", underline=0, menu=self.payload_menu)
         self.capsule_menu.add_separator()
         self.capsule_menu.add_command(label="Send Command", underline=0, command=send_command)
+        self.capsule_menu.add_separator()
+        
+        # Repair Submenu - how many flipped bits to repair in sentences with a wrong checksum
+        self.repair_menu = tk.Menu(self.capsule_menu)
+        self.repair_menu.add_radiobutton(label="Off", underline=1, value=0, variable=repair_errors)
+        self.repair_menu.add_radiobutton(label="1-bit Errors", underline=0, value=1, variable=repair_errors)
+        self.repair_menu.add_radiobutton(label="1 and 2-bit Errors", underline=6, value=2, variable=repair_errors)
+        self.capsule_menu.add_cascade(label="Repair Bad Sentences", underline=0, menu=self.repair_menu)
+        self.capsule_menu.add_separator()
+        self.capsule_menu.add_command(label="Receiver Statistics", underline=0, command=show_receiver_stats)
+        self.capsule_menu.add_command(label="Link Quality", underline=0, command=show_link_quality)
+        self.capsule_menu.add_command(label="Performance", underline=1, command=PerformanceWindow)
         
         # HabHub Menu
         self.tracking_menu = tk.Menu(self.menu_bar)
-        self.tracking_menu.add_command(label="Google Maps", underline=0, command=lambda : webbrowser.open("http://google.com/maps/place/" + parsed_data[3][1].get() + "," + parsed_data[4][1].get()))
+        self.tracking_menu.add_command(label="Google Maps", underline=0, command=lambda : webbrowser.open("http://google.com/maps/place/" + payload_view.values[3] + "," + payload_view.values[4]))
         self.tracking_menu.add_command(label="HabHub", underline=0, command=lambda : webbrowser.open("http://tracker.habhub.org/"))
         self.tracking_menu.add_separator()
         self.tracking_menu.add_checkbutton(label="Online", underline=0, offvalue=0, onvalue=1, variable=online)
@@ -316,6 +512,7 @@ class MainApplication(tk.Frame):
         serial_port_options.config(width=6)
         serial_port_options.bind('<Button-1>', update_serial_list)
         serial_port_options.grid(row=0, column=1, sticky='w', padx=(10, 0))
+        serial_port.trace("w", update_connect_button)
         
         # Serial Port Connect Button
         connect_button = tk.Button(left_frame, text="Connect", command=connect_serial)
@@ -348,6 +545,9 @@ class MainApplication(tk.Frame):
         data_textbox.configure(state=tk.DISABLED, width=64, height=16, wrap=tk.NONE)  # Make data uneditable
         data_textbox.grid(row=0, column=2, columnspan=5, padx=(20, 0), pady=(10, 10))
         
+        # Keep only the last lines, and redraw at most 10 times per second
+        data_console = console.Console(data_textbox, max_lines=2000, interval=100)
+        
         #data_scrollbar = tk.Scrollbar(self.master, command=data_textbox.yview)
         #data_scrollbar.grid()
         
@@ -430,6 +630,19 @@ class MainApplication(tk.Frame):
         self.after(100, get_serial_data)
             
 
+    # List every payload heard in the Payload menu
+    def update_payload_menu(self):
+        global selected_payload
+        
+        payloads = all_payloads()
+        self.payload_menu.delete(0, 'end')
+        for payload in payloads:
+            self.payload_menu.add_radiobutton(label=payload.describe(), value=payload.callsign, variable=selected_payload)
+        
+        if not payloads:
+            self.payload_menu.add_command(label="No payloads heard yet", state=tk.DISABLED)
+    
+    
     # Show information about author and program
     def show_about(self):
         tkMessageBox.showinfo(title=ABOUT_MESSAGE[0], message=ABOUT_MESSAGE[1])
@@ -454,55 +667,76 @@ def on_select_command(*args):
     command_desc.set(GENERAL_COMMANDS[index][2])
 
 
-# Establish serial connection with port selected in 'serial_port'
+# Establish serial connection with port selected in 'serial_port' (or disconnect it if it is already connected)
+# Several receivers can be connected at once: frames they all receive are merged by 'engine'
 def connect_serial(*args):
-    global ser
+    global engine
+    global port_monitor
+    global receiver_identities
     global serial_port
-    close_serial()
     
-    if serial_port.get():
+    if serial_port.get() in engine.readers:
+        close_serial(serial_port.get())
+    
+    elif serial_port.get():
         write_log(logging.INFO, "Connecting to serial port " + serial_port.get() + "...")
         try: 
-            ser = serial.Serial(serial_port.get(), timeout=None, write_timeout=5)
+            engine.connect(serial_port.get())
             write_log(logging.INFO, "Connected!")
-            return
+            
+            # Remember which device this is, to find it again if it is unplugged
+            port = port_monitor.ports.get(serial_port.get())
+            if port is not None:
+                receiver_identities[port.device] = port.identity
         except:
             write_log(logging.ERROR, "Error while connecting to port")
             tkMessageBox.showerror(title=SERIAL_PORT_START_ERROR[0], message=SERIAL_PORT_START_ERROR[1])
     
     else:
         tkMessageBox.showerror(title=SERIAL_PORT_SELECT_ERROR[0], message=SERIAL_PORT_SELECT_ERROR[1])
+    
+    update_connect_button()
+
+
+# Show whether the button will connect or disconnect the port selected in 'serial_port'
+def update_connect_button(*args):
+    global connect_button
+    global engine
+    global serial_port
+    
+    connect_button.config(text="Disconnect" if serial_port.get() in engine.readers else "Connect")
         
         
-# Get a list of all available serial ports
+# Get a list of all available serial ports (as 'ports.PortInfo', kept up to date by 'port_monitor')
 def get_serial_ports(*args):
-    if sys.platform.startswith('win'):
-        ports = ['COM%s' % (i + 1) for i in range(256)]
-    
-    elif sys.platform.startswith('linux') or sys.platform.startswith('cygwin'):
-        # Excludes current terminal "/dev/tty"
-        ports = glob.glob('/dev/tty[A-Za-z]*')
+    global port_monitor
+    return port_monitor.ports.values()
+
+
+# Open status window showing current data from the selected payload (or bring it to the front if it is open)
+def show_status_window(*args):
+    global payload_view
+    global status_window
     
-    elif sys.platform.startswith('darwin'):
-        ports = glob.glob('/dev/tty.*')
+    if status_window is not None and status_window.winfo_exists():
+        status_window.show(payload_view)
+        status_window.deiconify()
+        status_window.lift()
+        return
     
-    else:
-        raise EnvironmentError('Unsupported platform')
+    status_window = StatusWindow(payload_view)
 
-    result = []
-    for port in ports:
-        try:
-            s = serial.Serial(port)
-            s.close()
-            result.append(port)
-        except (OSError, serial.SerialException):
-            pass
-    return result
 
-
-# Open status window showing current data from capsule
-def show_status_window(*args):
-    StatusWindow()
+# Open charts of the selected payload's history (or bring them to the front if they are open)
+def show_charts_window(*args):
+    global charts_window
+    
+    if charts_window is not None and charts_window.winfo_exists():
+        charts_window.deiconify()
+        charts_window.lift()
+        return
+    
+    charts_window = ChartsWindow()
 
 
 # Send command to capsule (through transceiver)
@@ -510,8 +744,9 @@ def send_command(*args):
     global logger
     
     global command_raw
+    global engine
     global last_command
-    global ser
+    global selected_payload
     global tx_power
     
     # Do nothing if command is empty
@@ -519,7 +754,7 @@ def send_command(*args):
         return
     
     # Let user know if not connected to receiver
-    if not ser.is_open:
+    if not engine.connected:
         tkMessageBox.showerror(SERIAL_PORT_NOT_CONNECTED[0], SERIAL_PORT_NOT_CONNECTED[1])
         return
         
@@ -528,13 +763,9 @@ def send_command(*args):
     
     last_command = command_raw.get()
     
-    write_log(logging.INFO, "Sending command '" + command_raw.get() + "' at " + tx_power.get() + " dBm")
-    
-    try:
-        ser.write(tx_power.get() + ";" + command_raw.get() + "\n")
-        
-    except:
-        write_log(logging.ERROR, "Error sending command!")
+    # Sent in the background after the next sentence received, and again until the payload shown confirms it (progress
+    # is logged, see 'on_ingest_event()')
+    engine.send_command(tx_power.get(), command_raw.get(), selected_payload.get() or None)
     
     
 
@@ -546,178 +777,319 @@ def update_serial_list(*args):
     global serial_port_options
     global port_list
     
-    serial_port.set("")
     port_list = list(get_serial_ports())
     serial_port_options['menu'].delete(0, 'end')
     
+    # Selected port was unplugged
+    if serial_port.get() not in [port.device for port in port_list]:
+        serial_port.set("")
+    
     # Add empty entry (aesthetics)
     serial_port_options['menu'].add_command(label="", command=tk._setit(serial_port, ""))
     
     # Add available ports to OptionMenu list
     for port in port_list:
-        serial_port_options['menu'].add_command(label=port, command=tk._setit(serial_port, port))
+        serial_port_options['menu'].add_command(label=port.label(), command=tk._setit(serial_port, port.device))
     
     logger.info("Updated port list")
 
 
-# Get data from receiver connected through serial port (and save last valid sentence)
-# Sentence from receiver has the following format (with sentence from capsule and RSSI of receiver):
-# [SENTENCE];[RSSI]
+# Show serial ports plugged in/unplugged (reported by 'port_monitor'), and reconnect receivers that were unplugged
+# while connected as soon as they are plugged back in (even if they come back under a different name)
+def check_serial_ports(*args):
+    global engine
+    global lost_receivers
+    global port_monitor
+    global receiver_identities
+    
+    events = port_monitor.poll()
+    if not events:
+        return
+    
+    for event, port in events:
+        if event == "removed":
+            write_log(logging.INFO, "Serial port removed: " + port.label())
+        
+        elif event == "added":
+            write_log(logging.INFO, "Serial port added: " + port.label())
+            
+            if port.identity in lost_receivers and port.device not in engine.readers:
+                del lost_receivers[port.identity]
+                try:
+                    engine.connect(port.device)
+                    receiver_identities[port.device] = port.identity
+                    write_log(logging.INFO, "Reconnected to receiver on " + port.device)
+                except:
+                    write_log(logging.ERROR, "Error while reconnecting to " + port.device)
+    
+    update_serial_list()
+    update_connect_button()
+
+
+# Process data received by 'engine' (every 'serial_port_wait' ms)
+# Frames are read from the serial port in the background; results are shown through 'on_ingest_event()'
 def get_serial_data(*args):
     global app
-    global data_textbox
-    global last_data_sentence
+    global engine
+    global replay_engine
+    
+    engine.poll()
+    if replay_engine is not None:
+        replay_engine.poll()
+    check_serial_ports()
+    check_replay()
+    show_qrcode()
+    app.after(serial_port_wait, get_serial_data)
+
+
+# Replay a recorded flight (raw capture, GroundStation.log or sentences.log) at 'replay_speed'
+# Stops the replay instead if one is running. Recordings are played into an engine of their own ('replay_engine'), shown
+# like live frames but never uploaded, logged to sentences.log, archived or taken as answers to commands. Its payloads
+# are kept until the next replay
+def start_replay(*args):
+    global engine
     global logger
-    global ser
+    global replay_engine
+    global replay_speed
+    global replayer
     
-    data = ""
-    if ser.is_open:
-        try:
-            data = ser.readline(ser.inWaiting())
-        except:
-            logger.error("Error while attempting to read serial port data")
-            if not tkMessageBox.askretrycancel(title=SERIAL_PORT_READ_ERROR[0], message=SERIAL_PORT_READ_ERROR[1], icon="error"):
-                close_serial()
+    if replayer is not None:
+        replayer.stop()
+        write_log(logging.INFO, "Replay stopped")
+        return
     
-    if data:
-        last_data_sentence = data
-        parse_data()
-        
-        # Send data to HabHub tracker (if online and data is valid)
-        if online.get() and len(re.split(',|\*', data.split(";")[0] )) == len(parsed_data):
-            send_data(data.split(";")[0]);
+    path = tkFileDialog.askopenfilename(title="Replay Flight", filetypes=[("Recordings", "*.cap *.log"), ("All Files", "*")])
+    if not path:
+        return
+    
+    try:
+        recording = replay.open_recording(path)
+    except IOError as e:
+        write_log(logging.ERROR, "Couldn't open recording: " + str(e))
+        return
     
+    if replay_engine is not None:
+        replay_engine.stop(1)
+    replay_engine = ingest.IngestEngine(engine.callsign, logger, None, ":memory:", engine.repair_errors, live=False)
+    replay_engine.subscribe(on_ingest_event)
+    replay_engine.start()
     
-    # For some reason, pySerial needs an entire second to figure out if there is new data in the buffer...
-    # Very annoying and time consuming...
-    app.after(1000, get_serial_data)
+    replayer = replay.Replayer(recording, replay_engine.frames, replay_speed.get())
+    replayer.start()
+    write_log(logging.INFO, "Replaying " + path + (" at %gx" % replay_speed.get() if replay_speed.get() else " as fast as possible"))
 
 
-# Update stored data from last data sentence
-def parse_data(*args):
-    global last_data_sentence
-    global parsed_data
-    global sent_logger
+# Report end of replay (if one is running)
+def check_replay(*args):
+    global replay_engine
+    global replayer
     
-    # Grab and remove RSSI from data string
-    try:
-        rssi.set(last_data_sentence.split(";")[1].rstrip())
-        last_data_sentence = last_data_sentence.split(";")[0]
-    except:
-        write_log(logging.INFO, "Received data: '" + last_data_sentence.strip("\n") + "'")
-        write_log(logging.INFO, " -> Message length: " + str(len(last_data_sentence)))
-        write_log(logging.INFO, " -> Wrong message format!")
+    if replayer is None or not replayer.done.is_set():
+        return
+    
+    # Frames read but not shown yet
+    if not replay_engine.frames.empty() or replay_engine.aggregator.next_due() is not None:
         return
     
-    write_log(logging.INFO, "Received data: '" + last_data_sentence.strip("\n") + "'")
-    write_log(logging.INFO, " -> RSSI: " + rssi.get() + " dBm")
-    write_log(logging.INFO, " -> Message length: " + str(len(last_data_sentence)))
+    if replayer.error is not None:
+        write_log(logging.ERROR, "Error while reading recording: " + str(replayer.error))
+    write_log(logging.INFO, "Replay finished (" + str(replayer.frame_count) + " frames)")
+    replayer = None
+
+
+# Start/stop recording everything read from the receivers to a raw capture file (which can be replayed)
+def toggle_record_raw(*args):
+    global engine
+    global record_raw
+    
+    if record_raw.get():
+        path = time.strftime("capture-%Y%m%d-%H%M%S.cap")
+        engine.set_capture(receiver.CaptureWriter(path))
+        write_log(logging.INFO, "Recording raw data to " + path)
+    else:
+        engine.set_capture(None)
+        write_log(logging.INFO, "Stopped recording raw data")
+
+
+# Show events from 'engine' (called from 'engine.poll()')
+def on_ingest_event(event, data):
+    global engine
+    global lost_receivers
+    global port_monitor
+    global receiver_identities
     
-    data = re.split(',|\*', last_data_sentence)
+    if event == "frame":
+        start = metrics.METRICS.start()
+        show_reception(data)
+        metrics.METRICS.observe("display", start)
     
+    elif event == "upload":
+        write_log(logging.INFO if data[2] else logging.ERROR, ingest.describe_upload(data))
     
-    try:
-        if len(data) != len(parsed_data): raise ValueError("Wrong message format!")
-        
-        for x in xrange(0, len(data)):
-            parsed_data[x][1].set(data[x])
-        
-        sent_logger.info(last_data_sentence)
+    elif event == "dropped":
+        write_log(logging.INFO, "Dropped " + str(data[1]) + " bytes of unframed data (" + data[0] + ")")
+    
+    elif event == "command":
+        write_log(logging.ERROR if data.state == uplink.FAILED else logging.INFO, data.describe())
+    
+    # Sentences lost, tracker restarted, or summary of the link with a payload
+    elif event == "link":
+        write_log(logging.INFO if data[1] == "report" else logging.WARNING, ingest.describe_link(data))
+    
+    # Reader of one of the ports stopped because of an error
+    elif event == "read_error":
+        port = data[0]
         
-    except:
-        write_log(logging.INFO, " -> Wrong message format!")
+        # Receiver was unplugged: reconnect to it once it is plugged back in (see 'check_serial_ports()')
+        port_monitor.refresh()
+        if port not in port_monitor.ports and port in receiver_identities:
+            write_log(logging.ERROR, "Receiver on " + port + " was unplugged. Waiting for it to be plugged back in...")
+            lost_receivers[receiver_identities.pop(port)] = port
+            close_serial(port)
         
-        # Try to get checksum
-        if (len(last_data_sentence.split("*")) == 2):
-            parsed_data[17][1].set(last_data_sentence.split("*")[1])
+        elif tkMessageBox.askretrycancel(title=SERIAL_PORT_READ_ERROR[0], message=port + ": " + SERIAL_PORT_READ_ERROR[1], icon="error"):
+            engine.restart_reader(port)
         else:
-            write_log(logging.INFO, " -> No checksum found")
+            close_serial(port)
 
 
-# Calculate ccrc16-ccitt checksum
-def calc_crc(data):
-    ccitt = crcmod.predefined.Crc('crc-ccitt-false')
-    ccitt.update(data)
-    return str(format(ccitt.crcValue, 'x')).zfill(4)
+# Update stored data from a frame processed by 'engine'
+# Sentence from receiver has the following format (with sentence from capsule and RSSI of receiver):
+# [SENTENCE];[RSSI]
+# Data is shown in the view of the payload the sentence belongs to (by callsign). Sentences that can't be matched to a
+# payload heard before are only logged
+def show_reception(reception):
+    global engine
+    global payload_view
+    global selected_payload
+    
+    for line in ingest.describe(reception):
+        write_log(logging.INFO, line)
+    
+    payload = reception.payload or find_payload(reception.sentence.split(",", 1)[0])
+    if payload is None:
+        return
+    
+    view = get_payload_view(payload.callsign)
+    view.update(reception)
+    
+    # Show first payload heard
+    if not selected_payload.get():
+        selected_payload.set(payload.callsign)
+    
+    # Shown along with whatever else arrives before the next refresh
+    if view is payload_view:
+        schedule_refresh()
 
 
-# Check crc16-ccitt checksum
-def check_crc(*args):
-        global crc_label
-        global logger
-        global parsed_data
-        global last_data_sentence
-        
-        check_sum = calc_crc(last_data_sentence.split('*')[0]).upper()
+# Payload with 'callsign' heard live or in the flight replayed (None if it hasn't been heard)
+def find_payload(callsign):
+    global engine
+    global replay_engine
+    
+    payload = engine.payloads.get(callsign)
+    if payload is None and replay_engine is not None:
+        payload = replay_engine.payloads.get(callsign)
+    return payload
+
+
+# Every payload heard live, followed by those of the flight replayed
+def all_payloads():
+    global engine
+    global replay_engine
+    
+    payloads = list(engine.payloads)
+    if replay_engine is not None:
+        payloads.extend(payload for payload in replay_engine.payloads if payload.callsign not in engine.payloads)
+    return payloads
+
+
+# Refresh data shown (see 'refresh_views()') within 'view_refresh' ms, unless already scheduled
+def schedule_refresh():
+    global app
+    global view_refresh
+    global view_refresh_scheduled
+    
+    if view_refresh_scheduled is None:
+        view_refresh_scheduled = app.after(view_refresh, refresh_views)
+
+
+# Show data of the selected payload stored since the last refresh: in the status window, and as a QR code if it moved
+# Frames arriving in a burst are shown in a single update
+def refresh_views():
+    global payload_view
+    global status_window
+    global view_refresh_scheduled
+    
+    view_refresh_scheduled = None
+    
+    if status_window is not None and status_window.winfo_exists() and (payload_view.changed or status_window.view is not payload_view):
+        status_window.show(payload_view)
+    
+    # Only sentences that could be parsed have a (new) position
+    if payload_view.moved:
+        payload_view.moved = False
+        update_qrcode()
+
+
+# View of payload with 'callsign' (created if needed). Views of payloads forgotten by 'engine' are dropped
+def get_payload_view(callsign):
+    global payload_views
+    global selected_payload
+    
+    view = payload_views.get(callsign)
+    if view is None:
+        for other in payload_views.keys():
+            if find_payload(other) is None and other != selected_payload.get():
+                del payload_views[other]
         
-        if check_sum == parsed_data[17][1].get().upper():
-            write_log(logging.INFO, " -> Correct Checksum: " + check_sum)
-            try:
-                crc_label.config(fg='dark green')
-            except:
-                return
-                
-        else:
-            write_log(logging.INFO, " -> Incorrect Checksum: Recv = " + parsed_data[17][1].get() + ", Calc = " + check_sum)
-            
-            try:
-                crc_label.config(fg='red')
-            except:
-                return
+        view = payload_views[callsign] = PayloadView(callsign)
+    
+    return view
+
+
+# Show payload selected in 'selected_payload' in the main window and status window
+def select_payload(*args):
+    global payload_view
+    
+    payload_view = get_payload_view(selected_payload.get())
+    write_log(logging.INFO, "Showing payload: " + payload_view.callsign)
+    payload_view.moved = True
+    refresh_views()
 
 
 # Set callsign to value in callsign_temp
 def set_callsign(*args):
     global callsign
     global callsign_temp
+    global engine
     
     if len(callsign_temp.get()) > 3:
         callsign.set(callsign_temp.get())
+        engine.callsign = callsign.get()
         write_log(logging.INFO, "Set callsign to: " + callsign.get())
     else:
         tkMessageBox.showerror(title=CALLSIGN_LENGTH_ERROR[0], message=CALLSIGN_LENGTH_ERROR[1])
 
 
-# Send data to HabHub tracker
-def send_data(*args):
-    global callsign
-    global last_data_sentence
-    global logger
-    
-    write_log(logging.INFO, "Sending data... ")
-    try:
-        resp = ""
-        while "OK" not in resp:
-            url = 'http://habitat.habhub.org/transition/payload_telemetry'
-            params = "callsign=" + callsign.get() + "&string=%24%24" + last_data_sentence + "\n&string_type=ascii&metadata={}"
-            f = urllib.urlopen(url, params)
-            resp = f.read()
-            logger.info("Response: " + resp)
-            time.sleep(0.5)
-        
-        write_log(logging.INFO, "Sent Data!")
-        
-        
-    except:
-        write_log(logging.ERROR, "Error sending data")
-        if tkMessageBox.askretrycancel(title=CONNECTION_ERROR[0], message=CONNECTION_ERROR[1]):
-            send_data()
-        else:
-            online = False
-                
-                
-# Updates qrcode_label with new QR Code link. Runs when me get a new message
+# Ask for a QR Code of the position shown. Runs when we get a new position
+# The code is rendered by 'qr_renderer' in the background and shown by 'show_qrcode()'
 def update_qrcode(*args):
-    global app
-    global qrcode_label
-    global parsed_data
-
-    #qrcode = pyqrcode.create('http://google.com/maps/place/' + parsed_data[3][1].get() + "," + parsed_data[4][1].get())
-    qrcode = pyqrcode.create('geo:' + parsed_data[3][1].get() + "," + parsed_data[4][1].get())
+    global payload_view
+    global qr_renderer
+    
+    qr_renderer.request(payload_view.values[3], payload_view.values[4])
 
-    # Create XBM image
-    qr_xbm = qrcode.xbm(scale=2)
 
+# Update qrcode_label with the latest QR Code rendered (if there is a new one)
+def show_qrcode(*args):
+    global qrcode_label
+    global qr_renderer
+    
+    qr_xbm = qr_renderer.poll()
+    if qr_xbm is None:
+        return
+    
     # Create Tkinter Bitmap
     qr_bmp = tk.BitmapImage(data=qr_xbm)
 
@@ -729,12 +1101,15 @@ def update_qrcode(*args):
 # Toggle whether data is send to HabHub or not (and change button text/color)
 def toggle_online(*args):
     global app
+    global engine
     global logger
     global online
     
+    engine.set_online(online.get())
+    
     # Going online
     if online.get():
-        write_log(logging.INFO, "Going online")
+        write_log(logging.INFO, "Going online (" + str(engine.upload_outbox.backlog) + " sentences waiting to be sent)")
         app.online_checkbutton.config(text="Online", fg="dark green")
             
     # Going offline
@@ -743,13 +1118,10 @@ def toggle_online(*args):
         app.online_checkbutton.config(text="Offline", fg="red")
         
         
-# Write given text to 'data_textbox'
+# Write given text to 'data_textbox' (shown on the next redraw of 'data_console')
 def write_textbox(text):
-    global data_textbox
-    data_textbox.config(state=tk.NORMAL)
-    data_textbox.insert(tk.END, text + "\n")
-    data_textbox.config(state=tk.DISABLED)
-    scroll_bottom()
+    global data_console
+    data_console.write(text)
     
 
 # Write given text to both 'data_textbox' and logger
@@ -760,28 +1132,65 @@ def write_log(level, text):
     write_textbox(text)
     
     
-# Scroll to bottom of textbox
-def scroll_bottom(*args):
-    global data_textbox
-    data_textbox.see(tk.END)
+# Set how many flipped bits 'engine' repairs in sentences with a wrong checksum
+def set_repair_errors(*args):
+    global engine
+    global repair_errors
+    
+    engine.repair_errors = repair_errors.get()
 
 
-# Close serial if it is open
-def close_serial(*args):
-    global ser
+# Show frames received and RSSI of every receiver connected so far
+def show_receiver_stats(*args):
+    global engine
     
-    if ser.is_open:
-        write_log(logging.INFO, "Closing Serial Port")
-        ser.close()
+    lines = [stats.describe() for stats in engine.aggregator.stats.itervalues()]
+    tkMessageBox.showinfo(title="Receiver Statistics", message="\n".join(lines) or "No receivers connected yet.")
+
+
+# Show sentences lost, checksum failures and RSSI of each payload heard (see 'linkquality')
+def show_link_quality(*args):
+    lines = []
+    for payload in all_payloads():
+        lines.append(payload.callsign + ":")
+        lines.extend(" - " + line for line in payload.link.describe())
+    tkMessageBox.showinfo(title="Link Quality", message="\n".join(lines) or "No payloads heard yet.")
+
+
+# Close serial port 'port' (all ports if None) if it is open
+def close_serial(port=None):
+    global engine
+    
+    if port is None and engine.connected:
+        write_log(logging.INFO, "Closing Serial Ports")
+    elif port in engine.readers:
+        write_log(logging.INFO, "Closing Serial Port " + port)
+    engine.disconnect(port)
+    update_connect_button()
 
 
 # On exit ask the user to confirm and close the serial port before quitting
 def on_exit(*args):
     global app
+    global engine
     global logger
+    global metrics_file
+    global port_monitor
+    global qr_renderer
+    global replay_engine
+    global replayer
     
     if tkMessageBox.askokcancel("Quit", "Are you sure you want to exit?"):
         close_serial()
+        engine.stop(1)
+        if replayer is not None:
+            replayer.stop()
+        if replay_engine is not None:
+            replay_engine.stop(1)
+        qr_renderer.stop(1)
+        port_monitor.stop(1)
+        if metrics_file is not None:
+            metrics_file.stop(1)
         logger.info("Quitting...")
         app.quit()
 
@@ -789,45 +1198,51 @@ def on_exit(*args):
 # Start program
 def main():
     global app
-    global last_data_sentence
+    global engine
     global logger
+    global metrics_file
     global online
-    global parsed_data
-    global rssi
+    global payload_view
+    global payload_views
+    global lost_receivers
+    global port_monitor
+    global qr_renderer
+    global receiver_identities
+    global record_raw
+    global repair_errors
+    global replay_engine
+    global replay_speed
+    global replayer
+    global selected_payload
     global sent_logger
+    global status_window
+    global charts_window
+    global view_refresh_scheduled
     
-    # Start and configure logging
-    logger = logging.getLogger(__name__)
-    logger.setLevel(logging.INFO)
-    
-    file_handler = logging.FileHandler('GroundStation.log')
-    file_handler.setLevel(logging.INFO)
-    
-    console_handler = logging.StreamHandler(sys.stdout)
-    console_handler.setLevel(logging.INFO)
-    
-    log_formatter = logging.Formatter("%(asctime)s [%(levelname)s] %(message)s")
-    file_handler.setFormatter(log_formatter)
-    console_handler.setFormatter(log_formatter)
-    
-    logger.addHandler(file_handler)
-    logger.addHandler(console_handler)
+    # Start and configure logging (Ground Station log and sentence log)
+    logger, sent_logger = ingest.setup_logging(__name__)
     
+    logger.info("Starting Argo 2 Ground Station")
     
-    # Start and configure sentence logging
-    sent_logger = logging.getLogger('sentence')
-    sent_logger.setLevel(logging.INFO)
-    
-    file_handler2 = logging.FileHandler('sentences.log')
-    file_handler2.setLevel(logging.INFO)
     
-    log_formatter2 = logging.Formatter("%(message)s")
-    file_handler2.setFormatter(log_formatter2)
+    # Start headless core (serial port, parsing, HabHub uploads - sentences not yet uploaded are kept in 'outbox.db')
+    # Valid sentences are also archived by payload in 'archive' (see 'archive.py')
+    engine = ingest.IngestEngine("PAN1", logger, sent_logger, 'outbox.db', archive_path='archive')
+    engine.subscribe(on_ingest_event)
+    engine.start()
     
-    sent_logger.addHandler(file_handler2)
+    # Render location QR codes in the background
+    qr_renderer = qrrender.QRRenderer()
+    qr_renderer.start()
     
+    # Keep list of serial ports up to date in the background (receivers are found by their device identity when they are
+    # plugged back in)
+    port_monitor = ports.PortMonitor(interval=0.5)
+    port_monitor.start()
+    receiver_identities = {}        # port -> identity of the receiver connected to it
+    lost_receivers = {}             # identity -> port of receivers unplugged while connected
     
-    logger.info("Starting Argo 2 Ground Station")
+    metrics_file = None             # Writes performance metrics to a file once they are being collected
     
     
     # Initialize window
@@ -839,31 +1254,22 @@ def main():
     # Initialize variables
     online = tk.IntVar()
     
-    # List containing parsed data from the capsule/receiver in form (name, value, unit)
-    # These are saved as 'StringVar' so that widgets update automatically when these are changed
-    # Example: ARGO2,10000,22:22:22,-92.1232322,-90.2322323,30000,-12.0,12.0,32.4,-20.25,-10.1,300.0,56.4,4.32,10,5,1*b762;-67
-    parsed_data = [
-                   ["callsign", tk.StringVar(), ""],        # 0.  Name of Capsule
-                   ["sent_id", tk.StringVar(), ""],         # 1.  Sentence ID (number)    
-                   ["time", tk.StringVar(), ""],            # 2.  Time (hh:mm:ss)
-                   ["latitude", tk.StringVar(), ""],        # 3.  Latitude (decimal)
-                   ["longitude", tk.StringVar(), ""],       # 4.  Longitude (decimal)
-                   ["altitude", tk.StringVar(), "m"],       # 5.  Altitude (meters)
-                   ["v_speed", tk.StringVar(), "m/s"],      # 6.  Vertical speed (meters per second)
-                   ["speed", tk.StringVar(), "m/s"],        # 7.  Speed (meters per second)
-                   ["course", tk.StringVar(), "deg"],       # 8.  Course (degrees)
-                   ["ext_temp", tk.StringVar(), "C"],       # 9.  External temperature (Celsius)
-                   ["int_temp", tk.StringVar(), "C"],       # 10. Internal temperature (Celsius)
-                   ["pressure", tk.StringVar(), "hPa"],     # 11. Pressure (hPa)
-                   ["humidity", tk.StringVar(), "%"],       # 12. Humidity (percent)
-                   ["v_bat", tk.StringVar(), "V"],          # 13. Battery voltage (volts)
-                   ["sat_num", tk.StringVar(), ""],         # 14  Satellite Number (#)
-                   ["status", tk.StringVar(), ""],          # 15. Status/Mode of Capsule (0: stby, 1: >0m, 2: >5,000m, 3: >10,000m, 4: >20,000m, 5: descending, 6: <3,000m descending)
-                   ["ACK", tk.StringVar(), ""],             # 16. Acknowledge Message Received (0: no messages received, 1: message received)
-                   ["crc", tk.StringVar(), ""]              # 17. Checksum (crc16-ccitt - 4 characters)
-    ]
-    
-    rssi = tk.StringVar()                                   # RSSI: Signal Strength noted by receiver (dBm - Formula: -137 + dBm)
+    repair_errors = tk.IntVar()     # Max. flipped bits to repair in sentences with a wrong checksum (0: off)
+    repair_errors.set(1)
+    
+    record_raw = tk.IntVar()        # Whether raw data read from the receivers is recorded
+    replay_speed = tk.DoubleVar()   # Times faster than real time flights are replayed (0: as fast as possible)
+    replay_speed.set(1)
+    replayer = None
+    replay_engine = None            # Engine the flight replayed (last) was played into (see 'start_replay()')
+    
+    # Parsed data from each payload (by callsign), and the one shown in the main window (and status window)
+    payload_views = {}
+    selected_payload = tk.StringVar()
+    payload_view = PayloadView("")
+    status_window = None
+    charts_window = None
+    view_refresh_scheduled = None
     
     
     # Initialize main window
@@ -882,8 +1288,9 @@ def main():
     # Setup bindings/protocols/callbacks
     root.protocol("WM_DELETE_WINDOW", on_exit)      # Run 'on_exit()' when user clicks "Close" button
     online.trace("w", toggle_online)                # Run 'toggle_online()' when value of 'online' changes
-    parsed_data[17][1].trace('w', check_crc)        # Run 'check_crc()' when we get a new message
-    parsed_data[17][1].trace('w', update_qrcode)    # Run 'udpate_qrcode()' when we get a new message
+    repair_errors.trace("w", set_repair_errors)     # Run 'set_repair_errors()' when value of 'repair_errors' changes
+    selected_payload.trace("w", select_payload)     # Run 'select_payload()' when a payload is selected
+    record_raw.trace("w", toggle_record_raw)        # Run 'toggle_record_raw()' when value of 'record_raw' changes
 
 
     # Start main update/window loop
@@ -0,0 +1,490 @@
+'''
+Argo 2 Ground Station - Archive
+
+Tomas Manterola
+
+Flight archive: every valid sentence received, stored as typed columns (one binary file per field, fixed width, little
+endian) so that questions about a flight don't need the whole sentence log to be parsed again. Each payload (callsign)
+has its own folder in the archive:
+
+    archive/ARGO2/received.col      Receive time (Unix time, float64)
+    archive/ARGO2/altitude.col      Altitude (float32)
+    ...
+    archive/ARGO2/rows              Number of rows written completely
+    archive/ARGO2/received.idx      Sparse indexes: receive time and sentence ID of every 'stride'-th row
+    archive/ARGO2/sent_id.idx
+
+Columns can be memory-mapped with NumPy ('Archive.column()' does it if NumPy is installed). Rows are only appended;
+they count once their columns and indexes have been synced to disk and 'rows' updated, so a crash can only lose rows
+appended after the last commit (they are dropped when the archive is opened again). 'FlightArchive' commits from a
+thread of its own every second, so that receiving never waits on the disk.
+
+Ranges of receive time and sentence ID are found with a binary search of the sparse index and then of one block of the
+column, so their cost is O(log n) plus the size of the result. Sentence IDs only grow until the tracker restarts: each
+restart starts a new segment, searched separately.
+
+    python archive.py archive/ARGO2 --since "2018-06-09 14:00" --until "2018-06-09 14:05"
+    python archive.py archive/ARGO2 --ids 100-200 --columns sent_id,altitude,rssi
+
+'''
+
+
+import argparse
+import bisect
+import collections
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+
+# NumPy is optional (columns are memory-mapped as NumPy arrays if it is installed)
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# Columns stored, as (name, struct format). Telemetry fields (see 'telemetry.SCHEMA') keep their names; 'time' is
+# stored as seconds since midnight (-1 if invalid) and 'status' as text
+COLUMNS = [
+    ("received",    "d"),       # Receive time (Unix time)
+    ("rssi",        "h"),       # dBm
+    ("sent_id",     "I"),
+    ("time",        "i"),
+    ("latitude",    "d"),
+    ("longitude",   "d"),
+    ("altitude",    "f"),
+    ("v_speed",     "f"),
+    ("speed",       "f"),
+    ("course",      "f"),
+    ("ext_temp",    "f"),
+    ("int_temp",    "f"),
+    ("pressure",    "f"),
+    ("humidity",    "f"),
+    ("v_bat",       "f"),
+    ("sat_num",     "h"),
+    ("status",      "8s"),
+    ("ACK",         "h"),
+]
+
+NUMPY_TYPES = {"d": "<f8", "f": "<f4", "i": "<i4", "I": "<u4", "h": "<i2", "8s": "S8"}
+
+# Sparse index entry: value, row and whether a new segment starts at the row
+INDEX_ENTRY = struct.Struct("<dQB")
+ROWS = struct.Struct("<Q")
+
+# Seconds between commits of 'FlightArchive'
+COMMIT_INTERVAL = 1.0
+
+
+
+# Sparse index of a column whose values don't decrease within a segment
+# Holds (value, row) of every 'stride'-th row and of the first row of every segment, in memory and in 'path'. Entries of
+# rows past 'rows' (not committed) are ignored, and removed from the file if it is opened for writing.
+class SparseIndex(object):
+
+    def __init__(self, path, rows, writable=True):
+        self.path = path
+        self.values = []
+        self.rows = []
+        self.segments = []      # Positions (in 'values'/'rows') where segments start
+        self.file = None
+
+        # Keep entries of committed rows only
+        entries = 0
+        if os.path.exists(path):
+            with open(path, "rb") as index_file:
+                data = index_file.read()
+            for offset in xrange(0, len(data) - INDEX_ENTRY.size + 1, INDEX_ENTRY.size):
+                value, row, segment = INDEX_ENTRY.unpack_from(data, offset)
+                if row >= rows:
+                    break
+                self._add(value, row, segment)
+                entries += 1
+
+        if writable:
+            self.file = open(path, "ab")
+            self.file.truncate(entries * INDEX_ENTRY.size)
+
+
+    def _add(self, value, row, segment):
+        if segment or not self.rows:
+            self.segments.append(len(self.rows))
+        self.values.append(value)
+        self.rows.append(row)
+
+
+    def add(self, value, row, segment=False):
+        self._add(value, row, segment)
+        self.file.write(INDEX_ENTRY.pack(value, row, segment))
+
+
+    # Segments as (first entry, entry after the last)
+    def segment_bounds(self):
+        ends = self.segments[1:] + [len(self.rows)]
+        return zip(self.segments, ends)
+
+
+    def flush(self):
+        self.file.flush()
+
+
+    def sync(self):
+        os.fsync(self.file.fileno())
+
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+
+
+
+# Archive of one payload (a folder of columns)
+class Archive(object):
+
+    def __init__(self, path, stride=256, writable=True):
+        self.path = path
+        self.stride = stride            # Rows between sparse index entries
+        self.writable = writable
+
+        if writable and not os.path.isdir(path):
+            os.makedirs(path)
+
+        self.formats = collections.OrderedDict((name, struct.Struct("<" + code)) for name, code in COLUMNS)
+
+        self._rows_path = os.path.join(path, "rows")
+        self.rows = 0                   # Rows committed
+        if os.path.exists(self._rows_path):
+            with open(self._rows_path, "rb") as rows_file:
+                data = rows_file.read(ROWS.size)
+            if len(data) == ROWS.size:
+                self.rows = ROWS.unpack(data)[0]
+
+        self.appended = self.rows       # Rows appended (committed or not)
+        self.files = {}
+        self.rows_file = None
+
+        if writable:
+            # Drop whatever was appended after the last commit (e.g. before a crash)
+            for name, row_format in self.formats.iteritems():
+                column_file = self.files[name] = open(self._column_path(name), "ab")
+                column_file.truncate(self.rows * row_format.size)
+            self.rows_file = open(self._rows_path, "r+b" if os.path.exists(self._rows_path) else "w+b")
+
+        self.time_index = SparseIndex(os.path.join(path, "received.idx"), self.rows, writable)
+        self.id_index = SparseIndex(os.path.join(path, "sent_id.idx"), self.rows, writable)
+        self._last_received = self.read("received", self.rows - 1, self.rows)[0] if self.rows else None
+        self._last_id = self.read("sent_id", self.rows - 1, self.rows)[0] if self.rows else None
+
+
+    def __len__(self):
+        return self.rows
+
+
+    # Rows appended but not committed yet
+    @property
+    def pending(self):
+        return self.appended - self.rows
+
+
+    def _column_path(self, name):
+        return os.path.join(self.path, name + ".col")
+
+
+    # Append telemetry 'record' (see 'telemetry.Parser'), received at 'received' (Unix time) with 'rssi'
+    # The row is only kept once committed (see 'commit()')
+    def append(self, record, rssi, received):
+        row = self.appended
+
+        # Receive times must not decrease for the index (the clock may have been set back)
+        if self._last_received is not None and received < self._last_received:
+            received = self._last_received
+
+        # Pack every value before writing any, so that a value out of range (struct.error) leaves no partial row
+        values = {"received": received, "rssi": rssi or 0, "time": seconds_of_day(record.time), "status": record.status}
+        packed = [(name, row_format.pack(values[name] if name in values else getattr(record, name)))
+                  for name, row_format in self.formats.iteritems()]
+        for name, data in packed:
+            self.files[name].write(data)
+
+        if row % self.stride == 0:
+            self.time_index.add(received, row)
+
+        # Sentence ID went back: the tracker restarted
+        restarted = self._last_id is not None and record.sent_id < self._last_id
+        if row % self.stride == 0 or restarted:
+            self.id_index.add(record.sent_id, row, restarted)
+
+        self._last_received = received
+        self._last_id = record.sent_id
+        self.appended += 1
+
+
+    # Make appended rows permanent: sync columns and indexes, then the row count
+    def commit(self):
+        self.sync(self.flush())
+
+
+    # Hand appended rows over to the OS. Returns the number of rows written out (to be passed to 'sync()')
+    def flush(self):
+        rows = self.appended
+        for column_file in self.files.itervalues():
+            column_file.flush()
+        self.time_index.flush()
+        self.id_index.flush()
+        return rows
+
+
+    # Sync columns and indexes to disk, then count the first 'rows' rows as committed (written out by 'flush()')
+    # Rows can be appended meanwhile, from another thread: they are only committed by the next 'flush()' and 'sync()'
+    def sync(self, rows):
+        if rows <= self.rows:
+            return
+
+        for column_file in self.files.itervalues():
+            os.fsync(column_file.fileno())
+        self.time_index.sync()
+        self.id_index.sync()
+
+        self.rows_file.seek(0)
+        self.rows_file.write(ROWS.pack(rows))
+        self.rows_file.flush()
+        os.fsync(self.rows_file.fileno())
+        self.rows = rows
+
+
+    def close(self):
+        if not self.writable:
+            return
+        self.commit()
+        for column_file in self.files.itervalues():
+            column_file.close()
+        self.rows_file.close()
+        self.time_index.close()
+        self.id_index.close()
+
+
+    # Committed values of column 'name' (rows 'start' to 'stop'): a memory-mapped NumPy array if NumPy is installed,
+    # a list otherwise
+    def column(self, name, start=0, stop=None):
+        stop = self.rows if stop is None else min(stop, self.rows)
+        start = min(start, stop)
+
+        if numpy is None:
+            return self.read(name, start, stop)
+        if stop == start:
+            return numpy.zeros(0, dtype=NUMPY_TYPES[dict(COLUMNS)[name]])
+
+        values = numpy.memmap(self._column_path(name), dtype=NUMPY_TYPES[dict(COLUMNS)[name]], mode="r", shape=(self.rows,))
+        return values[start:stop]
+
+
+    # Values of column 'name' in rows 'start' to 'stop' as a list (without NumPy)
+    def read(self, name, start, stop):
+        row_format = self.formats[name]
+        count = max(0, stop - start)
+        if not count:
+            return []
+
+        with open(self._column_path(name), "rb") as column_file:
+            data = mmap.mmap(column_file.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                values = struct.unpack_from("<" + dict(COLUMNS)[name] * count, data, start * row_format.size)
+            finally:
+                data.close()
+
+        if row_format.format.endswith("s"):
+            return [value.rstrip("\0") for value in values]
+        return list(values)
+
+
+    # Rows 'start' to 'stop' as dicts (column -> value)
+    def records(self, start, stop, columns=None):
+        columns = columns or [name for name, code in COLUMNS]
+        values = [self.read(name, start, stop) for name in columns]
+        return [dict(zip(columns, row)) for row in zip(*values)]
+
+
+    # First row in rows 'lo' to 'hi' of column 'name' with a value >= 'value' ('right': > 'value')
+    # Values in those rows must not decrease
+    def _search(self, name, index, first, last, hi, value, right):
+        values = index.values[first:last]
+        rows = index.rows[first:last]
+
+        i = (bisect.bisect_right if right else bisect.bisect_left)(values, value)
+        if i == 0:
+            return rows[0]
+
+        block_start = rows[i - 1]
+        block_end = rows[i] if i < len(rows) else hi
+        block = self.read(name, block_start, block_end)
+        return block_start + (bisect.bisect_right if right else bisect.bisect_left)(block, value)
+
+
+    # Rows received between 'since' and 'until' (Unix time, inclusive) as (first row, row after the last)
+    def time_range(self, since=None, until=None):
+        index = self.time_index
+        if not self.rows or not index.rows:
+            return 0, 0
+
+        first = 0 if since is None else self._search("received", index, 0, len(index.rows), self.rows, since, False)
+        stop = self.rows if until is None else self._search("received", index, 0, len(index.rows), self.rows, until, True)
+        return first, max(first, stop)
+
+
+    # Rows with sentence IDs from 'first' to 'last' (inclusive), as list of (first row, row after the last): one range
+    # for every segment (tracker restart) containing any
+    def id_ranges(self, first=None, last=None):
+        index = self.id_index
+        ranges = []
+
+        bounds = index.segment_bounds()
+        for n, (entry, end) in enumerate(bounds):
+            lo = index.rows[entry]
+            hi = index.rows[bounds[n + 1][0]] if n + 1 < len(bounds) else self.rows
+
+            start = lo if first is None else self._search("sent_id", index, entry, end, hi, first, False)
+            stop = hi if last is None else self._search("sent_id", index, entry, end, hi, last, True)
+            if stop > start:
+                ranges.append((start, stop))
+
+        return ranges
+
+
+
+# Archive of every payload: a folder with an Archive per callsign
+# Once started, a thread commits rows appended every 'commit_interval' seconds (whether or not any arrived since), so
+# that 'add()' only writes to buffers. Errors while committing are logged to 'logger' and kept in 'error'.
+class FlightArchive(object):
+
+    def __init__(self, path, commit_interval=COMMIT_INTERVAL, logger=None):
+        self.path = path
+        self.commit_interval = commit_interval
+        self.logger = logger
+        self.archives = {}      # callsign -> Archive
+        self.errors = 0         # Rows that couldn't be written
+        self.error = None       # Last error while committing
+
+        # Held while appending and while handing rows over to the OS (but not while syncing)
+        self._lock = threading.Lock()
+        self._halt = threading.Event()
+        self._committer = None
+
+
+    def start(self):
+        self._committer = threading.Thread(target=self._run, name="ArchiveCommitter")
+        self._committer.daemon = True
+        self._committer.start()
+
+
+    def _run(self):
+        while not self._halt.wait(self.commit_interval):
+            try:
+                self.commit()
+            except (IOError, OSError) as e:
+                self.error = e
+                if self.logger is not None:
+                    self.logger.error("Error while committing flight archive: " + str(e))
+
+
+    # Archive of payload 'callsign' (opened or created if needed)
+    def get(self, callsign):
+        archive = self.archives.get(callsign)
+        if archive is None:
+            with self._lock:
+                archive = self.archives[callsign] = Archive(os.path.join(self.path, safe_name(callsign)))
+        return archive
+
+
+    # Archive Reception (see 'ingest.Reception') with a valid checksum
+    def add(self, reception, now=None):
+        now = time.time() if now is None else now
+        archive = self.get(reception.record.callsign)
+        with self._lock:
+            archive.append(reception.record, reception.rssi, now)
+
+
+    # Commit rows appended to every archive so far
+    def commit(self):
+        with self._lock:
+            flushed = [(archive, archive.flush()) for archive in self.archives.itervalues()]
+        for archive, rows in flushed:
+            archive.sync(rows)
+
+
+    # Stop committing in the background and commit whatever is left
+    def close(self):
+        self._halt.set()
+        if self._committer is not None:
+            self._committer.join()
+            self._committer = None
+        for archive in self.archives.itervalues():
+            archive.close()
+        self.archives = {}
+
+
+
+# Seconds since midnight of a time (hh:mm:ss), -1 if it isn't one
+def seconds_of_day(text):
+    try:
+        hours, minutes, seconds = text.split(":")
+        return int(hours) * 3600 + int(minutes) * 60 + int(seconds)
+    except ValueError:
+        return -1
+
+
+# Callsign usable as folder name
+def safe_name(callsign):
+    return "".join(c if c.isalnum() or c in "-_" else "_" for c in callsign) or "_"
+
+
+# Unix time of a local date and time ("YYYY-MM-DD HH:MM[:SS]")
+def parse_time(text):
+    for time_format in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M"):
+        try:
+            return time.mktime(time.strptime(text, time_format))
+        except ValueError:
+            continue
+    raise argparse.ArgumentTypeError("invalid time: '" + text + "' (use YYYY-MM-DD HH:MM[:SS])")
+
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Print rows of an Argo 2 flight archive (one payload) as CSV.")
+    parser.add_argument("archive", help="folder of one payload (e.g. archive/ARGO2)")
+    parser.add_argument("--since", type=parse_time, help="first receive time (YYYY-MM-DD HH:MM[:SS], local time)")
+    parser.add_argument("--until", type=parse_time, help="last receive time")
+    parser.add_argument("--ids", metavar="FIRST-LAST", help="sentence IDs (in every tracker restart)")
+    parser.add_argument("--columns", help="comma-separated columns to print (default: all)")
+    args = parser.parse_args()
+
+    if not os.path.exists(os.path.join(args.archive, "rows")):
+        parser.error("no archive in " + args.archive)
+
+    columns = args.columns.split(",") if args.columns else [name for name, code in COLUMNS]
+    for name in columns:
+        if name not in dict(COLUMNS):
+            parser.error("unknown column '" + name + "'")
+
+    archive = Archive(args.archive, writable=False)
+
+    ranges = [archive.time_range(args.since, args.until)]
+    if args.ids:
+        try:
+            first, last = [int(value) for value in args.ids.split("-")]
+        except ValueError:
+            parser.error("invalid sentence IDs: '" + args.ids + "' (use FIRST-LAST)")
+        time_first, time_stop = ranges[0]
+        ranges = [(max(start, time_first), min(stop, time_stop)) for start, stop in archive.id_ranges(first, last)]
+
+    sys.stdout.write(",".join(columns) + "\n")
+    for start, stop in ranges:
+        for row in archive.records(start, stop, columns):
+            sys.stdout.write(",".join(str(row[name]) for name in columns) + "\n")
+
+
+
+if __name__ == '__main__':
+    main()
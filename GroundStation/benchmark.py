@@ -0,0 +1,377 @@
+'''
+Argo 2 Ground Station - Benchmark
+
+Tomas Manterola
+
+Measures each stage of the path a frame takes through the Ground Station, using realistic sentences from the simulated
+tracker ('simulator.py'):
+ - crc:     checksum check ('crc16.check')
+ - repair:  repair of a sentence with one flipped bit ('crc16.repair')
+ - parse:   frame split and sentence parse ('telemetry')
+ - process: whole frame processing ('IngestEngine.process': repair, parse, checksum, payload and outbox)
+ - logging: logging of a processed frame (GroundStation.log and sentences.log lines, queued for the log writer
+            thread as the Ground Station does, to temporary files)
+ - upload:  upload to a local stand-in for HabHub ('uploader.HabHubUploader', from submit to response)
+
+For each stage it reports throughput, median and 99th percentile latency, and objects left over per frame (a sign of
+something keeping frames alive). Results can be saved as named baselines and compared later, so regressions between
+versions show up:
+
+    python benchmark.py --save v1.0
+    python benchmark.py                 (compares with the last baseline saved)
+
+'''
+
+
+import argparse
+import gc
+import hashlib
+import json
+import logging
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import timeit
+
+import crc16
+import ingest
+import logfiles
+import replay
+import simulator
+import telemetry
+import uploader
+
+
+STAGES = ["crc", "repair", "parse", "process", "logging", "upload"]
+
+# Baselines saved with '--save' (name -> results)
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark.json")
+
+timer = timeit.default_timer
+
+
+
+# Outcome of benchmarking one stage
+class Result(object):
+
+    def __init__(self, stage, latencies, elapsed, objects):
+        self.stage = stage
+        self.count = len(latencies)
+        self.elapsed = elapsed              # Seconds taken by the whole run
+        self.latencies = sorted(latencies)  # Seconds taken by each frame
+        self.objects = objects              # Objects still alive after the run (over those before it)
+
+
+    @property
+    def throughput(self):
+        return self.count / max(self.elapsed, 1e-9)
+
+
+    # Latency (seconds) at percentile 'p' (0 - 100)
+    def percentile(self, p):
+        if not self.latencies:
+            return 0.0
+        return self.latencies[int(round(p / 100.0 * (len(self.latencies) - 1)))]
+
+
+    def as_dict(self):
+        return {
+            "count": self.count,
+            "throughput": self.throughput,
+            "p50": self.percentile(50),
+            "p99": self.percentile(99),
+            "objects": self.objects / float(max(self.count, 1)),
+        }
+
+
+
+# Frames ([SENTENCE];[RSSI]) from simulated trackers, 'count' of them
+def generate_frames(count, seed=0):
+    rng = random.Random(seed)
+    trackers = [simulator.Tracker(callsign, interval=5, start=0, rng=rng) for callsign in ("ARGO2", "ARGO3")]
+    receiver = simulator.VirtualReceiver(trackers, rng=rng)
+
+    return [receiver.frame(trackers[i % len(trackers)]).rstrip("\r\n") for i in xrange(count)]
+
+
+# Fingerprint of 'frames', saved with baselines so that results are only compared on the same frames
+def fingerprint(frames):
+    return hashlib.md5("\n".join(frames)).hexdigest()
+
+
+# Copy of 'sentence' with one flipped bit
+def flip_bit(sentence, rng):
+    data = bytearray(sentence)
+    bit = rng.randrange(8 * len(data))
+    data[bit // 8] ^= 1 << (bit % 8)
+    return str(data)
+
+
+# Objects tracked by the garbage collector
+def count_objects():
+    gc.collect()
+    return len(gc.get_objects())
+
+
+# Call 'operation' on every item, timing each call
+def measure(stage, operation, items):
+    latencies = []
+    objects = count_objects()
+
+    start = timer()
+    for item in items:
+        before = timer()
+        operation(item)
+        latencies.append(timer() - before)
+    elapsed = timer() - start
+
+    # The list of latencies isn't the stage's
+    return Result(stage, latencies, elapsed, count_objects() - objects - 1)
+
+
+# Logger writing through 'writer' with 'handler' in the Ground Station's format, not passing records on to other loggers
+def queued_logger(name, writer, handler, log_format):
+    logger = logfiles.skip_record_details(logging.getLogger(name))
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+    handler.setFormatter(logging.Formatter(log_format))
+    logger.addHandler(writer.handler(handler))
+    return logger
+
+
+def remove_handlers(logger):
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+
+
+
+def bench_crc(frames, rng):
+    sentences = [telemetry.split_frame(frame)[0] for frame in frames]
+    return measure("crc", crc16.check, sentences)
+
+
+def bench_repair(frames, rng):
+    damaged = [flip_bit(telemetry.split_frame(frame)[0], rng) for frame in frames]
+    return measure("repair", lambda sentence: crc16.repair(sentence, 1, telemetry.PARSER.valid), damaged)
+
+
+def bench_parse(frames, rng):
+    return measure("parse", lambda frame: telemetry.PARSER.parse(telemetry.split_frame(frame)[0]), frames)
+
+
+def bench_process(frames, rng):
+    engine = ingest.IngestEngine("BENCH", silent_logger(), None, ":memory:")
+    engine.start()
+    try:
+        return measure("process", engine.process, frames)
+    finally:
+        engine.stop()
+
+
+def bench_logging(frames, rng):
+    engine = ingest.IngestEngine("BENCH", silent_logger(), None, ":memory:", repair_errors=0)
+    receptions = [engine.process(frame) for frame in frames]
+
+    folder = tempfile.mkdtemp(prefix="argo2-bench-")
+    writer = logfiles.LogWriter()
+    logger = queued_logger("Benchmark.log", writer, logfiles.RotatingLogHandler(os.path.join(folder, "GroundStation.log")),
+                           "%(asctime)s [%(levelname)s] %(message)s")
+    sentence_logger = queued_logger("Benchmark.sentences", writer, logfiles.SentenceLogHandler(os.path.join(folder, "sentences.log")),
+                                    "%(message)s")
+    writer.start()
+
+    # Same lines as the Ground Station logs for every frame
+    def log(reception):
+        for line in ingest.describe(reception):
+            logger.info(line)
+        if reception.crc_ok:
+            sentence_logger.info(reception.sentence)
+
+    try:
+        return measure("logging", log, receptions)
+    finally:
+        writer.stop()
+        remove_handlers(logger)
+        remove_handlers(sentence_logger)
+        shutil.rmtree(folder, ignore_errors=True)
+
+
+def bench_upload(frames, rng):
+    sentences = [telemetry.split_frame(frame)[0] for frame in frames]
+
+    server = replay.StandInServer()
+    server.start()
+    pool = uploader.HabHubUploader(server.url, max_pending=len(sentences) + 1, retries=1)
+    pool.start()
+
+    # Latency is from submit to result, measured as the results come in
+    submitted = {}
+    latencies = []
+    objects = count_objects()
+
+    try:
+        start = timer()
+        for sentence in sentences:
+            submitted[sentence] = timer()
+            pool.submit("BENCH", sentence)
+
+        while len(latencies) < len(sentences):
+            callsign, sentence, ok, detail = pool.results.get(timeout=30)
+            latencies.append(timer() - submitted[sentence])
+        elapsed = timer() - start
+
+    finally:
+        pool.stop(1)
+        server.stop()
+
+    return Result("upload", latencies, elapsed, count_objects() - objects - 2)
+
+
+def silent_logger():
+    logger = logging.getLogger("Benchmark.engine")
+    logger.propagate = False
+    logger.addHandler(logging.NullHandler())
+    return logger
+
+
+BENCHMARKS = {
+    "crc": bench_crc,
+    "repair": bench_repair,
+    "parse": bench_parse,
+    "process": bench_process,
+    "logging": bench_logging,
+    "upload": bench_upload,
+}
+
+
+
+# Run benchmarks of 'stages' on 'count' frames, 'repeat' times each. Returns list of Results (the fastest run of each
+# stage, the one least disturbed by whatever else the machine was doing)
+def run(stages=STAGES, count=2000, seed=0, repeat=3):
+    frames = generate_frames(count, seed)
+    results = []
+
+    for stage in stages:
+        runs = [BENCHMARKS[stage](frames, random.Random(seed)) for i in xrange(repeat)]
+        results.append(max(runs, key=lambda result: result.throughput))
+    return results
+
+
+def load_baselines(path=BASELINE_PATH):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as baseline_file:
+        return json.load(baseline_file)
+
+
+# Save 'results' as baseline 'name' (replacing any baseline with that name), measured on frames with fingerprint 'frames'
+def save_baseline(name, results, frames=None, path=BASELINE_PATH):
+    baselines = load_baselines(path)
+    baselines[name] = {
+        "saved": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "python": sys.version.split()[0],
+        "frames": frames,
+        "results": dict((result.stage, result.as_dict()) for result in results),
+    }
+
+    with open(path, "w") as baseline_file:
+        json.dump(baselines, baseline_file, indent=2, sort_keys=True)
+
+
+# Name of the baseline saved last, or None
+def latest_baseline(baselines):
+    if not baselines:
+        return None
+    return max(baselines, key=lambda name: baselines[name]["saved"])
+
+
+# Stages where 'results' are worse than 'baseline' by more than 'tolerance' (fraction): lower throughput or higher p99
+# Returns list of (stage, description)
+def compare(results, baseline, tolerance=0.2):
+    regressions = []
+
+    for result in results:
+        before = baseline["results"].get(result.stage)
+        if before is None:
+            continue
+
+        if result.throughput < before["throughput"] * (1 - tolerance):
+            regressions.append((result.stage, "throughput %d -> %d frames/s" % (before["throughput"], result.throughput)))
+        if result.percentile(99) > before["p99"] * (1 + tolerance):
+            regressions.append((result.stage, "p99 %.1f -> %.1f us" % (before["p99"] * 1e6, result.percentile(99) * 1e6)))
+
+    return regressions
+
+
+# Table of results (and change since 'baseline', if given)
+def describe(results, baseline=None):
+    lines = ["%-8s %12s %10s %10s %10s" % ("stage", "frames/s", "p50 (us)", "p99 (us)", "objects")]
+
+    for result in results:
+        line = "%-8s %12d %10.1f %10.1f %10.2f" % (result.stage, result.throughput, result.percentile(50) * 1e6,
+                                                   result.percentile(99) * 1e6, result.as_dict()["objects"])
+
+        before = baseline["results"].get(result.stage) if baseline is not None else None
+        if before is not None:
+            line += "   throughput %+.0f%%, p99 %+.0f%%" % (100.0 * (result.throughput / before["throughput"] - 1),
+                                                          100.0 * (result.percentile(99) / max(before["p99"], 1e-12) - 1))
+        lines.append(line)
+
+    return lines
+
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the Argo 2 Ground Station's receive, parse, checksum, logging and upload path.")
+    parser.add_argument("stages", nargs="*", metavar="STAGE", help="stages to benchmark: " + ", ".join(STAGES) + " (default: all)")
+    parser.add_argument("--count", type=int, default=2000, help="frames per stage (default: 2000)")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per stage, the fastest is kept (default: 3)")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the generated frames (default: 0)")
+    parser.add_argument("--save", metavar="NAME", help="save results as baseline NAME (e.g. a version number)")
+    parser.add_argument("--compare", metavar="NAME", help="baseline to compare with (default: the last one saved)")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="fraction worse than the baseline reported as a regression (default: 0.2)")
+    parser.add_argument("--baselines", default=BASELINE_PATH, help="file of saved baselines (default: benchmark.json)")
+    args = parser.parse_args()
+
+    for stage in args.stages:
+        if stage not in STAGES:
+            parser.error("unknown stage '" + stage + "' (choose from " + ", ".join(STAGES) + ")")
+
+    baselines = load_baselines(args.baselines)
+    name = args.compare or latest_baseline(baselines)
+    if args.compare and args.compare not in baselines:
+        parser.error("no baseline named '" + args.compare + "' in " + args.baselines)
+    baseline = baselines.get(name) if name is not None else None
+
+    # Frames are the same for the same count and seed: a baseline measured on others can't be compared with
+    frames = fingerprint(generate_frames(args.count, args.seed))
+    if baseline is not None and baseline.get("frames") not in (None, frames):
+        print("Baseline '" + name + "' was measured on different frames (other --count or --seed, or simulator changed): not compared")
+        baseline = None
+
+    results = run(args.stages or STAGES, args.count, args.seed, args.repeat)
+
+    if baseline is not None:
+        print("Compared with baseline '" + name + "' (saved " + baseline["saved"] + ")")
+    for line in describe(results, baseline):
+        print(line)
+
+    if args.save:
+        save_baseline(args.save, results, frames, args.baselines)
+        print("Saved baseline '" + args.save + "'")
+
+    if baseline is not None:
+        regressions = compare(results, baseline, args.tolerance)
+        for stage, description in regressions:
+            print("Regression in " + stage + ": " + description)
+        if regressions:
+            sys.exit(1)
+
+
+
+if __name__ == '__main__':
+    main()
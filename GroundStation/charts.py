@@ -0,0 +1,166 @@
+'''
+Argo 2 Ground Station - Charts
+
+Tomas Manterola
+
+Line charts of a payload's telemetry history (see 'timeseries.py') drawn on Tkinter canvases. Before drawing, a series
+is reduced to about one point per pixel of the chart's width with Largest-Triangle-Three-Buckets (LTTB), which keeps
+peaks and turns that plain averaging or skipping would flatten. Drawing then costs the same for a 10 hour flight as for
+a 10 minute one; only the reduction grows with the number of points, and it is a single pass.
+
+Each chart keeps one line item and only moves its points when redrawn, instead of deleting and creating items.
+
+'''
+
+
+import time
+
+import Tkinter as tk
+
+
+# Fields charted, as (name in 'timeseries.FIELDS', title, unit, color)
+FIELDS = [
+    ("altitude",    "Altitude",         "m",    "blue"),
+    ("v_speed",     "Vertical Speed",   "m/s",  "dark green"),
+    ("ext_temp",    "Ext. Temp",        "C",    "red"),
+    ("int_temp",    "Int. Temp",        "C",    "orange"),
+    ("pressure",    "Pressure",         "hPa",  "purple"),
+    ("rssi",        "RSSI",             "dBm",  "black"),
+]
+
+# Space (pixels) around the plot area, for labels
+MARGIN_LEFT = 50
+MARGIN_RIGHT = 8
+MARGIN_TOP = 18
+MARGIN_BOTTOM = 16
+
+
+
+# Reduce series ('xs', 'ys') to 'threshold' points with Largest-Triangle-Three-Buckets
+# The first and last points are kept; every other point is the one of its bucket forming the largest triangle with the
+# point kept before it and the average of the next bucket. 'xs' must not decrease. Returns (xs, ys) as lists
+def lttb(xs, ys, threshold):
+    count = len(xs)
+    if threshold >= count or count <= 2:
+        return list(xs), list(ys)
+    if threshold < 3:
+        return [xs[0], xs[-1]], [ys[0], ys[-1]]
+
+    every = (count - 2) / float(threshold - 2)
+    out_x = [xs[0]]
+    out_y = [ys[0]]
+    kept = 0
+
+    for i in xrange(threshold - 2):
+        # Average of the next bucket (the last point, for the last bucket)
+        next_start = int((i + 1) * every) + 1
+        next_end = min(int((i + 2) * every) + 1, count)
+        size = float(next_end - next_start)
+        average_x = sum(xs[next_start:next_end]) / size
+        average_y = sum(ys[next_start:next_end]) / size
+
+        # Point of this bucket forming the largest triangle
+        start = int(i * every) + 1
+        end = next_start
+        point_x = xs[kept]
+        point_y = ys[kept]
+        largest = -1.0
+        chosen = start
+        for j in xrange(start, end):
+            area = abs((point_x - average_x) * (ys[j] - point_y) - (point_x - xs[j]) * (average_y - point_y))
+            if area > largest:
+                largest = area
+                chosen = j
+
+        out_x.append(xs[chosen])
+        out_y.append(ys[chosen])
+        kept = chosen
+
+    out_x.append(xs[-1])
+    out_y.append(ys[-1])
+    return out_x, out_y
+
+
+
+# Line chart of one field on a Canvas, with title, latest value, value range and time range
+class Chart(object):
+
+    def __init__(self, canvas, title, unit, color="black"):
+        self.canvas = canvas
+        self.title = title
+        self.unit = unit
+
+        font = "TkSmallCaptionFont"
+        self.line = canvas.create_line(0, 0, 0, 0, fill=color, width=1)
+        self.title_text = canvas.create_text(MARGIN_LEFT, 2, anchor="nw", font=font, text=title)
+        self.value_text = canvas.create_text(0, 2, anchor="ne", font=font, fill=color)
+        self.max_text = canvas.create_text(MARGIN_LEFT - 4, MARGIN_TOP, anchor="ne", font=font)
+        self.min_text = canvas.create_text(MARGIN_LEFT - 4, 0, anchor="se", font=font)
+        self.start_text = canvas.create_text(MARGIN_LEFT, 0, anchor="sw", font=font)
+        self.end_text = canvas.create_text(0, 0, anchor="se", font=font)
+        self.frame = canvas.create_rectangle(0, 0, 0, 0, outline="gray")
+
+        self.points = 0         # Points drawn last
+
+
+    # Draw values 'ys' received at times 'xs' (Unix time, not decreasing), as arrays (NumPy or Python)
+    def draw(self, xs, ys):
+        canvas = self.canvas
+        width = canvas.winfo_width()
+        height = canvas.winfo_height()
+        right = width - MARGIN_RIGHT
+        bottom = height - MARGIN_BOTTOM
+        plot_width = max(1, right - MARGIN_LEFT)
+        plot_height = max(1, bottom - MARGIN_TOP)
+
+        canvas.coords(self.frame, MARGIN_LEFT, MARGIN_TOP, right, bottom)
+        canvas.coords(self.value_text, right, 2)
+        canvas.coords(self.min_text, MARGIN_LEFT - 4, bottom)
+        canvas.coords(self.start_text, MARGIN_LEFT, height)
+        canvas.coords(self.end_text, right, height)
+
+        if len(xs) < 2:
+            canvas.coords(self.line, 0, 0, 0, 0)
+            for item in (self.value_text, self.max_text, self.min_text, self.start_text, self.end_text):
+                canvas.itemconfig(item, text="")
+            self.points = 0
+            return
+
+        # Plain lists are much faster to go through one by one than NumPy arrays
+        xs, ys = lttb(xs.tolist(), ys.tolist(), plot_width)
+
+        low = min(ys)
+        high = max(ys)
+        span = (high - low) or 1.0
+        first = xs[0]
+        duration = (xs[-1] - first) or 1.0
+        x_scale = plot_width / duration
+        y_scale = plot_height / span
+
+        coords = []
+        for x, y in zip(xs, ys):
+            coords.append(MARGIN_LEFT + (x - first) * x_scale)
+            coords.append(bottom - (y - low) * y_scale)
+        canvas.coords(self.line, *coords)
+        self.points = len(xs)
+
+        canvas.itemconfig(self.value_text, text=format_value(ys[-1]) + " " + self.unit)
+        canvas.itemconfig(self.max_text, text=format_value(high))
+        canvas.itemconfig(self.min_text, text=format_value(low))
+        canvas.itemconfig(self.start_text, text=time.strftime("%H:%M", time.localtime(first)))
+        canvas.itemconfig(self.end_text, text=time.strftime("%H:%M:%S", time.localtime(xs[-1])))
+
+
+
+# Value as short text (fewer decimals the larger it is)
+def format_value(value):
+    if abs(value) >= 1000:
+        return "%d" % value
+    if abs(value) >= 10:
+        return "%.1f" % value
+    return "%.2f" % value
+
+
+# Canvas for a chart, filling its cell of a grid
+def chart_canvas(master, height=100):
+    return tk.Canvas(master, height=height, background="white", highlightthickness=0)
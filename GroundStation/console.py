@@ -0,0 +1,76 @@
+'''
+Argo 2 Ground Station - Console
+
+Tomas Manterola
+
+Read-only text console for the Ground Station window. Lines written to it are buffered and shown together at a fixed
+rate (one insert per redraw instead of one per line), and only the last 'max_lines' are kept, so the cost of writing a
+line stays the same however long the Ground Station has been running.
+
+'''
+
+
+import collections
+
+import Tkinter as tk
+
+
+# Bounded console on top of a (disabled) Text widget
+class Console(object):
+
+    def __init__(self, text, max_lines=2000, interval=100):
+        self.text = text                    # Text widget (e.g. ScrolledText)
+        self.max_lines = max_lines          # Lines kept in the widget
+        self.interval = interval            # Time (ms) between redraws
+
+        self.lines = 0                      # Lines currently in the widget
+        self.dropped = 0                    # Lines that never made it to the widget (buffer overflowed between redraws)
+
+        self._pending = collections.deque(maxlen=max_lines)
+        self._scheduled = None
+
+
+    # Add line to the console (shown on the next redraw)
+    def write(self, line):
+        if len(self._pending) == self._pending.maxlen:
+            self.dropped += 1
+        self._pending.append(line)
+
+        if self._scheduled is None:
+            self._scheduled = self.text.after(self.interval, self.flush)
+
+
+    # Show buffered lines in one insert and remove the oldest lines over 'max_lines'
+    def flush(self):
+        self._scheduled = None
+        if not self._pending:
+            return
+
+        text = "\n".join(self._pending) + "\n"
+        count = len(self._pending)
+        self._pending.clear()
+
+        # Only follow new lines if the user hasn't scrolled up
+        at_bottom = self.text.yview()[1] >= 1.0
+
+        self.text.config(state=tk.NORMAL)
+        self.text.insert(tk.END, text)
+
+        self.lines += count
+        if self.lines > self.max_lines:
+            self.text.delete("1.0", str(self.lines - self.max_lines + 1) + ".0")
+            self.lines = self.max_lines
+
+        self.text.config(state=tk.DISABLED)
+
+        if at_bottom:
+            self.text.see(tk.END)
+
+
+    # Remove every line
+    def clear(self):
+        self._pending.clear()
+        self.text.config(state=tk.NORMAL)
+        self.text.delete("1.0", tk.END)
+        self.text.config(state=tk.DISABLED)
+        self.lines = 0
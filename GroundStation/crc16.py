@@ -0,0 +1,199 @@
+'''
+Argo 2 Ground Station - CRC16
+
+Tomas Manterola
+
+Table-driven CRC16-CCITT (poly 0x1021, initial value 0xFFFF, no reflection), the same checksum as 'calc_CRC16()' in the
+tracker and 'crc16()' in the receiver firmware.
+Single sentences are checked with 'check()'. Large numbers of sentences (e.g. when re-checking archived logs) can be
+checked at once with 'check_batch()', which is vectorized with NumPy if it is installed.
+
+'''
+
+
+# NumPy is optional (only used to speed up batch checks)
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+POLYNOMIAL = 0x1021
+INITIAL_VALUE = 0xFFFF
+
+
+# Precompute CRC of every possible high byte
+def _make_table():
+    table = []
+    for byte in xrange(256):
+        crc = byte << 8
+        for bit in xrange(8):
+            if crc & 0x8000:
+                crc = ((crc << 1) ^ POLYNOMIAL) & 0xFFFF
+            else:
+                crc = (crc << 1) & 0xFFFF
+        table.append(crc)
+    return table
+
+
+TABLE = _make_table()
+
+
+
+# Calculate CRC16-CCITT of 'data' (as an int)
+def crc16(data, crc=INITIAL_VALUE):
+    table = TABLE
+    for byte in bytearray(data):
+        crc = ((crc << 8) & 0xFFFF) ^ table[(crc >> 8) ^ byte]
+    return crc
+
+
+# Calculate CRC16-CCITT of 'data' as 4 upper-case hex characters (as sent by the tracker)
+def crc16_hex(data):
+    return "%04X" % crc16(data)
+
+
+# Check whether sentence ([DATA]*[CRC]) has a correct checksum
+def check(sentence):
+    data, sep, check_sum = sentence.rpartition("*")
+    if not sep or len(check_sum) != 4:
+        return False
+
+    try:
+        return crc16(data) == int(check_sum, 16)
+    except ValueError:
+        return False
+
+
+# Calculate CRC16-CCITT of every item in 'datas' (returns list of ints)
+def crc16_batch(datas):
+    datas = list(datas)
+    if numpy is None or not datas:
+        return [crc16(data) for data in datas]
+
+    # Lay data out as rows of a matrix (padded with zeros) and update the CRC of all rows one column at a time
+    lengths = numpy.array([len(data) for data in datas])
+    width = int(lengths.max())
+    matrix = numpy.frombuffer("".join(data.ljust(width, "\0") for data in datas), dtype=numpy.uint8).reshape(len(datas), width)
+
+    table = numpy.array(TABLE, dtype=numpy.uint32)
+    crc = numpy.full(len(datas), INITIAL_VALUE, dtype=numpy.uint32)
+
+    for column in xrange(width):
+        updated = ((crc << 8) & 0xFFFF) ^ table[(crc >> 8) ^ matrix[:, column]]
+        crc = numpy.where(column < lengths, updated, crc)
+
+    return crc.tolist()
+
+
+# Check every sentence ([DATA]*[CRC]) in 'sentences' (returns list of bools)
+def check_batch(sentences):
+    datas = []
+    check_sums = []
+
+    for sentence in sentences:
+        data, sep, check_sum = sentence.rpartition("*")
+        try:
+            check_sums.append(int(check_sum, 16) if sep and len(check_sum) == 4 else None)
+        except ValueError:
+            check_sums.append(None)
+        datas.append(data)
+
+    return [expected is not None and crc == expected for crc, expected in zip(crc16_batch(datas), check_sums)]
+
+
+# Single-bit error correction
+# CRC16 is linear: flipping bit 'k' (counted from the end of the data) changes the CRC by a fixed syndrome, x^(k + 16) mod P.
+# These are unique for data shorter than the period of the polynomial (32767 bits), so a syndrome identifies the flipped
+# bit directly. Syndromes are precomputed for the longest message the radio can carry.
+
+MAX_REPAIR_LENGTH = 256     # Bytes of data (RH_RF95_MAX_MESSAGE_LEN is 251)
+
+
+# Syndrome of a flipped bit, indexed by its distance from the end of the data
+def _make_syndromes(bits):
+    syndromes = []
+    syndrome = POLYNOMIAL   # x^16 mod P
+    for k in xrange(bits):
+        syndromes.append(syndrome)
+        syndrome <<= 1
+        if syndrome & 0x10000:
+            syndrome ^= 0x10000 | POLYNOMIAL
+    return syndromes
+
+
+SYNDROMES = _make_syndromes(8 * MAX_REPAIR_LENGTH)
+SYNDROME_BITS = dict((syndrome, k) for k, syndrome in enumerate(SYNDROMES))
+
+
+# Flip bits (distances from the end) of 'data'. Returns None if a flipped byte isn't printable or becomes '*'
+def _flip(data, bits):
+    data = bytearray(data)
+    for k in bits:
+        index = len(data) - 1 - k // 8
+        data[index] ^= 1 << (k % 8)
+        if not 0x20 <= data[index] <= 0x7E or data[index] == 0x2A:
+            return None
+    return str(data)
+
+
+# Try to repair sentence ([DATA]*[CRC]) with a wrong checksum, assuming up to 'max_errors' (1 or 2) flipped bits.
+# Single-bit errors are found with one lookup. Two-bit errors need a search over the bits of the data, and are only
+# accepted if exactly one candidate passes 'validate' (a function taking the repaired sentence, optional).
+# Returns (repaired sentence, number of bits repaired), or None if the sentence couldn't be repaired.
+def repair(sentence, max_errors=1, validate=None):
+    data, sep, check_sum = sentence.rpartition("*")
+    if not sep or len(data) > MAX_REPAIR_LENGTH:
+        return None
+
+    computed = crc16_hex(data)
+
+    # Error in the checksum itself: data is correct and checksum is a few bits away from the correct one
+    if len(check_sum) == 4:
+        flipped = sum(bin(ord(a) ^ ord(b)).count("1") for a, b in zip(computed, check_sum.upper()))
+        if 0 < flipped <= max_errors:
+            return data + "*" + computed, flipped
+
+    try:
+        syndrome = int(computed, 16) ^ int(check_sum, 16)
+    except ValueError:
+        return None
+
+    if len(check_sum) != 4 or not syndrome:
+        return None
+
+    bits = 8 * len(data)
+
+    # Single-bit error
+    k = SYNDROME_BITS.get(syndrome)
+    if k is not None and k < bits:
+        repaired = _flip(data, (k,))
+        if repaired is not None:
+            repaired += "*" + check_sum
+            if validate is None or validate(repaired):
+                return repaired, 1
+
+    if max_errors < 2:
+        return None
+
+    # Two-bit error: for every first bit, the remaining syndrome must belong to a second (later) bit
+    found = None
+    for i in xrange(bits):
+        j = SYNDROME_BITS.get(syndrome ^ SYNDROMES[i])
+        if j is None or not i < j < bits:
+            continue
+
+        repaired = _flip(data, (i, j))
+        if repaired is None:
+            continue
+
+        repaired += "*" + check_sum
+        if validate is None or validate(repaired):
+            # Ambiguous: more than one way to repair the sentence
+            if found is not None:
+                return None
+            found = repaired
+
+    if found is not None:
+        return found, 2
+    return None
@@ -0,0 +1,642 @@
+'''
+Argo 2 Ground Station - Ingest
+
+Tomas Manterola
+
+Headless core of the Ground Station: reads frames from one or more receivers, repairs and parses sentences, checks their
+checksums, logs them and uploads them to HabHub. Nothing here depends on Tkinter, so it can run on machines without a
+display (relay stations, batch jobs). The Ground Station window subscribes to the engine to display what it receives.
+
+To run without the window:
+
+    python ingest.py /dev/ttyUSB0 [/dev/ttyUSB1 ...] --callsign PAN1 --online
+
+'''
+
+
+import argparse
+import atexit
+import collections
+import logging
+import Queue
+import struct
+import sys
+import time
+
+import serial
+
+import archive
+import crc16
+import logfiles
+import metrics
+import outbox
+import payloads
+import ports
+import receiver
+import telemetry
+import uplink
+import uploader
+
+
+# Seconds between attempts to reconnect to a receiver that isn't plugged in (headless mode)
+RECONNECT_DELAY = 5
+
+
+
+# Result of processing one frame from the receiver
+class Reception(object):
+    __slots__ = ("frame", "port", "copies", "payload", "sentence", "rssi", "fields", "record", "error", "check_sum", "crc", "crc_ok", "repaired", "original")
+
+    def __init__(self, frame, port=None, copies=1):
+        self.frame = frame
+        self.port = port            # Receiver with the best copy of the frame
+        self.copies = copies        # Number of receivers that received the frame
+        self.payload = None         # 'payloads.Payload' the sentence belongs to (None if unknown)
+        self.sentence = frame       # Sentence without RSSI (repaired, if it was repaired)
+        self.rssi = None
+        self.fields = None          # Text of each field (None if sentence is malformed)
+        self.record = None          # Typed 'telemetry' record (None if sentence is malformed)
+        self.error = None           # Why the sentence is malformed
+        self.check_sum = None       # Checksum received
+        self.crc = None             # Checksum calculated
+        self.crc_ok = False
+        self.repaired = 0           # Number of flipped bits repaired
+        self.original = None        # Sentence as received (if it was repaired)
+
+
+
+# Pipeline from serial ports to HabHub
+# Frames are read in the background and processed when 'poll()' is called. Frames from several receivers are merged
+# (see 'receiver.FrameAggregator'). Every result is passed to the subscribers (functions taking (event, data)) as one
+# of these events:
+#   "frame"         - Reception
+#   "upload"        - (callsign, sentence, ok, detail)
+#   "dropped"       - (port, number of bytes dropped by the framer since the last event)
+#   "read_error"    - (port, exception that stopped the serial reader)
+#   "command"       - uplink.Command queued or changing state (sent, acked, failed, pending to be sent again)
+#   "link"          - (callsign, kind, text) about the link with a payload (see 'linkquality'): sentences found missing
+#                     ("lost"), tracker restarted ("restart"), or a summary every 'link_report' seconds ("report")
+# An engine that isn't 'live' (replaying a recording alongside the live one) sends no commands to the tracker, and its
+# queues aren't reported in the performance metrics
+class IngestEngine(object):
+
+    def __init__(self, callsign, logger=None, sentence_logger=None, outbox_path="outbox.db", repair_errors=1, window=0.3,
+                 upload_url=uploader.HABHUB_URL, archive_path=None, live=True):
+        self.callsign = callsign
+        self.repair_errors = repair_errors          # Max. flipped bits to repair in sentences with a wrong checksum (0: off)
+        self.logger = logger or logging.getLogger(__name__)
+        self.sentence_logger = sentence_logger      # Logger for valid sentences (sentences.log)
+
+        self.readers = collections.OrderedDict()    # port -> SerialReader
+        self.frames = Queue.Queue()
+        self.capture = None                         # receiver.CaptureWriter recording raw data read (None: off)
+
+        # Copies of a sentence from different receivers are merged if they arrive within 'window' seconds
+        self.window = window
+        self.aggregator = receiver.FrameAggregator(0)
+
+        self.last_record = None
+        self.payloads = payloads.PayloadRegistry(sentence_logger)   # State of every payload heard, by callsign
+        self.link_report = 300                      # Seconds between summaries of the link with each payload
+
+        # Columnar archive of valid sentences (None: off)
+        self.archive = archive.FlightArchive(archive_path, logger=self.logger) if archive_path else None
+
+        self.upload_pool = uploader.HabHubUploader(upload_url)
+        self.upload_outbox = outbox.Outbox(outbox_path, self.upload_pool)
+
+        # Commands to the tracker, written in the background and sent again until confirmed (None: not live)
+        self.uplink = uplink.UplinkScheduler(self._write_command) if live else None
+
+        if live:
+            metrics.METRICS.gauge("frames_queued", "Frames read but not processed yet", self.frames.qsize)
+            metrics.METRICS.gauge("upload_backlog", "Sentences waiting to be uploaded", lambda: self.upload_outbox.backlog)
+
+        self._subscribers = []
+
+
+    # Add function to be called with (event, data) for every event
+    def subscribe(self, subscriber):
+        self._subscribers.append(subscriber)
+
+
+    def unsubscribe(self, subscriber):
+        self._subscribers.remove(subscriber)
+
+
+    def _publish(self, event, data):
+        for subscriber in list(self._subscribers):
+            subscriber(event, data)
+
+
+    # Start upload workers, outbox, archive commits and command writer
+    def start(self):
+        self.upload_pool.start()
+        self.upload_outbox.start()
+        if self.archive is not None:
+            self.archive.start()
+        if self.uplink is not None:
+            self.uplink.start()
+
+
+    # Close serial port and stop background threads
+    def stop(self, timeout=1):
+        self.disconnect()
+        self.set_capture(None)
+        self.upload_outbox.stop(timeout)
+        self.upload_pool.stop(timeout)
+        if self.uplink is not None:
+            self.uplink.stop(timeout)
+        if self.archive is not None:
+            self.archive.close()
+
+
+    # Whether at least one receiver is connected
+    @property
+    def connected(self):
+        return bool(self.readers)
+
+
+    # Open serial port and start reading from it, along with any other receivers already connected
+    # (raises serial.SerialException if port can't be opened)
+    def connect(self, port):
+        self.disconnect(port)
+        ser = serial.Serial(port, timeout=receiver.READ_TIMEOUT, write_timeout=5)
+        self.start_reader(ser)
+
+
+    # Stop reading and close serial port (all ports if 'port' is None)
+    def disconnect(self, port=None):
+        for port in ([port] if port is not None else list(self.readers)):
+            reader = self.readers.get(port)
+            if reader is not None:
+                self.stop_reader(port)
+                if reader.ser.is_open:
+                    reader.ser.close()
+
+
+    # Start reading an open serial port in the background
+    def start_reader(self, ser):
+        reader = receiver.SerialReader(ser, self.frames, self.capture)
+        self.readers[reader.port] = reader
+        self.aggregator.receiver(reader.port)
+        self.aggregator.window = self.window if len(self.readers) > 1 else 0
+        reader.start()
+
+
+    # Stop the background reader of 'port' (serial port is left open)
+    def stop_reader(self, port):
+        reader = self.readers.pop(port, None)
+        if reader is not None:
+            reader.stop()
+            reader.join(1)
+        self.aggregator.window = self.window if len(self.readers) > 1 else 0
+
+
+    # Start reading again from 'port' after a read error
+    def restart_reader(self, port):
+        reader = self.readers.get(port)
+        if reader is not None:
+            self.stop_reader(port)
+            self.start_reader(reader.ser)
+
+
+    # Record raw data read from every receiver to 'capture' (a receiver.CaptureWriter, or None to stop recording)
+    def set_capture(self, capture):
+        previous = self.capture
+        self.capture = capture
+        for reader in self.readers.itervalues():
+            reader.capture = capture
+        if previous is not None and previous is not capture:
+            previous.close()
+
+
+    # Queue command to the tracker, to be sent at 'tx_power' dBm and confirmed by payload 'callsign' (any, if None)
+    # Returns the uplink.Command; its state changes are published as "command" events (engine must be live)
+    def send_command(self, tx_power, command, callsign=None):
+        command = self.uplink.submit(tx_power, command, callsign)
+        self._publish("command", command)
+        return command
+
+
+    # Write command to the first receiver connected (called by the uplink's writer thread)
+    def _write_command(self, tx_power, command):
+        for reader in self.readers.values():
+            reader.ser.write(str(tx_power) + ";" + command + "\n")
+            return
+        raise serial.SerialException("No receiver connected")
+
+
+    # Enable/disable uploading to HabHub (sentences are stored in the outbox either way)
+    def set_online(self, online):
+        self.upload_outbox.set_online(online)
+
+
+    # Process frames read so far (waiting up to 'timeout' seconds for the first one) and finished uploads
+    # Returns number of frames processed
+    def poll(self, timeout=0):
+        received = 0
+
+        while True:
+            # Don't wait past the time frames held for merging are due
+            wait = timeout if not received else 0
+            due = self.aggregator.next_due()
+            if wait and due is not None:
+                wait = min(wait, max(0, due - time.time()))
+
+            try:
+                if wait:
+                    port, frame = self.frames.get(True, wait)
+                else:
+                    port, frame = self.frames.get_nowait()
+            except Queue.Empty:
+                break
+
+            # Reader stopped because of an error
+            if frame is None:
+                error = self.readers[port].error if port in self.readers else None
+                self.logger.error("Error while attempting to read serial port data (" + str(port) + "): " + str(error))
+                metrics.METRICS.count("read_errors")
+                self._publish("read_error", (port, error))
+                continue
+
+            self.aggregator.add(port, frame, time.time())
+            received += 1
+
+        metrics.METRICS.count("frames_received", received)
+
+        count = 0
+        for port, frame, copies in self.aggregator.ready(time.time()):
+            self.process(frame, port, copies)
+            count += 1
+
+        self.check_uploads()
+
+        for command in (self.uplink.check() if self.uplink is not None else []):
+            self._publish("command", command)
+
+        # Report data that wasn't part of a frame (noise, receiver errors, ...)
+        for port, reader in self.readers.items():
+            stats = self.aggregator.receiver(port)
+            if reader.framer.dropped_bytes != stats.dropped_bytes:
+                dropped = reader.framer.dropped_bytes - stats.dropped_bytes
+                stats.dropped_bytes = reader.framer.dropped_bytes
+                metrics.METRICS.count("bytes_dropped", dropped)
+                self._publish("dropped", (port, dropped))
+
+        return count
+
+
+    # Repair, parse, check, log and upload one frame ([SENTENCE];[RSSI]) and return the Reception
+    # 'port' is the receiver the frame came from, and 'copies' the number of receivers that received it
+    def process(self, frame, port=None, copies=1):
+        stats = metrics.METRICS
+        start = stats.start()
+        stats.count("frames_processed")
+
+        reception = check_frame(frame, port, copies, self.repair_errors)
+        sentence = reception.sentence
+
+        # No RSSI: not a frame from the receiver
+        if reception.rssi is None:
+            stats.observe("process", start)
+            self._publish("frame", reception)
+            return reception
+
+        if reception.record is not None:
+            self.last_record = reception.record
+
+            # Only sentences with a correct checksum can add a new payload
+            payload = reception.payload = self.payloads.update(reception, add=reception.crc_ok)
+            stage = stats.start()
+            if payload is not None and payload.logger is not None:
+                payload.logger.info(sentence)
+            elif self.sentence_logger is not None:
+                self.sentence_logger.info(sentence)
+            stats.observe("log", stage)
+
+            if reception.crc_ok and self.archive is not None:
+                try:
+                    self.archive.add(reception)
+                except (IOError, OSError, struct.error) as e:
+                    self.archive.errors += 1
+                    self.logger.error("Error while archiving sentence: " + str(e))
+
+            # Send data to HabHub tracker (if valid - stored until we are online)
+            if reception.crc_ok:
+                metadata = {"repaired_bits": reception.repaired} if reception.repaired else None
+                self.upload_outbox.add(self.callsign, sentence, metadata)
+                payload.uploads += 1
+
+                # Check commands sent against the sentence, and send the next one right after it
+                for command in (self.uplink.on_record(reception.record) if self.uplink is not None else []):
+                    self._publish("command", command)
+
+        # Link quality of the payload the frame came from (frames with a corrupted callsign can't be told apart)
+        payload = reception.payload or self.payloads.find(sentence)
+        if payload is not None:
+            self._check_link(payload, reception)
+
+        stats.observe("process", start)
+        self._publish("frame", reception)
+        return reception
+
+
+    # Count frame in the link quality of 'payload', and report sentences lost and (every 'link_report' seconds) a summary
+    def _check_link(self, payload, reception):
+        now = time.time()
+        link = payload.link
+
+        event = link.observe(reception, now)
+        if event is not None:
+            self._publish("link", (payload.callsign,) + event)
+
+        if now - link.reported >= self.link_report:
+            link.reported = now
+            self._publish("link", (payload.callsign, "report", link.summary(now)))
+
+
+    # Report outcome of finished uploads
+    def check_uploads(self):
+        while True:
+            try:
+                result = self.upload_pool.results.get_nowait()
+            except Queue.Empty:
+                break
+
+            sent_callsign, sentence, ok, detail = result
+            payload = self.payloads.find(sentence)
+            if ok:
+                self.upload_outbox.done(sent_callsign, sentence)
+                self.logger.info("Response: " + detail)
+            else:
+                self.upload_outbox.failed(sent_callsign, sentence)
+
+            # Sentences stored before a restart may belong to payloads not heard yet
+            if payload is not None:
+                if ok:
+                    payload.sent += 1
+                    payload.uploads = max(0, payload.uploads - 1)
+                else:
+                    payload.failed += 1
+
+            self._publish("upload", result)
+
+
+
+# Repair, parse and check one frame ([SENTENCE];[RSSI]) and return the Reception (see 'IngestEngine.process')
+# 'port' is the receiver the frame came from, 'copies' the number of receivers that received it, and 'repair_errors' the
+# max. flipped bits to repair in a sentence with a wrong checksum. Doesn't depend on any state, so frames can be checked
+# in any thread or process (see 'reprocess.py')
+def check_frame(frame, port=None, copies=1, repair_errors=1):
+    reception = Reception(frame, port, copies)
+    stats = metrics.METRICS
+
+    # Grab and remove RSSI from frame
+    try:
+        reception.sentence, reception.rssi = telemetry.split_frame(frame)
+    except telemetry.ParseError as e:
+        reception.error = str(e)
+        stats.count("frames_malformed")
+        return reception
+
+    # Try to repair sentence if checksum is wrong (up to 'repair_errors' flipped bits)
+    if repair_errors and not crc16.check(reception.sentence):
+        stage = stats.start()
+        repaired = crc16.repair(reception.sentence, repair_errors, telemetry.PARSER.valid)
+        if repaired:
+            reception.original = reception.sentence
+            reception.sentence, reception.repaired = repaired
+            stats.count("frames_repaired")
+        stats.observe("repair", stage)
+
+    sentence = reception.sentence
+
+    stage = stats.start()
+    try:
+        reception.fields = telemetry.PARSER.split(sentence)
+        reception.record = telemetry.PARSER.convert(reception.fields)
+    except telemetry.ParseError as e:
+        reception.fields = None
+        reception.error = str(e)
+        stats.count("frames_malformed")
+    stats.observe("parse", stage)
+
+    # Check checksum (if there is one)
+    if len(sentence.split("*")) == 2:
+        stage = stats.start()
+        data, reception.check_sum = sentence.split("*")
+        reception.crc = crc16.crc16_hex(data)
+        reception.crc_ok = reception.crc == reception.check_sum.upper()
+        stats.observe("crc", stage)
+    if not reception.crc_ok:
+        stats.count("frames_bad_crc")
+
+    return reception
+
+
+# Lines describing a Reception (as shown and logged by the Ground Station)
+def describe(reception):
+    lines = []
+
+    if reception.repaired:
+        lines.append("Repaired " + str(reception.repaired) + "-bit error in: '" + reception.original + "'")
+
+    lines.append("Received data: '" + reception.sentence + "'")
+
+    if reception.rssi is None:
+        lines.append(" -> Message length: " + str(len(reception.sentence)))
+        lines.append(" -> Wrong message format! (" + reception.error + ")")
+        return lines
+
+    if reception.copies > 1:
+        lines.append(" -> RSSI: " + str(reception.rssi) + " dBm (best of " + str(reception.copies) + " receivers: " + reception.port + ")")
+    else:
+        lines.append(" -> RSSI: " + str(reception.rssi) + " dBm")
+    lines.append(" -> Message length: " + str(len(reception.sentence)))
+
+    if reception.error:
+        lines.append(" -> Wrong message format! (" + reception.error + ")")
+
+    if reception.check_sum is None:
+        lines.append(" -> No checksum found")
+    elif reception.crc_ok:
+        lines.append(" -> Correct Checksum: " + reception.crc)
+    else:
+        lines.append(" -> Incorrect Checksum: Recv = " + reception.check_sum + ", Calc = " + reception.crc)
+
+    return lines
+
+
+# Lines describing the outcome of an upload
+def describe_upload(result):
+    sent_callsign, sentence, ok, detail = result
+    sent_id = sentence.split(",")[1] if "," in sentence else "?"
+
+    if ok:
+        return "Sent Data! (" + sent_id + ")"
+    return "Error sending data (" + sent_id + "): " + detail
+
+
+# Line describing a "link" event
+def describe_link(event):
+    callsign, kind, text = event
+    if kind == "report":
+        return "Link " + callsign + ": " + text
+    return callsign + ": " + text
+
+
+# Set up Ground Station log (file and console) and sentence log. Returns (logger, sentence logger)
+# Both are written by a background thread (see 'logfiles'), stopped (after writing everything logged) on exit
+def setup_logging(name, log_path='GroundStation.log', sentence_path='sentences.log'):
+    writer = logfiles.LogWriter()
+
+    logger = logfiles.skip_record_details(logging.getLogger(name))
+    logger.setLevel(logging.INFO)
+
+    file_handler = logfiles.RotatingLogHandler(log_path)
+    file_handler.setLevel(logging.INFO)
+
+    console_handler = logging.StreamHandler(sys.stdout)
+    console_handler.setLevel(logging.INFO)
+
+    log_formatter = logging.Formatter("%(asctime)s [%(levelname)s] %(message)s")
+    file_handler.setFormatter(log_formatter)
+    console_handler.setFormatter(log_formatter)
+
+    logger.addHandler(writer.handler(file_handler, console_handler))
+
+
+    # Sentence log: one valid sentence per line
+    sent_logger = logfiles.skip_record_details(logging.getLogger('sentence'))
+    sent_logger.setLevel(logging.INFO)
+
+    file_handler2 = logfiles.SentenceLogHandler(sentence_path)
+    file_handler2.setLevel(logging.INFO)
+
+    log_formatter2 = logging.Formatter("%(message)s")
+    file_handler2.setFormatter(log_formatter2)
+
+    sent_logger.addHandler(writer.handler(file_handler2))
+
+    writer.start()
+    atexit.register(writer.stop, 5)
+
+    return logger, sent_logger
+
+
+# Run engine without UI until interrupted, reconnecting to each of 'devices' whenever its connection is lost
+# Receivers are reconnected as soon as they are plugged back in, even under a different name (found by their identity)
+def run(engine, devices):
+    devices = list(devices)
+    identities = {}     # device -> identity of the receiver last connected to it
+
+    def log_event(event, data):
+        if event == "frame":
+            for line in describe(data):
+                engine.logger.info(line)
+        elif event == "upload":
+            engine.logger.log(logging.INFO if data[2] else logging.ERROR, describe_upload(data))
+        elif event == "dropped":
+            engine.logger.info("Dropped " + str(data[1]) + " bytes of unframed data (" + data[0] + ")")
+        elif event == "link":
+            engine.logger.log(logging.INFO if data[1] == "report" else logging.WARNING, describe_link(data))
+        elif event == "read_error":
+            engine.disconnect(data[0])
+
+    engine.subscribe(log_event)
+    engine.start()
+
+    monitor = ports.PortMonitor()
+    monitor.start()
+
+    next_connect = dict((device, 0) for device in devices)
+    try:
+        while True:
+            for event, info in monitor.poll():
+                if event != "added":
+                    continue
+
+                # Receiver plugged back in: connect now (under its new name, if it changed)
+                for i, device in enumerate(devices):
+                    if device not in engine.readers and info.device not in engine.readers and \
+                            (info.device == device or identities.get(device) == info.identity):
+                        devices[i] = info.device
+                        next_connect[info.device] = 0
+
+            for device in devices:
+                if device not in engine.readers and time.time() >= next_connect[device]:
+                    engine.logger.info("Connecting to serial port " + device + "...")
+                    try:
+                        engine.connect(device)
+                        engine.logger.info("Connected!")
+                        if device in monitor.ports:
+                            identities[device] = monitor.ports[device].identity
+                    except (OSError, serial.SerialException) as e:
+                        engine.logger.error("Error while connecting to port: " + str(e))
+                        next_connect[device] = time.time() + RECONNECT_DELAY
+
+            if engine.connected:
+                engine.poll(0.5)
+            else:
+                engine.poll()
+                time.sleep(0.5)
+
+    except KeyboardInterrupt:
+        for stats in engine.aggregator.stats.itervalues():
+            engine.logger.info(stats.describe())
+        engine.logger.info("Quitting...")
+
+    finally:
+        monitor.stop(1)
+        engine.stop()
+
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Argo 2 Ground Station without UI: receive, log and upload sentences to HabHub.")
+    parser.add_argument("ports", nargs="+", metavar="port", help="serial port of a receiver (e.g. /dev/ttyUSB0 or COM3)")
+    parser.add_argument("--callsign", default="PAN1", help="callsign used when uploading to HabHub (default: PAN1)")
+    parser.add_argument("--online", action="store_true", help="upload sentences to HabHub")
+    parser.add_argument("--repair", type=int, default=1, choices=[0, 1, 2], help="max. flipped bits to repair in sentences with a wrong checksum (default: 1)")
+    parser.add_argument("--outbox", default="outbox.db", help="database of sentences waiting to be uploaded (default: outbox.db)")
+    parser.add_argument("--window", type=float, default=0.3, help="seconds to wait for copies of a sentence from other receivers (default: 0.3)")
+    parser.add_argument("--capture", metavar="PATH", help="record raw data read from the receivers to PATH (can be replayed with replay.py)")
+    parser.add_argument("--archive", default="archive", metavar="PATH", help="folder of the flight archive (see archive.py, default: archive, '' to disable)")
+    parser.add_argument("--metrics-port", type=int, metavar="PORT", help="serve performance metrics (Prometheus format) at http://127.0.0.1:PORT/metrics")
+    parser.add_argument("--metrics-host", default="127.0.0.1", metavar="HOST", help="address to serve performance metrics on (default: 127.0.0.1, only this machine; 0.0.0.0 for every interface)")
+    parser.add_argument("--metrics-file", metavar="PATH", help="write performance metrics (Prometheus format) to PATH every 5 seconds")
+    args = parser.parse_args()
+
+    logger, sent_logger = setup_logging("GroundStation")
+    logger.info("Starting Argo 2 Ground Station (headless)")
+
+    engine = IngestEngine(args.callsign, logger, sent_logger, args.outbox, args.repair, args.window, archive_path=args.archive)
+    engine.set_online(args.online)
+    if args.capture:
+        engine.set_capture(receiver.CaptureWriter(args.capture))
+
+    # Performance metrics are only collected if they are exported
+    server = metrics_file = None
+    if args.metrics_port is not None or args.metrics_file:
+        metrics.METRICS.enable()
+    if args.metrics_port is not None:
+        server = metrics.MetricsServer(args.metrics_port, host=args.metrics_host)
+        server.start()
+        logger.info("Serving performance metrics at " + server.url)
+    if args.metrics_file:
+        metrics_file = metrics.MetricsFile(args.metrics_file)
+        metrics_file.start()
+
+    try:
+        run(engine, args.ports)
+    finally:
+        if server is not None:
+            server.stop()
+        if metrics_file is not None:
+            metrics_file.stop(1)
+
+
+
+if __name__ == '__main__':
+    main()
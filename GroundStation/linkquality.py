@@ -0,0 +1,337 @@
+'''
+Argo 2 Ground Station - Link Quality
+
+Tomas Manterola
+
+How well sentences from a payload are getting through, kept up to date frame by frame so that it can be checked (and
+logged) at any time during a flight: to decide whether to move the antenna or change the tracker's TX power.
+
+The tracker numbers its sentences (sent ID, counting up from 1 when it starts), so the sentences lost are the numbers
+missing between those received. They are kept as sorted ranges: a sentence after the last one received adds at most
+one range, at the end, and a late one (from a slower receiver, or repaired) shrinks or splits the range it falls in,
+found by bisection (splitting or removing a range shifts the ranges after it, of which there are at most 'max_ranges').
+A sent ID below the first one counted, one of the first few after many more, or any lower one after a long silence
+means the tracker restarted, and counting starts over from 1.
+
+Loss, checksum failures and RSSI (mean, min. and max.) are also kept over the last minutes ('WINDOWS'), as running
+sums over the frames in each window: every frame is added once and removed once, and the min./max. are kept in
+monotonic queues, so no frame is looked at twice.
+
+'''
+
+
+import bisect
+import collections
+import time
+
+
+# Sliding windows (seconds) over which loss, checksum failures and RSSI are kept
+WINDOWS = (300, 1800)
+
+# Sent IDs up to this are only sent right after the tracker starts: one received more than 'REORDER' below the last
+# one (and not missing) means the tracker restarted
+START_IDS = 5
+REORDER = 3
+
+# Seconds without sentences after which a sent ID lower than the last one means the tracker restarted, even if missing
+RESTART_SILENCE = 60
+
+
+
+# Frames received in the last 'seconds', with running sums
+class Window(object):
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.entries = collections.deque()      # (time, checksum failed, RSSI, sentences expected, sentences received)
+        self.frames = 0
+        self.crc_failures = 0
+        self.expected = 0                       # Sent IDs the tracker went through
+        self.received = 0                       # Sentences received with a correct checksum (late ones included)
+        self.rssi_count = 0
+        self.rssi_total = 0
+
+        self._lowest = collections.deque()      # (time, RSSI) with RSSI increasing: min. first
+        self._highest = collections.deque()     # (time, RSSI) with RSSI decreasing: max. first
+
+
+    # Add frame received at 'now' (not before the previous one)
+    def add(self, now, crc_failed, rssi, expected, received):
+        self.expire(now)
+        self.entries.append((now, crc_failed, rssi, expected, received))
+        self.frames += 1
+        self.crc_failures += crc_failed
+        self.expected += expected
+        self.received += received
+
+        if rssi is not None:
+            self.rssi_count += 1
+            self.rssi_total += rssi
+            while self._lowest and self._lowest[-1][1] >= rssi:
+                self._lowest.pop()
+            self._lowest.append((now, rssi))
+            while self._highest and self._highest[-1][1] <= rssi:
+                self._highest.pop()
+            self._highest.append((now, rssi))
+
+
+    # Remove frames received before the window (at 'now')
+    def expire(self, now):
+        start = now - self.seconds
+
+        entries = self.entries
+        while entries and entries[0][0] <= start:
+            when, crc_failed, rssi, expected, received = entries.popleft()
+            self.frames -= 1
+            self.crc_failures -= crc_failed
+            self.expected -= expected
+            self.received -= received
+            if rssi is not None:
+                self.rssi_count -= 1
+                self.rssi_total -= rssi
+
+        while self._lowest and self._lowest[0][0] <= start:
+            self._lowest.popleft()
+        while self._highest and self._highest[0][0] <= start:
+            self._highest.popleft()
+
+
+    # Sentences lost (sent IDs the tracker went through but weren't received)
+    @property
+    def lost(self):
+        return max(0, self.expected - self.received)
+
+
+    # Share of sentences lost (None if none were expected)
+    def loss_rate(self):
+        if not self.expected:
+            return None
+        return float(self.lost) / self.expected
+
+
+    # Share of frames with a wrong (or no) checksum (None if no frames)
+    def crc_failure_rate(self):
+        if not self.frames:
+            return None
+        return float(self.crc_failures) / self.frames
+
+
+    def mean_rssi(self):
+        if not self.rssi_count:
+            return None
+        return float(self.rssi_total) / self.rssi_count
+
+
+    def min_rssi(self):
+        return self._lowest[0][1] if self._lowest else None
+
+
+    def max_rssi(self):
+        return self._highest[0][1] if self._highest else None
+
+
+    # One-line summary
+    def describe(self):
+        text = "last " + str(self.seconds // 60) + " min: " + str(self.frames) + " frames"
+        if not self.frames:
+            return text
+        if self.expected:
+            text += ", " + str(self.lost) + " lost (" + percent(self.loss_rate()) + ")"
+        text += ", " + str(self.crc_failures) + " bad checksums (" + percent(self.crc_failure_rate()) + ")"
+        if self.rssi_count:
+            text += ", RSSI mean " + str(int(round(self.mean_rssi()))) + " / min " + str(self.min_rssi()) + " / max " + str(self.max_rssi()) + " dBm"
+        return text
+
+
+
+# Link quality of one payload: sentences missing (by sent ID) and statistics over the last minutes ('windows')
+# At most 'max_ranges' ranges of missing sentences are listed (the oldest are forgotten, but still counted)
+class LinkQuality(object):
+
+    def __init__(self, windows=WINDOWS, max_ranges=1000):
+        self.windows = [Window(seconds) for seconds in windows]
+        self.max_ranges = max_ranges
+
+        # Ranges of sent IDs missing since the tracker last started, as (start, end) sorted by start
+        self.starts = []
+        self.ends = []
+
+        self.first = None           # First sent ID counted since the tracker last started (or was first heard)
+        self.last = None            # Highest sent ID received since then
+        self.received = 0           # Sentences received with a correct checksum (not counting duplicates)
+        self.missing = 0            # Sentences missing, since first heard
+        self.duplicates = 0
+        self.restarts = 0
+        self.frames = 0
+        self.crc_failures = 0
+        self.forgotten = 0          # Missing sentences no longer listed (in ranges over 'max_ranges')
+        self.latest = 0             # Time of the last frame
+        self.heard = None           # Time of the last sentence with a correct checksum
+        self.reported = None        # Time of the last report (see 'ingest.IngestEngine'), from the first frame
+
+
+    # Count a Reception (see 'ingest') received at 'now'. Frames with a wrong checksum only count as checksum failures
+    # Returns ("lost", text) if sentences were found missing, ("restart", text) if the tracker restarted, else None
+    def observe(self, reception, now=None):
+        now = max(time.time() if now is None else now, self.latest)
+        self.latest = now
+        if self.reported is None:
+            self.reported = now
+
+        self.frames += 1
+        crc_failed = not reception.crc_ok
+        self.crc_failures += crc_failed
+
+        expected = received = 0
+        event = None
+        if reception.crc_ok and reception.record is not None:
+            expected, received, event = self.receive(reception.record.sent_id, now)
+
+        for window in self.windows:
+            window.add(now, crc_failed, reception.rssi, expected, received)
+        return event
+
+
+    # Count sentence 'sent_id' (received with a correct checksum, in the order received: see 'reprocess.py' for sentences
+    # from logs) at 'now' (None: unknown, silences aren't noticed). Returns (sent IDs the tracker went through,
+    # sentences received, event or None)
+    def receive(self, sent_id, now=None):
+        silent = now is not None and self.heard is not None and now - self.heard >= RESTART_SILENCE
+        if now is not None:
+            self.heard = now
+
+        if self.last is None:
+            self.first = self.last = sent_id
+            self.received += 1
+            return 1, 1, None
+
+        if sent_id > self.last:
+            expected = sent_id - self.last
+            event = None
+            if expected > 1:
+                self._add_range(self.last + 1, sent_id - 1)
+                event = ("lost", "Lost sentence" + ("s " if expected > 2 else " ") + describe_range(self.last + 1, sent_id - 1))
+            self.last = sent_id
+            self.received += 1
+            return expected, 1, event
+
+        # Late sentence (but not a lower one after a long silence, which the tracker may have restarted in)
+        silent = silent and sent_id < self.last
+        if not silent and self._fill(sent_id):
+            self.received += 1
+            return 0, 1, None
+
+        if not silent and sent_id >= self.first and (sent_id > START_IDS or self.last - sent_id <= REORDER):
+            self.duplicates += 1
+            return 0, 0, None
+
+        # Tracker restarted: sent IDs start again from 1 (missing ranges before can't be filled any more)
+        event = ("restart", "Tracker restarted (sentence #" + str(sent_id) + " after #" + str(self.last) + ")")
+        self.restarts += 1
+        del self.starts[:]
+        del self.ends[:]
+        self.first = 1
+        self.last = sent_id
+        self.received += 1
+        if sent_id > 1:
+            self._add_range(1, sent_id - 1)
+        return sent_id, 1, event
+
+
+    # Add range of missing sent IDs after every other one
+    def _add_range(self, start, end):
+        self.starts.append(start)
+        self.ends.append(end)
+        self.missing += end - start + 1
+
+        if len(self.starts) > self.max_ranges:
+            self.forgotten += self.ends[0] - self.starts[0] + 1
+            del self.starts[0]
+            del self.ends[0]
+
+
+    # Remove 'sent_id' from the missing ranges. Returns whether it was missing
+    def _fill(self, sent_id):
+        i = bisect.bisect_right(self.starts, sent_id) - 1
+        if i < 0 or self.ends[i] < sent_id:
+            return False
+
+        start, end = self.starts[i], self.ends[i]
+        if start == end:
+            del self.starts[i]
+            del self.ends[i]
+        elif sent_id == start:
+            self.starts[i] = start + 1
+        elif sent_id == end:
+            self.ends[i] = end - 1
+        else:
+            self.ends[i] = sent_id - 1
+            self.starts.insert(i + 1, sent_id + 1)
+            self.ends.insert(i + 1, end)
+
+        self.missing -= 1
+        return True
+
+
+    # Ranges of missing sent IDs, as (start, end), since the tracker last started (the latest 'count' ranges)
+    def ranges(self, count=None):
+        start = max(0, len(self.starts) - count) if count is not None else 0
+        return zip(self.starts[start:], self.ends[start:])
+
+
+    # Share of sentences missing since first heard (None if none received)
+    def loss_rate(self):
+        total = self.received + self.missing
+        if not total:
+            return None
+        return float(self.missing) / total
+
+
+    # One-line summary (logged every few minutes): totals and the shortest window
+    def summary(self, now=None):
+        text = str(self.received) + " received, " + str(self.missing) + " lost"
+        if self.received:
+            text += " (" + percent(self.loss_rate()) + ")"
+        if self.windows:
+            window = self.windows[0]
+            window.expire(time.time() if now is None else now)
+            text += "; " + window.describe()
+        return text
+
+
+    # Lines describing the link in detail
+    def describe(self, now=None):
+        now = time.time() if now is None else now
+
+        text = str(self.frames) + " frames, " + str(self.received) + " sentences received, " + str(self.missing) + " lost"
+        if self.received:
+            text += " (" + percent(self.loss_rate()) + ")"
+        if self.duplicates:
+            text += ", " + str(self.duplicates) + " duplicates"
+        if self.restarts:
+            text += ", " + str(self.restarts) + " tracker restart" + ("s" if self.restarts != 1 else "")
+        lines = [text]
+
+        ranges = self.ranges(5)
+        if ranges:
+            more = len(self.starts) - len(ranges)
+            lines.append("Missing: " + ("... " if more else "") + ", ".join(describe_range(start, end) for start, end in ranges))
+
+        for window in self.windows:
+            window.expire(now)
+            text = window.describe()
+            lines.append(text[0].upper() + text[1:])
+        return lines
+
+
+
+# Sent IDs from 'start' to 'end' as text ("#12", "#12-14")
+def describe_range(start, end):
+    if start == end:
+        return "#" + str(start)
+    return "#" + str(start) + "-" + str(end)
+
+
+# Rate as a percentage ("4.2%")
+def percent(rate):
+    return "%.1f%%" % (rate * 100)
@@ -0,0 +1,333 @@
+'''
+Argo 2 Ground Station - Log Files
+
+Tomas Manterola
+
+Writes the Ground Station's logs from a background thread, so that logging a line never waits on the disk or the
+console (the window logs every frame it shows). Loggers get a 'QueueHandler', which only queues records; a 'LogWriter'
+thread picks them up a few times per second and writes them in batches with the real handlers (one flush per batch).
+
+GroundStation.log is rotated when it reaches a size limit and every midnight, and rotated files are compressed in the
+background (GroundStation-YYYYMMDD-HHMMSS.log.gz, keeping the latest few). sentences.log is never rotated: it is the
+record of the flight, only appended to, and synced to disk every second instead of flushed after every line.
+
+'''
+
+
+import collections
+import glob
+import gzip
+import logging
+import os
+import re
+import shutil
+import threading
+import time
+
+
+# Time this module was loaded (what 'relativeCreated' of records counts from)
+START_TIME = time.time()
+
+
+# Make 'logger' (and children it gets later) leave out details of its records that the Ground Station's log formats
+# don't use (where they were logged from, thread and process). Finding the caller is most of the cost of logging a line.
+# Other loggers are left as they are. Returns 'logger'
+def skip_record_details(logger):
+    logger.findCaller = no_caller
+    logger.makeRecord = make_plain_record
+    logger.getChild = lambda suffix: skip_record_details(logging.Logger.getChild(logger, suffix))
+    return logger
+
+
+# Caller of a logging call, without looking for it
+def no_caller():
+    return "(unknown file)", 0, "(unknown function)"
+
+
+# Log record without thread and process (for 'Logger.makeRecord()')
+def make_plain_record(name, level, fn, lno, msg, args, exc_info, func=None, extra=None):
+    record = PlainRecord(name, level, fn, lno, msg, args, exc_info, func)
+    if extra is not None:
+        for key in extra:
+            if key in ("message", "asctime") or key in record.__dict__:
+                raise KeyError("Attempt to overwrite %r in LogRecord" % key)
+            record.__dict__[key] = extra[key]
+    return record
+
+
+
+# Log record without the thread and process it was logged from
+class PlainRecord(logging.LogRecord):
+
+    def __init__(self, name, level, pathname, lineno, msg, args, exc_info, func=None):
+        now = time.time()
+        self.name = name
+        self.msg = msg
+        if args and len(args) == 1 and isinstance(args[0], collections.Mapping) and args[0]:
+            args = args[0]
+        self.args = args
+        self.levelname = logging.getLevelName(level)
+        self.levelno = level
+        self.pathname = pathname
+        self.filename = pathname
+        self.module = "Unknown module"
+        self.exc_info = exc_info
+        self.exc_text = None
+        self.lineno = lineno
+        self.funcName = func
+        self.created = now
+        self.msecs = (now - long(now)) * 1000
+        self.relativeCreated = (now - START_TIME) * 1000
+        self.thread = None
+        self.threadName = None
+        self.processName = None
+        self.process = None
+
+
+
+# Thread writing queued log records with the handlers they were queued for
+# Records are queued by 'QueueHandler's (see 'handler()') and written every 'interval' seconds. If more than
+# 'max_pending' records are waiting, new ones are dropped (and counted in 'dropped') rather than making the logging
+# thread wait. Handlers are flushed after every batch, and those with a 'sync()' method get it called every
+# 'sync_interval' seconds.
+class LogWriter(threading.Thread):
+
+    def __init__(self, max_pending=10000, interval=0.05, sync_interval=1.0):
+        threading.Thread.__init__(self, name="LogWriter")
+        self.daemon = True
+
+        self.max_pending = max_pending
+        self.interval = interval
+        self.sync_interval = sync_interval
+        self.handlers = []              # Every handler records are written with
+        self.dropped = 0
+
+        # Appending to a deque is thread-safe and much cheaper than a Queue, which matters to the logging thread
+        self._records = collections.deque()
+        self._halt = threading.Event()
+
+
+    # Handler to add to a logger, queueing its records to be written by 'handlers'
+    def handler(self, *handlers):
+        for handler in handlers:
+            if handler not in self.handlers:
+                self.handlers.append(handler)
+        return QueueHandler(self, handlers)
+
+
+    # Queue 'record' to be written by 'handlers'. Returns False if it was dropped
+    def put(self, handlers, record):
+        if len(self._records) >= self.max_pending:
+            self.dropped += 1
+            return False
+        self._records.append((handlers, record))
+        return True
+
+
+    def run(self):
+        next_sync = time.time() + self.sync_interval
+        reported = 0
+
+        while not self._halt.wait(self.interval):
+            if self.dropped != reported:
+                self._report_dropped(self.dropped - reported)
+                reported = self.dropped
+
+            self.write()
+
+            if time.time() >= next_sync:
+                self.sync()
+                next_sync = time.time() + self.sync_interval
+
+        self.write()
+        self.sync()
+
+
+    # Write every record queued so far, then flush handlers
+    def write(self):
+        records = self._records
+        if not records:
+            return
+
+        while records:
+            handlers, record = records.popleft()
+            for handler in handlers:
+                if record.levelno >= handler.level:
+                    handler.handle(record)
+
+        for handler in self.handlers:
+            handler.flush()
+
+
+    # Note records dropped since the last report in every handler's output
+    def _report_dropped(self, count):
+        record = logging.LogRecord("logfiles", logging.WARNING, __file__, 0, "Dropped %d log records (too many waiting to be written)", (count,), None)
+        for handler in self.handlers:
+            if not isinstance(handler, SentenceLogHandler):
+                handler.handle(record)
+
+
+    # Write everything buffered by handlers to disk
+    def sync(self):
+        for handler in self.handlers:
+            sync = getattr(handler, "sync", None)
+            if sync is not None:
+                sync()
+
+
+    # Write records still queued, then stop and close handlers
+    def stop(self, timeout=None):
+        self._halt.set()
+        if self.is_alive():
+            self.join(timeout)
+        for handler in self.handlers:
+            handler.close()
+
+
+
+# Handler queueing records for a LogWriter (see 'LogWriter.handler()')
+class QueueHandler(logging.Handler):
+
+    def __init__(self, writer, handlers):
+        logging.Handler.__init__(self)
+        self.writer = writer
+        self.handlers = handlers
+
+
+    def emit(self, record):
+        try:
+            # Arguments may change before the record is written: merge them into the message now
+            record.msg = record.getMessage()
+            record.args = None
+            if record.exc_info:
+                record.exc_text = logging.Formatter().formatException(record.exc_info)
+                record.exc_info = None
+
+            self.writer.put(self.handlers, record)
+        except Exception:
+            self.handleError(record)
+
+
+
+# File handler that doesn't flush after every record (LogWriter flushes it after each batch)
+class BufferedFileHandler(logging.FileHandler):
+
+    # Write record and return number of bytes written
+    def emit(self, record):
+        try:
+            if self.stream is None:
+                self.stream = self._open()
+            text = self.format(record) + "\n"
+            self.stream.write(text)
+            return len(text)
+        except Exception:
+            self.handleError(record)
+            return 0
+
+
+
+# Log file rotated when it reaches 'max_bytes' and every midnight (local time). Rotated files are renamed with the time
+# they were rotated ([NAME]-YYYYMMDD-HHMMSS[EXT]), compressed in the background and only the latest 'backups' are kept
+class RotatingLogHandler(BufferedFileHandler):
+
+    def __init__(self, path, max_bytes=10 * 1024 * 1024, backups=30, daily=True, compress=True):
+        BufferedFileHandler.__init__(self, path)
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.daily = daily
+        self.compress = compress
+
+        self.size = os.path.getsize(self.baseFilename)
+        self.next_rotation = self._next_midnight()
+
+        self._stamp = None
+        self._copy = 0
+
+
+    def emit(self, record):
+        try:
+            if self.size >= self.max_bytes or (self.daily and time.time() >= self.next_rotation):
+                self.rotate()
+        except (IOError, OSError):
+            self.handleError(record)
+
+        self.size += BufferedFileHandler.emit(self, record)
+
+
+    # Move current file aside (compressed later) and start a new one
+    def rotate(self):
+        if self.stream is not None:
+            self.stream.close()
+            self.stream = None
+
+        # Files rotated within the same second are numbered
+        name, ext = os.path.splitext(self.baseFilename)
+        stamp = time.strftime("-%Y%m%d-%H%M%S")
+        self._copy = self._copy + 1 if stamp == self._stamp else 0
+        self._stamp = stamp
+        rotated = name + stamp + ("-" + str(self._copy) if self._copy else "") + ext
+
+        if self.size:
+            os.rename(self.baseFilename, rotated)
+            if self.compress:
+                compressor = threading.Thread(target=compress_file, args=(rotated,), name="LogCompressor")
+                compressor.start()
+            self._remove_old()
+
+        self.stream = self._open()
+        self.size = 0
+        self.next_rotation = self._next_midnight()
+
+
+    # Remove rotated files past the latest 'backups'
+    def _remove_old(self):
+        name, ext = os.path.splitext(self.baseFilename)
+        # Oldest first, by the time in their names (and number, if several were rotated in the same second)
+        rotated = sorted(glob.glob(name + "-[0-9]*-[0-9]*" + ext + "*"),
+                         key=lambda path: [int(number) for number in re.findall(r"\d+", path[len(name):])])
+        for path in rotated[:max(0, len(rotated) - self.backups)]:
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+
+
+    def _next_midnight(self):
+        tomorrow = time.localtime(time.time() + 86400)
+        return time.mktime((tomorrow.tm_year, tomorrow.tm_mon, tomorrow.tm_mday, 0, 0, 0, 0, 0, -1))
+
+
+# Compress 'path' to 'path'.gz and remove it
+def compress_file(path):
+    try:
+        with open(path, "rb") as source:
+            with gzip.open(path + ".gz", "wb") as target:
+                shutil.copyfileobj(source, target)
+        os.remove(path)
+    except (IOError, OSError):
+        return
+
+
+
+# Append-only log file, synced to disk (not only flushed) by 'sync()', which LogWriter calls periodically
+class SentenceLogHandler(BufferedFileHandler):
+
+    def __init__(self, path):
+        BufferedFileHandler.__init__(self, path, mode="a")
+
+
+    def sync(self):
+        self.acquire()
+        try:
+            if self.stream is not None:
+                self.stream.flush()
+                os.fsync(self.stream.fileno())
+        except (IOError, OSError):
+            pass
+        finally:
+            self.release()
+
+
+    def close(self):
+        self.sync()
+        BufferedFileHandler.close(self)
@@ -0,0 +1,337 @@
+'''
+Argo 2 Ground Station - Metrics
+
+Tomas Manterola
+
+Counters and latency histograms for every stage a frame goes through (reading, repair, parsing, checksum, logging,
+display, QR rendering and upload), shared by the whole Ground Station through 'METRICS'. Collection is off until
+enabled: while off, each measuring point costs a single check.
+
+Metrics can be read in Prometheus' text format, from an HTTP endpoint ('MetricsServer') or from a file rewritten every
+few seconds ('MetricsFile', e.g. for node_exporter's textfile collector):
+
+    python ingest.py /dev/ttyUSB0 --metrics-port 9464      (http://127.0.0.1:9464/metrics)
+
+The endpoint only listens on this machine unless told otherwise ('host', '--metrics-host 0.0.0.0' for every interface).
+
+'''
+
+
+import bisect
+import BaseHTTPServer
+import collections
+import os
+import SocketServer
+import socket
+import threading
+import time
+import timeit
+
+
+# Upper bounds (seconds) of the latency histogram buckets (the last bucket has no bound)
+BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+           0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Stages timed, with description
+STAGES = collections.OrderedDict([
+    ("read",    "Framing data read from a receiver"),
+    ("process", "Processing a frame (repair, parse, checksum and logging)"),
+    ("repair",  "Repairing a sentence with a wrong checksum"),
+    ("parse",   "Parsing a sentence"),
+    ("crc",     "Calculating a checksum"),
+    ("log",     "Logging a sentence"),
+    ("display", "Showing a frame in the window"),
+    ("qr",      "Rendering a QR code"),
+    ("upload",  "Uploading a sentence to HabHub (one attempt)"),
+])
+
+# Counters, with description
+COUNTERS = collections.OrderedDict([
+    ("frames_received",     "Frames read from the receivers (every copy)"),
+    ("frames_processed",    "Frames processed (after merging copies)"),
+    ("frames_malformed",    "Frames that couldn't be parsed"),
+    ("frames_bad_crc",      "Sentences with a wrong or missing checksum (after repair)"),
+    ("frames_repaired",     "Sentences repaired"),
+    ("bytes_dropped",       "Bytes read that weren't part of a frame"),
+    ("read_errors",         "Receivers stopped by a read error"),
+    ("uploads_sent",        "Sentences uploaded to HabHub"),
+    ("uploads_failed",      "Sentences that couldn't be uploaded (after retries)"),
+    ("uploads_dropped",     "Sentences not uploaded because too many were pending"),
+    ("commands_sent",       "Commands written to the receiver (every attempt)"),
+    ("commands_acked",      "Commands confirmed by the tracker"),
+    ("commands_failed",     "Commands not confirmed after every attempt"),
+])
+
+PREFIX = "argo2_"
+
+timer = timeit.default_timer
+
+
+
+# Latency histogram with fixed buckets (see 'BUCKETS')
+class Histogram(object):
+    __slots__ = ("counts", "count", "sum")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.count += 1
+        self.sum += value
+
+
+    # Estimate of quantile 'q' (0 - 1), interpolating inside the bucket it falls in (as Prometheus does)
+    def quantile(self, q):
+        if not self.count:
+            return 0.0
+
+        rank = q * self.count
+        cumulative = 0
+        for i, count in enumerate(self.counts):
+            if cumulative + count >= rank and count:
+                lower = BUCKETS[i - 1] if i > 0 else 0.0
+                if i == len(BUCKETS):
+                    return lower
+                return lower + (BUCKETS[i] - lower) * (rank - cumulative) / count
+            cumulative += count
+        return BUCKETS[-1]
+
+
+    def copy(self):
+        histogram = Histogram()
+        histogram.counts = list(self.counts)
+        histogram.count = self.count
+        histogram.sum = self.sum
+        return histogram
+
+
+
+# Counters and histograms of the whole Ground Station (see 'METRICS')
+# Stages are timed as:
+#     start = METRICS.start()
+#     ...
+#     METRICS.observe("parse", start)
+class Metrics(object):
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.since = time.time()            # When collection started (or was reset)
+
+        self.counters = dict((name, 0) for name in COUNTERS)
+        self.histograms = dict((stage, Histogram()) for stage in STAGES)
+        self.gauges = collections.OrderedDict()     # name -> (description, function returning current value)
+
+        self._lock = threading.Lock()
+
+
+    # Start (or stop) collecting. Collection starts from zero
+    def enable(self, enabled=True):
+        if enabled and not self.enabled:
+            self.reset()
+        self.enabled = enabled
+
+
+    def reset(self):
+        with self._lock:
+            self.counters = dict((name, 0) for name in COUNTERS)
+            self.histograms = dict((stage, Histogram()) for stage in STAGES)
+            self.since = time.time()
+
+
+    # Time at the start of a stage, to be passed to 'observe()' at its end (None if not collecting)
+    def start(self):
+        return timer() if self.enabled else None
+
+
+    # Record time taken by 'stage' since 'start' (from 'start()')
+    def observe(self, stage, start):
+        if start is None:
+            return
+        elapsed = timer() - start
+        with self._lock:
+            self.histograms[stage].observe(elapsed)
+
+
+    def count(self, name, n=1):
+        if not self.enabled:
+            return
+        with self._lock:
+            self.counters[name] += n
+
+
+    # Report the value returned by 'function' (read whenever metrics are exported)
+    def gauge(self, name, description, function):
+        self.gauges[name] = (description, function)
+
+
+    # Copy of (counters, histograms, gauge values)
+    def snapshot(self):
+        with self._lock:
+            counters = dict(self.counters)
+            histograms = dict((stage, histogram.copy()) for stage, histogram in self.histograms.iteritems())
+
+        gauges = collections.OrderedDict()
+        for name, (description, function) in self.gauges.items():
+            try:
+                gauges[name] = function()
+            except Exception:
+                continue
+        return counters, histograms, gauges
+
+
+    # Metrics in Prometheus' text exposition format
+    def prometheus(self):
+        counters, histograms, gauges = self.snapshot()
+        lines = []
+
+        for name, description in COUNTERS.iteritems():
+            lines.append("# HELP " + PREFIX + name + "_total " + description)
+            lines.append("# TYPE " + PREFIX + name + "_total counter")
+            lines.append(PREFIX + name + "_total " + str(counters[name]))
+
+        for name, value in gauges.iteritems():
+            lines.append("# HELP " + PREFIX + name + " " + self.gauges[name][0])
+            lines.append("# TYPE " + PREFIX + name + " gauge")
+            lines.append(PREFIX + name + " " + repr(float(value)))
+
+        name = PREFIX + "stage_seconds"
+        lines.append("# HELP " + name + " Time taken by each stage (" + ", ".join(STAGES) + ")")
+        lines.append("# TYPE " + name + " histogram")
+        for stage in STAGES:
+            histogram = histograms[stage]
+            label = 'stage="' + stage + '"'
+
+            cumulative = 0
+            for bound, count in zip(BUCKETS, histogram.counts):
+                cumulative += count
+                lines.append(name + '_bucket{' + label + ',le="' + repr(bound) + '"} ' + str(cumulative))
+            lines.append(name + '_bucket{' + label + ',le="+Inf"} ' + str(histogram.count))
+            lines.append(name + "_sum{" + label + "} " + repr(histogram.sum))
+            lines.append(name + "_count{" + label + "} " + str(histogram.count))
+
+        return "\n".join(lines) + "\n"
+
+
+    # Lines describing metrics (as shown in the Ground Station window)
+    def describe(self):
+        if not self.enabled:
+            return ["Not collecting"]
+
+        counters, histograms, gauges = self.snapshot()
+        elapsed = max(time.time() - self.since, 1e-9)
+
+        lines = ["%-8s %8s %8s %9s %9s" % ("Stage", "Count", "Per s", "p50 (ms)", "p99 (ms)")]
+        for stage in STAGES:
+            histogram = histograms[stage]
+            lines.append("%-8s %8d %8.1f %9.3f %9.3f" % (stage, histogram.count, histogram.count / elapsed,
+                                                         histogram.quantile(0.5) * 1000, histogram.quantile(0.99) * 1000))
+
+        lines.append("")
+        for name in COUNTERS:
+            lines.append("%-20s %8d" % (name, counters[name]))
+        for name, value in gauges.iteritems():
+            lines.append("%-20s %8d" % (name, value))
+
+        lines.append("")
+        lines.append("Collecting for " + str(int(elapsed)) + " s")
+        return lines
+
+
+METRICS = Metrics()
+
+
+
+# Thread rewriting 'path' with 'metrics' in Prometheus' text format every 'interval' seconds
+# The file is replaced at once, so readers never see half of it
+class MetricsFile(threading.Thread):
+
+    def __init__(self, path, metrics=METRICS, interval=5.0):
+        threading.Thread.__init__(self, name="MetricsFile")
+        self.daemon = True
+
+        self.path = path
+        self.metrics = metrics
+        self.interval = interval
+        self.error = None
+
+        self._halt = threading.Event()
+
+
+    def run(self):
+        while True:
+            self.write()
+            if self._halt.is_set():
+                break
+            self._halt.wait(self.interval)
+
+
+    def write(self):
+        temp_path = self.path + ".tmp"
+        try:
+            with open(temp_path, "w") as metrics_file:
+                metrics_file.write(self.metrics.prometheus())
+            if os.name == "nt" and os.path.exists(self.path):
+                os.remove(self.path)
+            os.rename(temp_path, self.path)
+        except (IOError, OSError) as e:
+            self.error = e
+
+
+    # Stop and write the metrics one last time
+    def stop(self, timeout=None):
+        self._halt.set()
+        self.join(timeout)
+
+
+
+# HTTP endpoint serving 'metrics' in Prometheus' text format at /metrics
+# Listens on 'host' only: this machine by default ("0.0.0.0" or "" for every interface)
+class MetricsServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port=9464, metrics=METRICS, host="127.0.0.1"):
+        BaseHTTPServer.HTTPServer.__init__(self, (host, port), MetricsHandler)
+        self.metrics = metrics
+        self._thread = None
+
+
+    @property
+    def url(self):
+        host = self.server_address[0]
+        if host in ("", "0.0.0.0"):
+            host = socket.gethostname()
+        return "http://" + host + ":" + str(self.server_address[1]) + "/metrics"
+
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, name="MetricsServer")
+        self._thread.daemon = True
+        self._thread.start()
+
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class MetricsHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    wbufsize = -1
+
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+
+        body = self.server.metrics.prometheus()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        return
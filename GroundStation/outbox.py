@@ -0,0 +1,209 @@
+'''
+Argo 2 Ground Station - Outbox
+
+Tomas Manterola
+
+Store-and-forward queue for HabHub uploads. Every sentence is saved to an SQLite database (WAL mode) before it is
+uploaded, and only removed once HabHub has accepted it. Sentences received while offline (or before a restart) are
+uploaded in bulk, at a limited rate, once the Ground Station is back online.
+
+'''
+
+
+import json
+import Queue
+import sqlite3
+import threading
+import time
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id          INTEGER PRIMARY KEY AUTOINCREMENT,
+    callsign    TEXT NOT NULL,
+    sentence    TEXT NOT NULL,
+    received    REAL NOT NULL,
+    metadata    TEXT NOT NULL DEFAULT '{}',
+    attempts    INTEGER NOT NULL DEFAULT 0,
+    next_try    REAL NOT NULL DEFAULT 0,
+    UNIQUE (callsign, sentence)
+)
+"""
+
+
+
+# Durable upload queue in front of a 'HabHubUploader'
+# 'add()', 'done()' and 'failed()' only put a command on a queue, so they never block the caller.
+# All database work and the submission of stored sentences to 'uploader' happens in a background thread.
+class Outbox(object):
+
+    def __init__(self, path, uploader, newest_first=True, rate=5.0, batch_size=50, max_in_flight=20, retry_delay=30.0):
+        self.path = path
+        self.uploader = uploader
+        self.newest_first = newest_first
+        self.rate = rate                    # Max. sentences submitted per second
+        self.batch_size = batch_size        # Sentences read from database at once
+        self.max_in_flight = max_in_flight  # Max. sentences submitted but not yet done/failed
+        self.retry_delay = retry_delay      # Seconds before a failed sentence is submitted again
+
+        self.backlog = 0                    # Sentences stored and not yet uploaded
+
+        self._commands = Queue.Queue()
+        self._online = threading.Event()
+        self._halt = threading.Event()
+        self._thread = None
+
+
+    # Open database and start background thread
+    def start(self):
+        self._halt.clear()
+        self._thread = threading.Thread(target=self._work, name="Outbox")
+        self._thread.daemon = True
+        self._thread.start()
+
+
+    # Stop background thread (commands already queued are written first)
+    def stop(self, timeout=None):
+        self._halt.set()
+        self._commands.put(None)
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+
+    @property
+    def online(self):
+        return self._online.is_set()
+
+
+    # Enable/disable uploading of stored sentences (sentences are stored either way)
+    def set_online(self, online):
+        if online:
+            self._online.set()
+        else:
+            self._online.clear()
+        self._commands.put(("wake",))
+
+
+    # Store sentence for upload (with optional 'metadata' dict, sent to HabHub along with the sentence)
+    def add(self, callsign, sentence, metadata=None):
+        self._commands.put(("add", callsign, sentence, time.time(), json.dumps(metadata or {})))
+
+
+    # Sentence was accepted by HabHub: remove it from the outbox
+    def done(self, callsign, sentence):
+        self._commands.put(("done", callsign, sentence))
+
+
+    # Sentence couldn't be uploaded: try again after 'retry_delay'
+    def failed(self, callsign, sentence):
+        self._commands.put(("failed", callsign, sentence))
+
+
+    # Background thread: apply queued commands and submit stored sentences to the uploader
+    def _work(self):
+        db = sqlite3.connect(self.path)
+        db.text_factory = str
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.execute(SCHEMA)
+
+        # Outboxes created before metadata was stored
+        if "metadata" not in [column[1] for column in db.execute("PRAGMA table_info(outbox)")]:
+            db.execute("ALTER TABLE outbox ADD COLUMN metadata TEXT NOT NULL DEFAULT '{}'")
+        db.commit()
+
+        self.backlog = db.execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+
+        in_flight = {}      # (callsign, sentence) -> id
+        batch = []          # Rows read from database, waiting to be submitted
+        next_submit = 0
+
+        while True:
+            # Wait for a command, or until the next sentence can be submitted
+            if self._online.is_set() and (batch or self.backlog > len(in_flight)) and len(in_flight) < self.max_in_flight:
+                wait = max(0, next_submit - time.time())
+            else:
+                wait = 1.0
+
+            try:
+                command = self._commands.get(timeout=wait)
+            except Queue.Empty:
+                command = ("wake",)
+
+            # Apply every command waiting, then commit them together
+            commands = [command]
+            while True:
+                try:
+                    commands.append(self._commands.get_nowait())
+                except Queue.Empty:
+                    break
+
+            for command in commands:
+                if command is None:
+                    continue
+
+                if command[0] == "add":
+                    cursor = db.execute("INSERT OR IGNORE INTO outbox (callsign, sentence, received, metadata) VALUES (?, ?, ?, ?)", command[1:])
+                    self.backlog += cursor.rowcount
+
+                    # Newest sentences go first: submit before anything already read from the database
+                    if cursor.rowcount and self.newest_first:
+                        batch.insert(0, (cursor.lastrowid, command[1], command[2], command[4]))
+
+                elif command[0] == "done":
+                    key = command[1:]
+                    row_id = in_flight.pop(key, None)
+                    if row_id is not None:
+                        cursor = db.execute("DELETE FROM outbox WHERE id = ?", (row_id,))
+                    else:
+                        cursor = db.execute("DELETE FROM outbox WHERE callsign = ? AND sentence = ?", key)
+                    self.backlog -= cursor.rowcount
+
+                elif command[0] == "failed":
+                    row_id = in_flight.pop(command[1:], None)
+                    if row_id is not None:
+                        db.execute("UPDATE outbox SET attempts = attempts + 1, next_try = ? WHERE id = ?", (time.time() + self.retry_delay, row_id))
+
+            db.commit()
+
+            if self._halt.is_set():
+                break
+
+            if not self._online.is_set():
+                batch = []
+                continue
+
+            # Submit stored sentences (at most 'rate' per second)
+            while len(in_flight) < self.max_in_flight and time.time() >= next_submit:
+                if not batch:
+                    batch = self._read_batch(db, in_flight)
+                    if not batch:
+                        # Nothing ready (rest is in flight or waiting to be retried)
+                        next_submit = time.time() + 1.0
+                        break
+
+                row_id, callsign, sentence, metadata = batch.pop(0)
+                if (callsign, sentence) in in_flight:
+                    continue
+
+                if not self.uploader.submit(callsign, sentence, json.loads(metadata)):
+                    # Uploader is busy: keep sentence and try again later
+                    batch.insert(0, (row_id, callsign, sentence, metadata))
+                    next_submit = time.time() + 1.0
+                    break
+
+                in_flight[(callsign, sentence)] = row_id
+                next_submit = time.time() + 1.0 / self.rate
+
+        db.close()
+
+
+    # Read next sentences to submit (excluding those already submitted or waiting to be retried)
+    def _read_batch(self, db, in_flight):
+        order = "DESC" if self.newest_first else "ASC"
+        rows = db.execute("SELECT id, callsign, sentence, metadata FROM outbox WHERE next_try <= ? ORDER BY id " + order + " LIMIT ?",
+                          (time.time(), self.batch_size + len(in_flight))).fetchall()
+
+        in_flight_ids = set(in_flight.values())
+        return [row for row in rows if row[0] not in in_flight_ids][:self.batch_size]
@@ -0,0 +1,122 @@
+'''
+Argo 2 Ground Station - Payloads
+
+Tomas Manterola
+
+Keeps the state of every payload (tracker) heard, keyed by callsign, so that several payloads transmitting on the same
+frequency don't overwrite each other's data. Each payload has its own latest record, recent sentences, upload counters,
+a history of its telemetry (see 'timeseries.py') and the quality of its link (see 'linkquality.py'). Sentences of every
+payload still go to the same sentence log (sentences.log), through a logger named after the payload. Memory is bounded:
+each payload keeps a fixed number of recent sentences and hours of history, and the payloads heard least recently are
+forgotten once there are more than 'max_payloads'.
+
+'''
+
+
+import collections
+import time
+
+import linkquality
+import timeseries
+
+
+# State of one payload
+class Payload(object):
+    __slots__ = ("callsign", "logger", "recent", "history", "link", "first_heard", "last_heard", "frames", "last_reception",
+                 "last_record", "uploads", "sent", "failed")
+
+    def __init__(self, callsign, logger, history, hours=timeseries.HOURS):
+        self.callsign = callsign
+        self.logger = logger                                # Logger of its sentences (same handlers as every payload's)
+        self.recent = collections.deque(maxlen=history)     # Most recent valid sentences
+        self.history = timeseries.for_hours(hours)          # Telemetry of sentences with a correct checksum
+        self.link = linkquality.LinkQuality()               # Sentences lost, checksum failures and RSSI (see 'ingest')
+        self.first_heard = None
+        self.last_heard = None
+        self.frames = 0
+        self.last_reception = None
+        self.last_record = None
+        self.uploads = 0                                    # Sentences waiting to be uploaded
+        self.sent = 0
+        self.failed = 0
+
+
+    # One-line summary
+    def describe(self):
+        text = self.callsign + ": " + str(self.frames) + " frames"
+        if self.last_record is not None:
+            text += ", last #" + str(self.last_record.sent_id) + " at " + str(int(self.last_record.altitude)) + " m"
+        if self.link.missing:
+            text += ", " + str(self.link.missing) + " lost"
+        text += ", " + str(self.sent) + " uploaded, " + str(self.failed) + " failed, " + str(self.uploads) + " waiting"
+        return text
+
+
+
+# Payloads by callsign, most recently heard last
+# New payloads are only added from sentences with a correct checksum ('add=True'), so that corrupted callsigns don't
+# show up as payloads. Each payload logs its sentences to a child of 'sentence_logger' ("sentence.[CALLSIGN]"), if given:
+# the child has no handlers of its own, so sentences end up in the same log, with the payload in the record's name.
+class PayloadRegistry(object):
+
+    def __init__(self, sentence_logger=None, max_payloads=16, history=100, hours=timeseries.HOURS):
+        self.sentence_logger = sentence_logger
+        self.max_payloads = max_payloads
+        self.history = history
+        self.hours = hours                              # Hours of telemetry history kept by each payload
+
+        self._payloads = collections.OrderedDict()      # callsign -> Payload
+
+
+    def __len__(self):
+        return len(self._payloads)
+
+
+    def __contains__(self, callsign):
+        return callsign in self._payloads
+
+
+    def __iter__(self):
+        return iter(self._payloads.values())
+
+
+    # Payload with 'callsign' (None if it hasn't been heard)
+    def get(self, callsign):
+        return self._payloads.get(callsign)
+
+
+    # Update payload of a Reception with a parsed record. Returns the Payload, or None if the payload is unknown and
+    # 'add' is False
+    def update(self, reception, add=True, now=None):
+        callsign = reception.record.callsign
+        now = now or time.time()
+
+        payload = self._payloads.pop(callsign, None)
+        if payload is None:
+            if not add:
+                return None
+            logger = self.sentence_logger.getChild(callsign) if self.sentence_logger is not None else None
+            payload = Payload(callsign, logger, self.history, self.hours)
+            payload.first_heard = now
+
+            # Forget payload heard least recently
+            if len(self._payloads) >= self.max_payloads:
+                self._payloads.popitem(last=False)
+
+        # Re-insert to keep payloads ordered by when they were last heard
+        self._payloads[callsign] = payload
+
+        payload.frames += 1
+        payload.last_heard = now
+        payload.last_reception = reception
+        payload.last_record = reception.record
+        payload.recent.append(reception.sentence)
+        if reception.crc_ok:
+            payload.history.append(reception.record, reception.rssi, now)
+
+        return payload
+
+
+    # Payload a sentence belongs to (by its first field), if it has been heard
+    def find(self, sentence):
+        return self._payloads.get(sentence.split(",", 1)[0])
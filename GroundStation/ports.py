@@ -0,0 +1,132 @@
+'''
+Argo 2 Ground Station - Ports
+
+Tomas Manterola
+
+Finds serial ports from the metadata the operating system keeps about them (through 'serial.tools.list_ports'), without
+opening any port. The list is cached and refreshed in the background, and ports plugged in or unplugged are reported
+as events, so a receiver that comes back under a different name (e.g. /dev/ttyUSB1 instead of /dev/ttyUSB0) can be
+found again by its USB serial number.
+Virtual receivers ('simulator.py') are listed too: they leave a link to their pseudo-terminal in the temp directory.
+
+'''
+
+
+import collections
+import glob
+import os
+import Queue
+import tempfile
+import threading
+
+from serial.tools import list_ports
+
+
+# Links to the pseudo-terminals of virtual receivers
+VIRTUAL_PORTS = os.path.join(tempfile.gettempdir(), "argo2-sim-*")
+
+
+
+# Serial port as described by the operating system
+class PortInfo(collections.namedtuple("PortInfo", "device description hwid serial_number")):
+    __slots__ = ()
+
+    # What identifies the device behind the port, even if it is re-enumerated under another name
+    @property
+    def identity(self):
+        if self.serial_number:
+            return self.serial_number
+        if self.hwid and self.hwid != "n/a":
+            return self.hwid
+        return self.device
+
+    # Name shown in port lists (e.g. "COM3 (USB-SERIAL CH340)")
+    def label(self):
+        if self.description and self.description not in ("n/a", self.device):
+            return self.device + " (" + self.description + ")"
+        return self.device
+
+
+# Serial ports currently available (device -> PortInfo)
+def scan():
+    ports = collections.OrderedDict()
+    for port in sorted(list_ports.comports(), key=lambda port: port.device):
+        ports[port.device] = PortInfo(port.device, port.description, port.hwid, getattr(port, "serial_number", None))
+
+    for device in sorted(glob.glob(VIRTUAL_PORTS)):
+        if os.path.exists(device):
+            ports[device] = PortInfo(device, "Argo 2 Simulator", "virtual", os.path.basename(device))
+    return ports
+
+
+
+# Keeps a cached list of serial ports up to date in the background
+# Changes are put on 'events' as ("added", PortInfo) or ("removed", PortInfo), and picked up with 'poll()'
+class PortMonitor(object):
+
+    def __init__(self, interval=1.0):
+        self.interval = interval            # Seconds between scans
+        self.ports = collections.OrderedDict()
+        self.events = Queue.Queue()
+
+        self._lock = threading.Lock()
+        self._halt = threading.Event()
+        self._thread = None
+
+
+    # Scan ports now and start scanning in the background
+    def start(self):
+        self.refresh()
+        self._halt.clear()
+        self._thread = threading.Thread(target=self._work, name="PortMonitor")
+        self._thread.daemon = True
+        self._thread.start()
+
+
+    def stop(self, timeout=None):
+        self._halt.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+
+    # Scan ports and report changes since the last scan. Returns list of ports available
+    def refresh(self):
+        with self._lock:
+            ports = scan()
+
+            for device, info in self.ports.iteritems():
+                if ports.get(device) != info:
+                    self.events.put(("removed", info))
+            for device, info in ports.iteritems():
+                if self.ports.get(device) != info:
+                    self.events.put(("added", info))
+
+            self.ports = ports
+        return ports.values()
+
+
+    # Changes reported since the last call, as list of (event, PortInfo)
+    def poll(self):
+        events = []
+        while True:
+            try:
+                events.append(self.events.get_nowait())
+            except Queue.Empty:
+                return events
+
+
+    # Port currently available with device 'identity' (see 'PortInfo.identity'), or None
+    def find(self, identity):
+        for info in self.ports.values():
+            if info.identity == identity:
+                return info
+        return None
+
+
+    def _work(self):
+        while not self._halt.wait(self.interval):
+            try:
+                self.refresh()
+            except (OSError, IOError):
+                continue
@@ -0,0 +1,131 @@
+'''
+Argo 2 Ground Station - QR Render
+
+Tomas Manterola
+
+Renders the location QR code shown in the Ground Station window in a background thread. Codes are cached by rounded
+coordinates (least recently used are evicted) and rendered at most once every 'min_interval' seconds, always for the
+latest position requested. The UI thread only turns the finished XBM image into a bitmap.
+
+'''
+
+
+import collections
+import Queue
+import threading
+import time
+
+import pyqrcode
+
+import metrics
+
+
+# Renders 'geo:' QR codes as XBM images
+# Positions are requested with 'request()' (only the latest one is rendered) and finished images are picked up with 'poll()'
+class QRRenderer(object):
+
+    def __init__(self, precision=5, scale=2, cache_size=64, min_interval=1.0):
+        self.precision = precision          # Decimals kept of each coordinate (5: ~1 m)
+        self.scale = scale
+        self.cache_size = cache_size
+        self.min_interval = min_interval    # Min. seconds between renders
+
+        self.rendered = 0
+        self.cache_hits = 0
+
+        self._cache = collections.OrderedDict()     # (latitude, longitude) -> XBM
+        self._request = None
+        self._shown = None
+        self._results = Queue.Queue()
+        self._wake = threading.Condition()
+        self._halt = False
+        self._thread = None
+
+
+    # Start render thread
+    def start(self):
+        self._halt = False
+        self._thread = threading.Thread(target=self._work, name="QRRenderer")
+        self._thread.daemon = True
+        self._thread.start()
+
+
+    # Stop render thread
+    def stop(self, timeout=None):
+        with self._wake:
+            self._halt = True
+            self._wake.notify()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+
+    # Ask for a QR code of position (latitude and longitude as text or numbers). Ignored if they aren't numbers
+    def request(self, latitude, longitude):
+        try:
+            key = (round(float(latitude), self.precision), round(float(longitude), self.precision))
+        except ValueError:
+            return
+
+        with self._wake:
+            self._request = key
+            self._wake.notify()
+
+
+    # XBM image of the latest position rendered, or None if there is nothing new to show
+    def poll(self):
+        xbm = None
+        while True:
+            try:
+                key, image = self._results.get_nowait()
+            except Queue.Empty:
+                break
+            if key != self._shown:
+                self._shown = key
+                xbm = image
+        return xbm
+
+
+    # Create QR code of a position (as XBM image)
+    def render(self, key):
+        text = "geo:%.*f,%.*f" % (self.precision, key[0], self.precision, key[1])
+        return pyqrcode.create(text).xbm(scale=self.scale)
+
+
+    # Render thread: render latest request (from the cache if possible), then wait 'min_interval'
+    def _work(self):
+        next_render = 0
+
+        while True:
+            with self._wake:
+                while self._request is None and not self._halt:
+                    self._wake.wait()
+                if self._halt:
+                    break
+
+            # Wait out the rate limit (requests arriving meanwhile replace this one)
+            wait = next_render - time.time()
+            if wait > 0:
+                time.sleep(wait)
+
+            with self._wake:
+                key = self._request
+                self._request = None
+            if key is None:
+                continue
+
+            xbm = self._cache.pop(key, None)
+            if xbm is None:
+                start = metrics.METRICS.start()
+                xbm = self.render(key)
+                metrics.METRICS.observe("qr", start)
+                self.rendered += 1
+                next_render = time.time() + self.min_interval
+
+                if len(self._cache) >= self.cache_size:
+                    self._cache.popitem(last=False)
+            else:
+                self.cache_hits += 1
+
+            self._cache[key] = xbm
+            self._results.put((key, xbm))
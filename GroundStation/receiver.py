@@ -0,0 +1,363 @@
+'''
+Argo 2 Ground Station - Receiver
+
+Tomas Manterola
+
+Reads data from the receivers in background threads so that the UI never waits on a serial port.
+The byte stream is split into frames ([SENTENCE];[RSSI]) which are handed over through a queue as soon as they arrive.
+Frames from several receivers are merged, keeping only the copy of each sentence with the best RSSI.
+Everything read can also be recorded, byte for byte and with timestamps, to a raw capture file (see 'replay.py').
+
+'''
+
+
+import collections
+import re
+import struct
+import threading
+import time
+
+import serial
+
+import crc16
+import metrics
+
+
+# Seconds a read may block before the reader checks whether it has been asked to stop
+READ_TIMEOUT = 0.2
+
+# Longest line the receiver can send: RH_RF95_MAX_MESSAGE_LEN (251) plus ';', RSSI and line ending
+MAX_LINE_LENGTH = 512
+
+# Frame sent by the receiver: printable sentence, ';' and RSSI (line ending removed)
+FRAME_FORMAT = re.compile(r"[\x20-\x7e]+;-?[0-9]+\Z")
+
+# Raw capture file: CAPTURE_MAGIC, then one record per read: CAPTURE_RECORD (time, length of port name, length of data)
+# followed by the port name and the data
+CAPTURE_MAGIC = b"ARGOCAP1\n"
+CAPTURE_RECORD = struct.Struct("<dHI")
+
+
+
+# Splits the byte stream from the receiver into frames
+# Data is kept in a single buffer between reads, so frames split across reads (or several frames in one read) are handled.
+# Anything that isn't a frame (e.g. "Error receiving message!" or line noise) is dropped and counted in 'dropped_bytes'.
+class LineFramer(object):
+
+    def __init__(self):
+        self.buffer = bytearray()
+
+        self.frames = 0
+        self.dropped_lines = 0
+        self.dropped_bytes = 0
+
+
+    # Add data read from the port and return list of complete frames found
+    def feed(self, data):
+        buf = self.buffer
+        buf.extend(data)
+
+        frames = []
+        view = memoryview(buf)
+        start = 0
+        end = buf.find(b"\n")
+
+        while end >= 0:
+            stop = end
+            if stop > start and buf[stop - 1] == 13:   # '\r'
+                stop -= 1
+
+            line = view[start:stop].tobytes()
+            if FRAME_FORMAT.match(line):
+                frames.append(line)
+            else:
+                self.dropped_lines += 1
+                self.dropped_bytes += end + 1 - start
+
+            start = end + 1
+            end = buf.find(b"\n", start)
+
+        # Buffer can't be resized while the view exists
+        del view
+
+        # Partial line too long to be a frame: drop it and resync on the next line ending
+        if len(buf) - start > MAX_LINE_LENGTH:
+            self.dropped_bytes += len(buf) - start
+            start = len(buf)
+
+        if start:
+            del buf[:start]
+
+        self.frames += len(frames)
+        return frames
+
+
+
+# Thread that blocks on an open serial port and puts every complete frame on 'frames' as (port, frame)
+# If reading fails, the error is kept in 'error', (port, None) is put on the queue and the thread exits
+# Data read is also written to 'capture' (a CaptureWriter), if set
+class SerialReader(threading.Thread):
+
+    def __init__(self, ser, frames, capture=None):
+        threading.Thread.__init__(self, name="SerialReader-" + str(ser.port))
+        self.daemon = True
+
+        self.ser = ser
+        self.port = ser.port
+        self.frames = frames
+        self.capture = capture
+        self.error = None
+        self.framer = LineFramer()
+
+        self._halt = threading.Event()
+
+
+    def run(self):
+        while not self._halt.is_set():
+            try:
+                # Wait for at least one byte, then take everything already waiting
+                data = self.ser.read(1)
+                if data and self.ser.in_waiting:
+                    data += self.ser.read(self.ser.in_waiting)
+            except (IOError, OSError, serial.SerialException) as e:
+                # Port closed on purpose while reading
+                if self._halt.is_set():
+                    return
+
+                self.error = e
+                self.frames.put((self.port, None))
+                return
+
+            if not data:
+                continue
+            start = metrics.METRICS.start()
+
+            capture = self.capture
+            if capture is not None:
+                capture.write(self.port, data)
+
+            for frame in self.framer.feed(data):
+                self.frames.put((self.port, frame))
+
+            metrics.METRICS.observe("read", start)
+
+
+    # Ask the reader to stop (takes effect within READ_TIMEOUT seconds)
+    def stop(self):
+        self._halt.set()
+
+
+
+# Records everything read from the receivers to a raw capture file (appending to it if it exists)
+# Can be shared by several readers
+class CaptureWriter(object):
+
+    def __init__(self, path):
+        self.path = path
+        self.records = 0
+        self.bytes = 0
+
+        self._file = open(path, "ab")
+        self._lock = threading.Lock()
+
+        if self._file.tell() == 0:
+            self._file.write(CAPTURE_MAGIC)
+            self._file.flush()
+
+
+    # Record 'data' read from 'port' (at time 'now', default: current time)
+    def write(self, port, data, now=None):
+        port = port.encode("utf-8") if not isinstance(port, bytes) else port
+        record = CAPTURE_RECORD.pack(now or time.time(), len(port), len(data)) + port + bytes(data)
+
+        with self._lock:
+            if self._file.closed:
+                return
+            self._file.write(record)
+            self._file.flush()
+            self.records += 1
+            self.bytes += len(data)
+
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+# Read raw capture file, yielding (time, port, data) for every record
+def read_capture(path):
+    with open(path, "rb") as capture:
+        if capture.read(len(CAPTURE_MAGIC)) != CAPTURE_MAGIC:
+            raise ValueError(path + " is not a raw capture file")
+
+        while True:
+            header = capture.read(CAPTURE_RECORD.size)
+            if len(header) < CAPTURE_RECORD.size:
+                return
+
+            timestamp, port_length, data_length = CAPTURE_RECORD.unpack(header)
+            port = capture.read(port_length)
+            data = capture.read(data_length)
+
+            # Capture was cut short (e.g. Ground Station was killed while writing)
+            if len(data) < data_length:
+                return
+
+            yield timestamp, port, data
+
+
+
+# Statistics of one receiver
+class ReceiverStats(object):
+    __slots__ = ("port", "frames", "selected", "duplicates", "dropped_bytes", "rssi_total", "rssi_count", "best_rssi", "last_rssi", "last_time")
+
+    def __init__(self, port):
+        self.port = port
+        self.frames = 0             # Frames received
+        self.selected = 0           # Frames kept (best copy of the sentence)
+        self.duplicates = 0         # Frames dropped (another receiver had a better copy)
+        self.dropped_bytes = 0      # Bytes that weren't part of a frame
+        self.rssi_total = 0
+        self.rssi_count = 0
+        self.best_rssi = None
+        self.last_rssi = None
+        self.last_time = None
+
+
+    def mean_rssi(self):
+        if not self.rssi_count:
+            return None
+        return float(self.rssi_total) / self.rssi_count
+
+
+    # One-line summary
+    def describe(self):
+        text = self.port + ": " + str(self.frames) + " frames, " + str(self.selected) + " kept, " + str(self.duplicates) + " duplicates"
+        if self.rssi_count:
+            text += ", RSSI mean " + str(int(round(self.mean_rssi()))) + " / best " + str(self.best_rssi) + " / last " + str(self.last_rssi) + " dBm"
+        if self.dropped_bytes:
+            text += ", " + str(self.dropped_bytes) + " bytes dropped"
+        return text
+
+
+
+# Merges frames from several receivers
+# Copies of the same sentence (same callsign, sentence ID and checksum) received within 'window' seconds of each other are
+# merged into the best copy: one with a correct checksum if there is any, and the best RSSI among those. Copies arriving later (up to 'memory' seconds) are dropped as duplicates.
+# Frames are added with 'add()' and come out of 'ready()' as (port, frame, copies) once their window is over.
+class FrameAggregator(object):
+
+    def __init__(self, window=0.3, memory=60.0):
+        self.window = window
+        self.memory = memory
+        self.stats = collections.OrderedDict()      # port -> ReceiverStats
+
+        self._pending = collections.OrderedDict()   # key -> [due, best port, best frame, (checksum ok, RSSI), ports]
+        self._seen = {}                             # key -> time after which it is forgotten
+        self._seen_order = collections.deque()
+        self._ready = []
+
+
+    # Statistics of receiver on 'port' (created if needed)
+    def receiver(self, port):
+        stats = self.stats.get(port)
+        if stats is None:
+            stats = self.stats[port] = ReceiverStats(port)
+        return stats
+
+
+    # Add frame received on 'port' at time 'now'
+    def add(self, port, frame, now):
+        stats = self.receiver(port)
+        stats.frames += 1
+        stats.last_time = now
+
+        sentence, _, rssi = frame.partition(";")
+        try:
+            rssi = int(rssi)
+            stats.rssi_total += rssi
+            stats.rssi_count += 1
+            stats.last_rssi = rssi
+            if stats.best_rssi is None or rssi > stats.best_rssi:
+                stats.best_rssi = rssi
+        except ValueError:
+            rssi = None
+
+        key = sentence_key(sentence)
+
+        # Malformed frames can't be matched with other copies
+        if key is None:
+            stats.selected += 1
+            self._ready.append((port, frame, 1))
+            return
+
+        # Copy of a sentence that has already been passed on
+        self._forget(now)
+        if key in self._seen:
+            stats.duplicates += 1
+            return
+
+        # Copies with bit errors have the same key: prefer a copy with a correct checksum over a stronger one
+        score = (crc16.check(sentence), rssi)
+
+        entry = self._pending.get(key)
+        if entry is None:
+            self._pending[key] = [now + self.window, port, frame, score, [port]]
+        else:
+            entry[4].append(port)
+            if score > entry[3]:
+                entry[1:4] = [port, frame, score]
+
+
+    # Time at which the next pending frame is ready (None if there are none)
+    def next_due(self):
+        if self._ready:
+            return 0
+        for entry in self._pending.itervalues():
+            return entry[0]
+        return None
+
+
+    # Frames whose window is over at time 'now', as (port, frame, copies)
+    def ready(self, now):
+        ready = self._ready
+        self._ready = []
+
+        while self._pending:
+            key, entry = next(self._pending.iteritems())
+            if entry[0] > now:
+                break
+            del self._pending[key]
+
+            due, port, frame, score, ports = entry
+            copies = len(set(ports))
+            self.stats[port].selected += 1
+            ports.remove(port)
+            for other in ports:
+                self.stats[other].duplicates += 1
+
+            self._seen[key] = now + self.memory
+            self._seen_order.append((now + self.memory, key))
+            ready.append((port, frame, copies))
+
+        return ready
+
+
+    def _forget(self, now):
+        while self._seen_order and self._seen_order[0][0] <= now:
+            expiry, key = self._seen_order.popleft()
+            if self._seen.get(key) == expiry:
+                del self._seen[key]
+
+
+# Key identifying copies of the same sentence: (callsign, sentence ID, checksum), or None if sentence is malformed
+def sentence_key(sentence):
+    data, sep, check_sum = sentence.rpartition("*")
+    if not sep:
+        return None
+
+    fields = data.split(",", 2)
+    if len(fields) < 3:
+        return None
+
+    return fields[0], fields[1], check_sum.upper()
@@ -0,0 +1,327 @@
+'''
+Argo 2 Ground Station - Replay
+
+Tomas Manterola
+
+Feeds a recorded flight back through the Ground Station (framing, repair, parsing, checksum, display/logging and upload)
+at the speed it was received, N times faster, or as fast as possible. Recordings can be:
+ - Raw captures (recorded with 'ingest.py --capture' or 'File->Record Raw Data'): every byte read from the receivers,
+   with timestamps, so receive problems can be reproduced exactly
+ - GroundStation.log: frames and RSSI as logged, with timestamps
+ - sentences.log: valid sentences only, without timestamps (replayed one every 'interval' seconds)
+
+Uploads can go to a local stand-in for HabHub that accepts every sentence, to load-test the Ground Station:
+
+    python replay.py capture.cap --speed 10
+    python replay.py GroundStation.log --speed 0 --stand-in
+
+'''
+
+
+import argparse
+import BaseHTTPServer
+import logging
+import re
+import SocketServer
+import threading
+import time
+
+import ingest
+import receiver
+import uploader
+
+
+# Port name of frames replayed from logs (raw captures keep the ports they were read from)
+REPLAY_PORT = "replay"
+
+# Line of GroundStation.log: time, level and message
+LOG_LINE = re.compile(r"(\d{4}-\d\d-\d\d \d\d:\d\d:\d\d),(\d{3}) \[\w+\] (.*)")
+RECEIVED_MESSAGE = re.compile(r"Received data: '(.*)'\Z")
+REPAIRED_MESSAGE = re.compile(r"Repaired \d-bit error in: '(.*)'\Z")
+RSSI_MESSAGE = re.compile(r" -> RSSI: (-?[0-9]+) dBm")
+
+
+
+# Read GroundStation.log, yielding (time, port, data) for every frame received (as the receiver sent it)
+def read_station_log(path):
+    with open(path) as log:
+        for item in parse_station_log(log):
+            yield item
+
+
+# Go through lines of GroundStation.log (from any file-like object or list), yielding (time, port, data) for every frame
+def parse_station_log(lines):
+    frame = None
+    frame_time = None
+    original = None
+
+    for line in lines:
+        match = LOG_LINE.match(line.rstrip("\r\n"))
+        if match is None:
+            continue
+
+        date, millis, message = match.groups()
+        timestamp = time.mktime(time.strptime(date, "%Y-%m-%d %H:%M:%S")) + int(millis) / 1000.0
+
+        repaired = REPAIRED_MESSAGE.match(message)
+        if repaired is not None:
+            original = repaired.group(1)
+            continue
+
+        received = RECEIVED_MESSAGE.match(message)
+        if received is not None:
+            if frame is not None:
+                yield frame_time, REPLAY_PORT, frame + "\n"
+
+            # Replay sentence as it was received, not as it was repaired
+            frame = original if original is not None else received.group(1)
+            frame_time = timestamp
+            original = None
+            continue
+
+        rssi = RSSI_MESSAGE.match(message)
+        if rssi is not None and frame is not None:
+            yield frame_time, REPLAY_PORT, frame + ";" + rssi.group(1) + "\n"
+            frame = None
+
+    if frame is not None:
+        yield frame_time, REPLAY_PORT, frame + "\n"
+
+
+# Read sentences.log, yielding (time, port, data) for every sentence, 'interval' seconds apart (with RSSI 'rssi')
+def read_sentence_log(path, interval=1.0, rssi=0):
+    with open(path) as log:
+        for i, line in enumerate(log):
+            sentence = line.strip()
+            if sentence:
+                yield i * interval, REPLAY_PORT, sentence + ";" + str(rssi) + "\n"
+
+
+# Kind of recording: "capture" (raw capture), "station" (GroundStation.log) or "sentences" (sentences.log)
+def recording_kind(path):
+    with open(path, "rb") as recording:
+        start = recording.read(64)
+
+    if start.startswith(receiver.CAPTURE_MAGIC):
+        return "capture"
+    if LOG_LINE.match(start):
+        return "station"
+    return "sentences"
+
+
+# Open recording of any kind (raw capture, GroundStation.log or sentences.log)
+def open_recording(path, interval=1.0):
+    kind = recording_kind(path)
+    if kind == "capture":
+        return receiver.read_capture(path)
+    if kind == "station":
+        return read_station_log(path)
+    return read_sentence_log(path, interval)
+
+
+
+# Thread that plays a recording into 'frames' (e.g. 'IngestEngine.frames') the way SerialReaders would
+# 'speed' is how many times faster than real time the recording is played (0: as fast as possible). At full speed no
+# more than 'max_pending' frames are queued at once, so a long recording doesn't end up in memory.
+class Replayer(threading.Thread):
+
+    def __init__(self, recording, frames, speed=1.0, max_pending=1000):
+        threading.Thread.__init__(self, name="Replayer")
+        self.daemon = True
+
+        self.recording = recording
+        self.frames = frames
+        self.speed = speed
+        self.max_pending = max_pending
+
+        self.framers = {}       # port -> LineFramer
+        self.bytes = 0
+        self.error = None
+        self.done = threading.Event()
+
+        self._halt = threading.Event()
+
+
+    def run(self):
+        start = None
+        first = None
+
+        try:
+            for timestamp, port, data in self.recording:
+                if self._halt.is_set():
+                    break
+
+                if self.speed:
+                    if start is None:
+                        start, first = time.time(), timestamp
+                    wait = start + (timestamp - first) / self.speed - time.time()
+                    if wait > 0 and self._halt.wait(wait):
+                        break
+                else:
+                    while self.frames.qsize() > self.max_pending and not self._halt.is_set():
+                        time.sleep(0.01)
+
+                framer = self.framers.get(port)
+                if framer is None:
+                    framer = self.framers[port] = receiver.LineFramer()
+
+                self.bytes += len(data)
+                for frame in framer.feed(data):
+                    self.frames.put((port, frame))
+
+        except (IOError, ValueError) as e:
+            self.error = e
+
+        finally:
+            self.done.set()
+
+
+    @property
+    def frame_count(self):
+        return sum(framer.frames for framer in self.framers.values())
+
+
+    def stop(self):
+        self._halt.set()
+
+
+
+# Local stand-in for the HabHub tracker: accepts every upload (answering "OK") and counts them
+class StandInServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port=0):
+        BaseHTTPServer.HTTPServer.__init__(self, ("127.0.0.1", port), StandInHandler)
+        self.received = 0
+        self._lock = threading.Lock()
+        self._thread = None
+
+
+    @property
+    def url(self):
+        return "http://127.0.0.1:" + str(self.server_address[1]) + "/transition/payload_telemetry"
+
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, name="StandInServer")
+        self._thread.daemon = True
+        self._thread.start()
+
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class StandInHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"   # Keep connections open, like HabHub
+    wbufsize = -1                   # Send each response at once (written line by line, it waits on delayed ACKs)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        with self.server._lock:
+            self.server.received += 1
+
+        body = "OK"
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        return
+
+
+
+# Replay 'recording' through 'engine' until it ends (and, if online, until uploads are done or 'upload_timeout' expires)
+# Returns (frames replayed, seconds taken to process them)
+def replay(engine, recording, speed=1.0, upload_timeout=30.0):
+    replayer = Replayer(recording, engine.frames, speed)
+    start = time.time()
+    replayer.start()
+
+    try:
+        while not (replayer.done.is_set() and engine.frames.empty() and engine.aggregator.next_due() is None):
+            engine.poll(0.1)
+        elapsed = time.time() - start
+
+        deadline = time.time() + upload_timeout
+        while engine.upload_outbox.online and engine.upload_outbox.backlog and time.time() < deadline:
+            engine.poll(0.1)
+
+    finally:
+        replayer.stop()
+
+    if replayer.error is not None:
+        engine.logger.error("Error while reading recording: " + str(replayer.error))
+
+    return replayer.frame_count, elapsed
+
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a recorded flight through the Argo 2 Ground Station.")
+    parser.add_argument("recording", help="raw capture, GroundStation.log or sentences.log")
+    parser.add_argument("--speed", type=float, default=1.0, help="times faster than real time (0: as fast as possible, default: 1)")
+    parser.add_argument("--interval", type=float, default=1.0, help="seconds between sentences replayed from sentences.log (default: 1)")
+    parser.add_argument("--callsign", default="REPLAY", help="callsign used when uploading (default: REPLAY)")
+    parser.add_argument("--repair", type=int, default=1, choices=[0, 1, 2], help="max. flipped bits to repair in sentences with a wrong checksum (default: 1)")
+    parser.add_argument("--outbox", default=":memory:", help="database of sentences waiting to be uploaded (default: in memory)")
+    parser.add_argument("--rate", type=float, default=5.0, help="max. sentences uploaded per second (default: 5)")
+    parser.add_argument("--quiet", action="store_true", help="only log the summary (and errors)")
+    upload = parser.add_mutually_exclusive_group()
+    upload.add_argument("--stand-in", action="store_true", help="upload to a local stand-in for HabHub")
+    upload.add_argument("--upload", metavar="URL", help="upload to URL (don't use HabHub's)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+    logger = logging.getLogger("Replay")
+
+    # Engine logs every upload
+    engine_logger = logging.getLogger("Replay.engine")
+    if args.quiet:
+        engine_logger.setLevel(logging.WARNING)
+
+    server = None
+    url = args.upload
+    if args.stand_in:
+        server = StandInServer()
+        server.start()
+        url = server.url
+
+    engine = ingest.IngestEngine(args.callsign, engine_logger, None, args.outbox, args.repair, upload_url=url or uploader.HABHUB_URL)
+    engine.upload_outbox.rate = args.rate
+    engine.set_online(url is not None)
+
+    if not args.quiet:
+        def log_event(event, data):
+            if event == "frame":
+                for line in ingest.describe(data):
+                    logger.info(line)
+            elif event == "upload" and not data[2]:
+                logger.error(ingest.describe_upload(data))
+        engine.subscribe(log_event)
+
+    engine.start()
+    try:
+        frames, elapsed = replay(engine, open_recording(args.recording, args.interval), args.speed)
+    except KeyboardInterrupt:
+        logger.info("Replay interrupted")
+        return
+    finally:
+        engine.stop()
+        if server is not None:
+            server.stop()
+
+    logger.info("Replayed " + str(frames) + " frames in " + "%.2f" % elapsed + " s (" + str(int(frames / max(elapsed, 1e-9))) + " frames/s)")
+    if url is not None:
+        logger.info("Uploaded " + str(engine.upload_pool.sent) + ", failed " + str(engine.upload_pool.failed) +
+                    ", not uploaded " + str(engine.upload_outbox.backlog))
+    if server is not None:
+        logger.info("Stand-in received " + str(server.received) + " uploads")
+
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,405 @@
+'''
+Argo 2 Ground Station - Reprocess
+
+Tomas Manterola
+
+Checks recorded flights again in bulk (sentences.log, GroundStation.log or raw captures, as many as given): frames are
+repaired, parsed and their checksums checked with the same code the Ground Station uses ('ingest.check_frame'), and
+summarized per payload: sentences received and lost, altitude, RSSI and time received.
+
+Work is spread over a pool of processes, one per core. Logs are split into chunks of a few MB, each starting on the
+first line of a frame, so a single large log is spread as well as many small ones (raw captures are checked whole).
+Every process reads its own chunk from disk and sends back only a summary, and summaries are merged in the order of
+the chunks (files in the order given), so results are the same whatever the number of processes:
+
+    python reprocess.py flights/*/sentences.log
+    python reprocess.py GroundStation.log --jobs 4 --output sentences-checked.log
+
+'''
+
+
+import argparse
+import array
+import collections
+import multiprocessing
+import os
+import signal
+import sys
+import time
+
+import ingest
+import linkquality
+import receiver
+import replay
+
+
+# Default size of the chunks logs are split into (bytes)
+CHUNK_SIZE = 4 * 1024 * 1024
+
+# Longest line looked back at when splitting logs (longer lines can't start a chunk)
+MAX_LINE = 4096
+
+# Seconds to wait for a result at a time (a wait without timeout can't be interrupted with Ctrl+C in Python 2)
+RESULT_WAIT = 1.0
+
+
+
+# Sentences with a correct checksum from one payload
+class PayloadSummary(object):
+
+    def __init__(self, callsign):
+        self.callsign = callsign
+        self.sentences = 0
+        self.sent_ids = array.array("l")        # Sent ID of every sentence, in the order received
+        self.first_time = None                  # Time range received (unknown for sentences.log)
+        self.last_time = None
+        self.max_altitude = None
+        self.rssi_total = 0
+        self.rssi_count = 0
+        self.min_rssi = None
+        self.max_rssi = None
+
+
+    # Add sentence 'record' (see 'telemetry.Parser') received at 'timestamp' with 'rssi' (either can be None)
+    def add(self, record, rssi, timestamp):
+        self.sentences += 1
+        self.sent_ids.append(record.sent_id)
+
+        if timestamp is not None:
+            self.first_time = timestamp if self.first_time is None else min(self.first_time, timestamp)
+            self.last_time = timestamp if self.last_time is None else max(self.last_time, timestamp)
+
+        if self.max_altitude is None or record.altitude > self.max_altitude:
+            self.max_altitude = record.altitude
+
+        if rssi is not None:
+            self.rssi_total += rssi
+            self.rssi_count += 1
+            self.min_rssi = rssi if self.min_rssi is None else min(self.min_rssi, rssi)
+            self.max_rssi = rssi if self.max_rssi is None else max(self.max_rssi, rssi)
+
+
+    # Add sentences of 'other', received after these
+    def merge(self, other):
+        self.sentences += other.sentences
+        self.sent_ids.extend(other.sent_ids)
+
+        for timestamp in (other.first_time, other.last_time):
+            if timestamp is not None:
+                self.first_time = timestamp if self.first_time is None else min(self.first_time, timestamp)
+                self.last_time = timestamp if self.last_time is None else max(self.last_time, timestamp)
+
+        if other.max_altitude is not None and (self.max_altitude is None or other.max_altitude > self.max_altitude):
+            self.max_altitude = other.max_altitude
+
+        self.rssi_total += other.rssi_total
+        self.rssi_count += other.rssi_count
+        for rssi in (other.min_rssi, other.max_rssi):
+            if rssi is not None:
+                self.min_rssi = rssi if self.min_rssi is None else min(self.min_rssi, rssi)
+                self.max_rssi = rssi if self.max_rssi is None else max(self.max_rssi, rssi)
+
+
+    # Sentences lost, from the sent IDs missing (see 'linkquality'). Only meaningful once every chunk is merged
+    def link(self):
+        link = linkquality.LinkQuality(windows=())
+        for sent_id in self.sent_ids:
+            link.receive(sent_id)
+        return link
+
+
+    # One-line summary
+    def describe(self):
+        link = self.link()
+        text = self.callsign + ": " + str(self.sentences) + " sentences, " + str(link.missing) + " lost"
+        if link.received:
+            text += " (" + linkquality.percent(link.loss_rate()) + ")"
+        if link.duplicates:
+            text += ", " + str(link.duplicates) + " duplicates"
+        if link.restarts:
+            text += ", " + str(link.restarts) + " tracker restart" + ("s" if link.restarts != 1 else "")
+        if self.max_altitude is not None:
+            text += ", max. altitude " + str(int(self.max_altitude)) + " m"
+        if self.rssi_count:
+            text += ", RSSI mean " + str(int(round(float(self.rssi_total) / self.rssi_count))) + " / min " + str(self.min_rssi) + " / max " + str(self.max_rssi) + " dBm"
+        if self.first_time is not None:
+            text += ", " + format_time(self.first_time) + " to " + format_time(self.last_time)
+        return text
+
+
+
+# Outcome of checking the frames of one chunk (or of several, merged)
+# Sentences with a correct checksum are kept in 'sentences' (in the order received) if 'keep' is True
+class Summary(object):
+
+    def __init__(self, keep=False):
+        self.keep = keep
+        self.frames = 0
+        self.malformed = 0
+        self.bad_crc = 0
+        self.repaired = 0
+        self.valid = 0
+        self.dropped_lines = 0                          # Lines that weren't frames
+        self.payloads = collections.OrderedDict()       # callsign -> PayloadSummary, first heard first
+        self.sentences = []
+        self.errors = []                                # Chunks that couldn't be read
+        self.chunks = 0
+
+
+    # Add a Reception (see 'ingest') received at 'timestamp' (RSSI is left out if 'rssi' is False)
+    def add(self, reception, timestamp, rssi=True):
+        self.frames += 1
+        if reception.record is None:
+            self.malformed += 1
+        if not reception.crc_ok:
+            self.bad_crc += 1
+        if reception.repaired:
+            self.repaired += 1
+
+        record = reception.record
+        if reception.crc_ok and record is not None:
+            self.valid += 1
+            payload = self.payloads.get(record.callsign)
+            if payload is None:
+                payload = self.payloads[record.callsign] = PayloadSummary(record.callsign)
+            payload.add(record, reception.rssi if rssi else None, timestamp)
+            if self.keep:
+                self.sentences.append(reception.sentence)
+
+
+    # Add results of 'other', a chunk after these (its sentences aren't kept)
+    def merge(self, other):
+        self.frames += other.frames
+        self.malformed += other.malformed
+        self.bad_crc += other.bad_crc
+        self.repaired += other.repaired
+        self.valid += other.valid
+        self.dropped_lines += other.dropped_lines
+        self.errors.extend(other.errors)
+        self.chunks += other.chunks
+
+        for callsign, theirs in other.payloads.iteritems():
+            mine = self.payloads.get(callsign)
+            if mine is None:
+                mine = self.payloads[callsign] = PayloadSummary(callsign)
+            mine.merge(theirs)
+
+
+    # Lines describing the results
+    def describe(self):
+        lines = [str(self.frames) + " frames: " + str(self.valid) + " valid, " + str(self.bad_crc) + " with a wrong checksum, " +
+                 str(self.malformed) + " malformed, " + str(self.repaired) + " repaired"]
+        if self.dropped_lines:
+            lines.append(str(self.dropped_lines) + " lines weren't frames")
+        for payload in self.payloads.itervalues():
+            lines.append(payload.describe())
+        for error in self.errors:
+            lines.append("Error: " + error)
+        return lines
+
+
+
+# Chunks of a recording to check, as tasks for 'check_chunk()': (path, kind, start, end) plus the options
+# Logs bigger than 'chunk_size' bytes are split (0: not split)
+def plan(path, chunk_size=CHUNK_SIZE, repair_errors=1, keep=False):
+    kind = replay.recording_kind(path)
+    size = os.path.getsize(path)
+
+    offsets = [0]
+    if kind != "capture" and chunk_size and size > chunk_size:
+        boundary = station_boundary if kind == "station" else None
+        with open(path, "rb") as log:
+            for offset in xrange(chunk_size, size, chunk_size):
+                offset = align(log, offset, boundary)
+                if offsets[-1] < offset < size:
+                    offsets.append(offset)
+    offsets.append(size)
+
+    return [(path, kind, start, end, repair_errors, keep) for start, end in zip(offsets[:-1], offsets[1:])]
+
+
+# Position of the first line at or after 'offset' that a chunk can start on (any line, unless 'boundary(previous line,
+# line)' says otherwise). The end of the file if there is none
+def align(log, offset, boundary=None):
+    log.seek(offset - 1)
+    log.readline()
+    position = log.tell()
+    if boundary is None:
+        return position
+
+    previous = line_before(log, position)
+    while True:
+        line = log.readline()
+        if not line or boundary(previous, line):
+            return position
+        previous = line
+        position = log.tell()
+
+
+# Line of 'log' ending at 'position' ("" if it is longer than MAX_LINE). Leaves 'log' at 'position'
+def line_before(log, position):
+    start = max(0, position - MAX_LINE)
+    log.seek(start)
+    if start:
+        log.readline()
+
+    previous = ""
+    while log.tell() < position:
+        previous = log.readline()
+    if log.tell() != position:
+        previous = ""
+
+    log.seek(position)
+    return previous
+
+
+# Whether a frame logged in GroundStation.log starts on 'line': a repaired frame starts with "Repaired ...", any other
+# with "Received data: ..."
+def station_boundary(previous, line):
+    message = log_message(line)
+    if message is None:
+        return False
+    if replay.REPAIRED_MESSAGE.match(message):
+        return True
+    if replay.RECEIVED_MESSAGE.match(message):
+        previous = log_message(previous)
+        return previous is None or not replay.REPAIRED_MESSAGE.match(previous)
+    return False
+
+
+# Message of a line of GroundStation.log (None if it isn't one)
+def log_message(line):
+    match = replay.LOG_LINE.match(line.rstrip("\r\n"))
+    return match.group(3) if match is not None else None
+
+
+# Recording data in a chunk, as (time, port, data) like 'replay.open_recording()'
+def read_chunk(path, kind, start, end):
+    if kind == "capture":
+        return receiver.read_capture(path)
+
+    with open(path, "rb") as log:
+        log.seek(start)
+        lines = log.read(end - start).splitlines(True)
+
+    if kind == "station":
+        return replay.parse_station_log(lines)
+
+    # sentences.log has no times or RSSI (left out of the summary)
+    return ((None, replay.REPLAY_PORT, line.strip() + ";0\n") for line in lines if line.strip())
+
+
+# Check every frame of a chunk (see 'plan()') and return its Summary (run in the worker processes)
+def check_chunk(task):
+    path, kind, start, end, repair_errors, keep = task
+    summary = Summary(keep)
+    summary.chunks = 1
+    rssi = kind != "sentences"
+    framers = {}        # port -> LineFramer
+
+    try:
+        for timestamp, port, data in read_chunk(path, kind, start, end):
+            framer = framers.get(port)
+            if framer is None:
+                framer = framers[port] = receiver.LineFramer()
+
+            for frame in framer.feed(data):
+                summary.add(ingest.check_frame(frame, port, 1, repair_errors), timestamp, rssi)
+
+    except (IOError, ValueError) as e:
+        summary.errors.append(path + " (" + str(start) + "-" + str(end) + "): " + str(e))
+
+    summary.dropped_lines = sum(framer.dropped_lines for framer in framers.itervalues())
+    return summary
+
+
+# Worker processes leave Ctrl+C to the main process, which stops them
+def ignore_interrupt():
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+# Check every chunk of 'tasks' (see 'plan()') in 'jobs' processes (one per core if None) and return the merged Summary
+# Sentences with a correct checksum are written to 'output' (a file), in order, if given
+def reprocess(tasks, jobs=None, output=None):
+    total = Summary()
+    pool = None
+    if jobs != 1 and len(tasks) > 1:
+        pool = multiprocessing.Pool(jobs, ignore_interrupt)
+
+    try:
+        if pool is None:
+            results = (check_chunk(task) for task in tasks)
+        else:
+            pending = pool.imap(check_chunk, tasks)
+            results = (next_result(pending) for task in tasks)
+
+        # Results come in the order of 'tasks', whichever process finishes first
+        for summary in results:
+            total.merge(summary)
+            if output is not None:
+                for sentence in summary.sentences:
+                    output.write(sentence + "\n")
+
+    # Every result is in by now (unless interrupted)
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+
+    return total
+
+
+# Next result of an iterator from 'Pool.imap()'
+def next_result(results):
+    while True:
+        try:
+            return results.next(RESULT_WAIT)
+        except multiprocessing.TimeoutError:
+            continue
+
+
+# Time as text
+def format_time(timestamp):
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(timestamp))
+
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check recorded flights again (repair, parse and checksums) on every core, and summarize them.")
+    parser.add_argument("recordings", nargs="+", metavar="recording", help="sentences.log, GroundStation.log or raw capture (checked in the order given)")
+    parser.add_argument("--jobs", type=int, default=multiprocessing.cpu_count(), help="processes to use (default: one per core)")
+    parser.add_argument("--chunk-size", type=float, default=CHUNK_SIZE / 1024.0 / 1024, metavar="MB", help="split logs into chunks of about MB megabytes (default: 4, 0: don't split)")
+    parser.add_argument("--repair", type=int, default=1, choices=[0, 1, 2], help="max. flipped bits to repair in sentences with a wrong checksum (default: 1)")
+    parser.add_argument("--output", metavar="PATH", help="write sentences with a correct checksum (repaired, if they were) to PATH, in the order received")
+    args = parser.parse_args()
+
+    if args.jobs < 1:
+        parser.error("--jobs must be at least 1")
+
+    start = time.time()
+    tasks = []
+    for path in args.recordings:
+        try:
+            tasks.extend(plan(path, int(args.chunk_size * 1024 * 1024), args.repair, args.output is not None))
+        except (IOError, OSError) as e:
+            parser.error(str(e))
+
+    output = open(args.output, "w") if args.output else None
+    try:
+        summary = reprocess(tasks, args.jobs, output)
+    except KeyboardInterrupt:
+        sys.exit("Interrupted")
+    finally:
+        if output is not None:
+            output.close()
+    elapsed = time.time() - start
+
+    for line in summary.describe():
+        print(line)
+    print("Checked " + str(len(args.recordings)) + " files (" + str(summary.chunks) + " chunks) in " + "%.2f" % elapsed + " s with " +
+          str(min(args.jobs, len(tasks))) + " processes (" + str(int(summary.frames / max(elapsed, 1e-9))) + " frames/s)")
+
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,437 @@
+'''
+Argo 2 Ground Station - Simulator
+
+Tomas Manterola
+
+Virtual receiver for testing the Ground Station without a tracker or receiver. It opens a pseudo-terminal (listed by
+the Ground Station as "Argo 2 Simulator") and writes frames the way the receiver firmware does ([SENTENCE];[RSSI],
+'Serial.println()' line endings), with sentences built the way the tracker firmware builds them ('sprintf()'/'dtostrf()'
+formats and CRC16 checksum). Position and sensor data follow a simulated ascent, burst and descent.
+
+Commands written by the Ground Station ([TX_POWER];[ID],[VALUE]) get a checksum added, as the receiver would, and are
+passed to the simulated tracker, which acknowledges them in the ACK field of its next sentence.
+
+    python simulator.py --rate 5 --corrupt 0.1
+    python ingest.py /tmp/argo2-sim-1234            (port printed by the simulator)
+
+Frame rate, burst size, corrupted frames, receive errors and flight profile can be changed (see --help). Only runs on
+systems with pseudo-terminals (Linux, Mac).
+
+'''
+
+
+import argparse
+import errno
+import fcntl
+import math
+import os
+import pty
+import random
+import select
+import time
+import tty
+
+import crc16
+import ports
+
+
+# Tracker states (as in the tracker firmware)
+STATE_STANDBY       = 0
+STATE_RISING        = 1
+STATE_FALLING_HIGH  = 2
+STATE_FALLING_LOW   = 3
+STATE_LANDING       = 4
+
+# Command IDs (as in the tracker firmware)
+COMMAND_ID_TX_POWER     = 0
+COMMAND_ID_GPS_MODE     = 1
+COMMAND_ID_GPS_POWER    = 2
+COMMAND_ID_BUZZER       = 3
+COMMAND_ID_MODE         = 4
+
+RECEIVE_ERROR = "Error receiving message!"
+
+# Scale height (m) of the atmosphere's density, used for the descent rate under parachute
+DENSITY_SCALE_HEIGHT = 7238.0
+
+
+
+# Simulated flight: standby on the ground, ascent at a constant rate, burst and descent under parachute (faster where
+# the air is thinner), drifting with the wind while in the air
+class FlightProfile(object):
+
+    def __init__(self, ascent_rate=5.0, burst_altitude=30000.0, descent_rate=5.0, launch_altitude=500.0,
+                 latitude=-33.4489, longitude=-70.6693, wind=8.0, wind_direction=90.0, standby=300.0):
+        self.ascent_rate = ascent_rate          # m/s
+        self.burst_altitude = burst_altitude    # m
+        self.descent_rate = descent_rate        # m/s at sea level
+        self.launch_altitude = launch_altitude  # m
+        self.latitude = latitude
+        self.longitude = longitude
+        self.wind = wind                        # m/s
+        self.wind_direction = wind_direction    # Degrees (direction the payload drifts to)
+        self.standby = standby                  # Seconds on the ground before launch
+
+        self.burst_time = standby + (burst_altitude - launch_altitude) / ascent_rate
+
+        # Descent: dh/dt = -descent_rate * exp(h / 2H), so exp(-h / 2H) grows linearly with time
+        self._scale = 2 * DENSITY_SCALE_HEIGHT
+        self.landing_time = self.burst_time + self._scale * (math.exp(-launch_altitude / self._scale) -
+                                                             math.exp(-burst_altitude / self._scale)) / descent_rate
+
+
+    # Altitude (m) 't' seconds after power on
+    def altitude(self, t):
+        if t <= self.standby or t >= self.landing_time:
+            return self.launch_altitude
+        if t <= self.burst_time:
+            return self.launch_altitude + (t - self.standby) * self.ascent_rate
+
+        fallen = self.descent_rate * (t - self.burst_time) / self._scale
+        return -self._scale * math.log(math.exp(-self.burst_altitude / self._scale) + fallen)
+
+
+    # Position (latitude, longitude) 't' seconds after power on
+    def position(self, t):
+        airborne = min(max(t, self.standby), self.landing_time) - self.standby
+        distance = self.wind * airborne
+        direction = math.radians(self.wind_direction)
+
+        latitude = self.latitude + distance * math.cos(direction) / 111320.0
+        longitude = self.longitude + distance * math.sin(direction) / (111320.0 * math.cos(math.radians(self.latitude)))
+        return latitude, longitude
+
+
+    # Horizontal speed (m/s) 't' seconds after power on
+    def speed(self, t):
+        return self.wind if self.standby < t < self.landing_time else 0.0
+
+
+    # Distance (m) from the launch site (where the receiver is) 't' seconds after power on
+    def distance(self, t):
+        airborne = min(max(t, self.standby), self.landing_time) - self.standby
+        return math.hypot(self.wind * airborne, self.altitude(t) - self.launch_altitude)
+
+
+    # Temperature (Celsius) and pressure (hPa) at 'altitude' (standard atmosphere)
+    @staticmethod
+    def atmosphere(altitude):
+        if altitude < 11000:
+            return 15.0 - 0.0065 * altitude, 1013.25 * (1 - 2.25577e-5 * altitude) ** 5.25588
+        return -56.5, 226.32 * math.exp(-(altitude - 11000) / 6341.6)
+
+
+
+# Simulated tracker: builds sentences like the tracker firmware, and receives commands
+class Tracker(object):
+
+    def __init__(self, callsign="ARGO2", profile=None, interval=30, start=None, rng=None):
+        self.callsign = callsign
+        self.profile = profile or FlightProfile()
+        self.interval = interval                # Seconds of flight between sentences
+        self.start = time.time() if start is None else start     # GPS time at power on
+        self.rng = rng or random.Random()
+
+        self.sent_id = 1
+        self.rx_ack = 0
+        self.state = STATE_STANDBY
+        self.tx_power = 23
+        self.gps_mode = 0
+        self.gps_power = 0
+        self.buzzer = False
+        self.last_altitude = self.profile.launch_altitude
+
+        self.commands = 0                       # Commands received with a correct checksum
+        self.acknowledged = 0
+
+
+    # Seconds of flight at the current sentence
+    @property
+    def flight_time(self):
+        return (self.sent_id - 1) * self.interval
+
+
+    # Build next sentence ([FIELD],[FIELD],...*[CRC])
+    def sentence(self):
+        t = self.flight_time
+        profile = self.profile
+
+        altitude = profile.altitude(t)
+        v_speed = (altitude - self.last_altitude) / float(self.interval)
+        latitude, longitude = profile.position(t)
+        ext_temp, pressure = profile.atmosphere(altitude)
+        humidity = max(0.0, 60.0 - altitude / 500.0)
+        v_bat = 4.2 - 0.6 * t / 86400.0
+        satellites = self.rng.randint(6, 12)
+
+        self._update_state(altitude, v_speed)
+        status = "%u%02u%u%u%d" % (self.state, self.tx_power, self.gps_mode, self.gps_power, self.buzzer)
+
+        # Same formats as 'sprintf()' and 'dtostrf()' in the tracker firmware
+        data = ",".join([
+            self.callsign,
+            "%u" % self.sent_id,
+            time.strftime("%H:%M:%S", time.gmtime(self.start + t)),
+            "%9.7f" % latitude,
+            "%9.7f" % longitude,
+            "%3.1f" % altitude,
+            "%3.1f" % v_speed,
+            "%3.1f" % profile.speed(t),
+            "%3.1f" % profile.wind_direction,
+            "%4.2f" % ext_temp,
+            "%3.1f" % 0,                        # Internal temperature isn't measured
+            "%3.1f" % pressure,
+            "%3.1f" % humidity,
+            "%4.2f" % v_bat,
+            "%d" % satellites,
+            status,
+            "%u" % self.rx_ack,
+        ])
+
+        self.sent_id += 1
+        self.last_altitude = altitude
+        self.rx_ack = 0
+
+        return data + "*" + crc16.crc16_hex(data)
+
+
+    # State machine of the tracker (simplified)
+    def _update_state(self, altitude, v_speed):
+        if self.state == STATE_STANDBY and altitude > self.profile.launch_altitude + 500:
+            self.state = STATE_RISING
+        elif self.state == STATE_RISING and v_speed < 0:
+            self.state = STATE_FALLING_HIGH if altitude > 9000 else STATE_FALLING_LOW
+        elif self.state == STATE_FALLING_HIGH and altitude < 9000:
+            self.state = STATE_FALLING_LOW
+        elif self.state == STATE_FALLING_LOW and altitude < 2000:
+            self.state = STATE_LANDING
+            self.buzzer = True
+
+
+    # Receive command sent by the receiver ([ID],[VALUE]*[CRC]). Returns whether it was acknowledged
+    # Follows the tracker firmware, including its quirks: a mode command (ID 4) falls through to the invalid ID case, so
+    # it is carried out but not acknowledged.
+    def receive(self, message):
+        if len(message) <= 5 or "*" not in message:
+            return False
+        if message[-4:] != crc16.crc16_hex(message[:-5]):
+            return False
+
+        self.commands += 1
+
+        if len(message) not in (3 + 5, 4 + 5):
+            return False
+
+        try:
+            command_id = int(message[0])
+            value = int(message[2:-5])
+        except ValueError:
+            return False
+
+        acknowledged = True
+
+        if command_id == COMMAND_ID_TX_POWER:
+            self.tx_power = value
+        elif command_id == COMMAND_ID_GPS_MODE:
+            if value in (0, 1):
+                self.gps_mode = value
+        elif command_id == COMMAND_ID_GPS_POWER:
+            if value in (0, 1):
+                self.gps_power = value
+        elif command_id == COMMAND_ID_BUZZER:
+            if value in (0, 1):
+                self.buzzer = bool(value)
+        elif command_id == COMMAND_ID_MODE:
+            if STATE_STANDBY <= value <= STATE_LANDING:
+                self.state = value
+            acknowledged = False
+        else:
+            acknowledged = False
+
+        if acknowledged:
+            self.rx_ack += 1
+            self.acknowledged += 1
+        return acknowledged
+
+
+
+# Pseudo-terminal acting as a receiver for one or more trackers
+# Every 1 / 'rate' seconds 'burst' frames are written (trackers take turns). A 'corrupt' fraction of frames get 1 or 2
+# flipped bits and an 'errors' fraction are replaced by the receiver's receive error message.
+class VirtualReceiver(object):
+
+    def __init__(self, trackers, rate=1.0, burst=1, corrupt=0.0, errors=0.0, uplink_loss=0.0, rng=None):
+        self.trackers = trackers
+        self.rate = rate
+        self.burst = burst
+        self.corrupt = corrupt
+        self.errors = errors
+        self.uplink_loss = uplink_loss          # Fraction of commands lost on the way to the tracker
+        self.rng = rng or random.Random()
+
+        self.port = None                        # Link to the pseudo-terminal (opened by the Ground Station)
+        self.frames = 0
+        self.corrupted = 0
+        self.receive_errors = 0
+        self.overflows = 0                      # Frames dropped because nobody was reading the port
+        self.commands = 0
+
+        self._master = None
+        self._slave = None
+        self._uplink = ""
+        self._next = 0
+
+
+    # Open pseudo-terminal and link to it from where the Ground Station looks for virtual receivers
+    def open(self):
+        self._master, self._slave = pty.openpty()
+        tty.setraw(self._slave)     # No echo or line ending translation, like a real serial port
+
+        flags = fcntl.fcntl(self._master, fcntl.F_GETFL)
+        fcntl.fcntl(self._master, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+
+        self.port = ports.VIRTUAL_PORTS.replace("*", str(os.getpid()))
+        if os.path.lexists(self.port):
+            os.remove(self.port)
+        os.symlink(os.ttyname(self._slave), self.port)
+
+
+    def close(self):
+        if self.port is not None and os.path.lexists(self.port):
+            os.remove(self.port)
+        for fd in (self._master, self._slave):
+            if fd is not None:
+                os.close(fd)
+        self._master = self._slave = None
+
+
+    # Next frame as the receiver would write it
+    def frame(self, tracker):
+        sentence = tracker.sentence()
+
+        if self.rng.random() < self.errors:
+            self.receive_errors += 1
+            return RECEIVE_ERROR + "\r\n"
+
+        if self.rng.random() < self.corrupt:
+            data = bytearray(sentence)
+            for i in xrange(self.rng.choice((1, 2))):
+                bit = self.rng.randrange(8 * len(data))
+                data[bit // 8] ^= 1 << (bit % 8)
+            sentence = str(data)
+            self.corrupted += 1
+
+        # Signal gets weaker with distance (free space) and with lower transmit power
+        distance = max(tracker.profile.distance(tracker.flight_time), 100.0)
+        rssi = -40 - 20 * math.log10(distance / 100.0) + (tracker.tx_power - 23) + self.rng.gauss(0, 2)
+        rssi = int(min(-30, max(-137, rssi)))
+
+        return sentence + ";" + str(rssi) + "\r\n"
+
+
+    # Write frames and handle commands for 'duration' seconds or 'count' frames (forever if both are None)
+    def run(self, duration=None, count=None):
+        end = time.time() + duration if duration is not None else None
+        self._next = time.time()
+        turn = 0
+
+        while (end is None or time.time() < end) and (count is None or self.frames < count):
+            # Wait for the next burst, handling commands meanwhile
+            wait = self._next - time.time()
+            if wait > 0:
+                readable, _, _ = select.select([self._master], [], [], wait)
+                if readable:
+                    self._read_uplink()
+                continue
+
+            for i in xrange(self.burst):
+                tracker = self.trackers[turn % len(self.trackers)]
+                turn += 1
+                self._write(self.frame(tracker))
+                self.frames += 1
+                if count is not None and self.frames >= count:
+                    break
+
+            self._next += 1.0 / self.rate
+
+
+    def _write(self, data):
+        try:
+            os.write(self._master, data)
+        except OSError as e:
+            if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                raise
+            self.overflows += 1
+
+
+    # Read commands from the Ground Station ([TX_POWER];[MSG]) and send them to the trackers
+    def _read_uplink(self):
+        try:
+            self._uplink += os.read(self._master, 1024)
+        except OSError as e:
+            if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EIO):
+                raise
+            return
+
+        while "\n" in self._uplink:
+            line, self._uplink = self._uplink.split("\n", 1)
+            tx_power, _, message = line.partition(";")
+            self.commands += 1
+
+            # Receiver adds checksum before transmitting
+            message += "*" + crc16.crc16_hex(message)
+
+            for tracker in self.trackers:
+                if self.rng.random() >= self.uplink_loss:
+                    tracker.receive(message)
+
+
+    # One-line summary
+    def describe(self):
+        text = str(self.frames) + " frames (" + str(self.corrupted) + " corrupted, " + str(self.receive_errors) + " receive errors"
+        if self.overflows:
+            text += ", " + str(self.overflows) + " not read"
+        text += "), " + str(self.commands) + " commands ("
+        text += ", ".join(tracker.callsign + ": " + str(tracker.acknowledged) + " acknowledged" for tracker in self.trackers) + ")"
+        return text
+
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Virtual Argo 2 receiver: writes simulated tracker frames to a pseudo-terminal.")
+    parser.add_argument("--callsign", nargs="+", default=["ARGO2"], help="callsign of each simulated tracker (default: ARGO2)")
+    parser.add_argument("--rate", type=float, default=1.0, help="bursts of frames per second (default: 1)")
+    parser.add_argument("--burst", type=int, default=1, help="frames per burst (default: 1)")
+    parser.add_argument("--corrupt", type=float, default=0.0, help="fraction of frames with flipped bits (default: 0)")
+    parser.add_argument("--errors", type=float, default=0.0, help="fraction of frames lost with a receive error (default: 0)")
+    parser.add_argument("--uplink-loss", type=float, default=0.0, help="fraction of commands that don't reach the tracker (default: 0)")
+    parser.add_argument("--interval", type=int, default=30, help="seconds of flight between sentences (default: 30, as the tracker)")
+    parser.add_argument("--ascent-rate", type=float, default=5.0, help="m/s (default: 5)")
+    parser.add_argument("--burst-altitude", type=float, default=30000.0, help="m (default: 30000)")
+    parser.add_argument("--descent-rate", type=float, default=5.0, help="m/s at sea level (default: 5)")
+    parser.add_argument("--count", type=int, help="stop after this many frames")
+    parser.add_argument("--duration", type=float, help="stop after this many seconds")
+    parser.add_argument("--seed", type=int, help="random seed (for repeatable runs)")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    profile = FlightProfile(args.ascent_rate, args.burst_altitude, args.descent_rate)
+    start = time.time() if args.seed is None else 0
+    trackers = [Tracker(callsign, profile, args.interval, start, rng) for callsign in args.callsign]
+
+    receiver = VirtualReceiver(trackers, args.rate, args.burst, args.corrupt, args.errors, args.uplink_loss, rng)
+    receiver.open()
+    print("Virtual receiver on " + receiver.port + " (" + os.ttyname(receiver._slave) + ")")
+
+    try:
+        receiver.run(args.duration, args.count)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        receiver.close()
+        print(receiver.describe())
+
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,168 @@
+'''
+Argo 2 Ground Station - Telemetry
+
+Tomas Manterola
+
+Parser for sentences sent by the tracker, compiled from a declarative schema of the sentence's fields.
+Each sentence is split in a single pass and converted into a compact, typed record (floats and ints rather than text).
+If a sentence is malformed, the error names the field that couldn't be parsed.
+
+Can also be run to measure parser throughput on a log of sentences:
+
+    python telemetry.py sentences.log
+
+'''
+
+
+import collections
+import sys
+import time
+
+
+# Fields of a sentence, in order, as (name, type, unit)
+# Example: ARGO2,10000,22:22:22,-92.1232322,-90.2322323,30000,-12.0,12.0,32.4,-20.25,-10.1,300.0,56.4,4.32,10,5,1*b762
+SCHEMA = [
+    ("callsign",    str,    ""),        # 0.  Name of Capsule
+    ("sent_id",     int,    ""),        # 1.  Sentence ID (number)
+    ("time",        str,    ""),        # 2.  Time (hh:mm:ss)
+    ("latitude",    float,  ""),        # 3.  Latitude (decimal)
+    ("longitude",   float,  ""),        # 4.  Longitude (decimal)
+    ("altitude",    float,  "m"),       # 5.  Altitude (meters)
+    ("v_speed",     float,  "m/s"),     # 6.  Vertical speed (meters per second)
+    ("speed",       float,  "m/s"),     # 7.  Speed (meters per second)
+    ("course",      float,  "deg"),     # 8.  Course (degrees)
+    ("ext_temp",    float,  "C"),       # 9.  External temperature (Celsius)
+    ("int_temp",    float,  "C"),       # 10. Internal temperature (Celsius)
+    ("pressure",    float,  "hPa"),     # 11. Pressure (hPa)
+    ("humidity",    float,  "%"),       # 12. Humidity (percent)
+    ("v_bat",       float,  "V"),       # 13. Battery voltage (volts)
+    ("sat_num",     int,    ""),        # 14  Satellite Number (#)
+    ("status",      str,    ""),        # 15. Status of Capsule ([STATE][TX_POWER][GPS_MODE][GPS_POWER][BUZZER])
+    ("ACK",         int,    ""),        # 16. Acknowledge Message Received (number of commands received since last sentence)
+    ("crc",         str,    ""),        # 17. Checksum (crc16-ccitt - 4 characters)
+]
+
+
+
+# Raised when a sentence doesn't match the schema. 'field' is the name of the first field that couldn't be parsed
+# (None if the sentence has the wrong number of fields)
+class ParseError(ValueError):
+
+    def __init__(self, message, field=None, value=None):
+        ValueError.__init__(self, message)
+        self.field = field
+        self.value = value
+
+
+
+# Parser compiled from a schema. Records are namedtuples with one (typed) item per field
+class Parser(object):
+
+    def __init__(self, schema):
+        self.schema = schema
+        self.names = [field[0] for field in schema]
+        self.types = [field[1] for field in schema]
+        self.units = [field[2] for field in schema]
+
+        self.record = collections.namedtuple("Telemetry", self.names)
+        self._make = self.record._make
+
+        # Fields that are already text don't need converting
+        self._converters = [None if kind is str else kind for kind in self.types]
+
+
+    # Split sentence ([FIELD],[FIELD],...*[CRC]) into list of text fields
+    def split(self, sentence):
+        data, sep, check_sum = sentence.rpartition("*")
+        if not sep:
+            raise ParseError("No checksum found", "crc", sentence)
+
+        fields = data.split(",")
+        fields.append(check_sum)
+
+        if len(fields) != len(self.names):
+            raise ParseError("Wrong number of fields: " + str(len(fields)) + " (expected " + str(len(self.names)) + ")")
+
+        return fields
+
+
+    # Convert list of text fields (from 'split()') into a typed record
+    def convert(self, fields):
+        try:
+            return self._make([value if convert is None else convert(value) for convert, value in zip(self._converters, fields)])
+
+        except ValueError:
+            # Find which field is malformed
+            for name, convert, value in zip(self.names, self._converters, fields):
+                try:
+                    if convert is not None:
+                        convert(value)
+                except ValueError:
+                    raise ParseError("Invalid " + name + ": '" + value + "'", name, value)
+            raise
+
+
+    # Parse sentence into a typed record
+    def parse(self, sentence):
+        return self.convert(self.split(sentence))
+
+
+    # Check whether sentence matches the schema
+    def valid(self, sentence):
+        try:
+            self.parse(sentence)
+            return True
+        except ParseError:
+            return False
+
+
+PARSER = Parser(SCHEMA)
+
+
+# Split frame sent by the receiver ([SENTENCE];[RSSI]) into sentence and RSSI (as an int)
+def split_frame(frame):
+    sentence, sep, rssi = frame.partition(";")
+    if not sep:
+        raise ParseError("No RSSI found", "rssi", frame)
+
+    try:
+        return sentence, int(rssi)
+    except ValueError:
+        raise ParseError("Invalid rssi: '" + rssi.strip() + "'", "rssi", rssi)
+
+
+# Parse every sentence in 'sentences' for at least 'seconds' and return (frames per second, number of malformed sentences)
+def measure_throughput(sentences, seconds=1.0, parser=PARSER):
+    frames = 0
+    malformed = None
+    start = time.time()
+
+    while True:
+        errors = 0
+        for sentence in sentences:
+            try:
+                parser.parse(sentence)
+            except ParseError:
+                errors += 1
+
+        if malformed is None:
+            malformed = errors
+        frames += len(sentences)
+
+        elapsed = time.time() - start
+        if elapsed >= seconds or not sentences:
+            break
+
+    return frames / max(elapsed, 1e-9), malformed
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2:
+        print("Usage: python telemetry.py [SENTENCE LOG]")
+        sys.exit(1)
+
+    with open(sys.argv[1]) as log:
+        sentences = [line.strip() for line in log if line.strip()]
+
+    rate, malformed = measure_throughput(sentences)
+    print(str(len(sentences)) + " sentences (" + str(malformed) + " malformed): " + str(int(rate)) + " frames/s")
@@ -0,0 +1,131 @@
+'''
+Argo 2 Ground Station - Time Series
+
+Tomas Manterola
+
+Recent telemetry of a payload kept in memory, for plots and figures derived from the flight so far (trends, rates,
+link quality) without reading the logs again. Each field is a fixed-size typed array allocated once, so memory use is
+known up front ('TelemetryHistory.memory') and appending a row allocates nothing. Once full, the oldest rows are
+overwritten.
+
+Every row is written twice, 'capacity' apart, so that the latest N rows are always contiguous: a window is a slice of
+the array, never a copy being put back together (a view, if NumPy is installed).
+
+'''
+
+
+import array
+import bisect
+
+# NumPy is optional (windows are views of NumPy arrays if it is installed, copies of Python arrays otherwise)
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# Fields kept, as (name, array type code). 'received' is the receive time (Unix time) and 'rssi' the signal strength
+# (dBm); the rest are telemetry fields (see 'telemetry.SCHEMA')
+FIELDS = [
+    ("received",    "d"),
+    ("sent_id",     "l"),
+    ("latitude",    "d"),
+    ("longitude",   "d"),
+    ("altitude",    "f"),
+    ("v_speed",     "f"),
+    ("ext_temp",    "f"),
+    ("int_temp",    "f"),
+    ("pressure",    "f"),
+    ("rssi",        "f"),
+]
+
+NUMPY_TYPES = {"d": "f8", "f": "f4", "l": "i8"}
+
+# Hours kept by default, and shortest interval between sentences they are sized for (the tracker sends one every 30 s)
+HOURS = 12
+INTERVAL = 5.0
+
+
+
+# History of one payload: the latest 'capacity' rows of every field in 'FIELDS'
+class TelemetryHistory(object):
+
+    def __init__(self, capacity):
+        self.capacity = max(1, int(capacity))
+        self.total = 0              # Rows ever appended (including those overwritten)
+
+        size = 2 * self.capacity
+        if numpy is not None:
+            self.arrays = dict((name, numpy.zeros(size, dtype=NUMPY_TYPES[code])) for name, code in FIELDS)
+        else:
+            self.arrays = dict((name, array.array(code, [0]) * size) for name, code in FIELDS)
+
+        self._last_received = None
+
+
+    def __len__(self):
+        return min(self.total, self.capacity)
+
+
+    # Bytes taken by the arrays (fixed, whatever is appended)
+    @property
+    def memory(self):
+        return sum(len(values) * values.itemsize for values in self.arrays.itervalues())
+
+
+    # Append telemetry 'record' (see 'telemetry.Parser'), received at 'received' (Unix time) with 'rssi'
+    def append(self, record, rssi, received):
+        # Receive times must not decrease, so that windows by time can be searched (the clock may have been set back)
+        if self._last_received is not None and received < self._last_received:
+            received = self._last_received
+        self._last_received = received
+
+        position = self.total % self.capacity
+        arrays = self.arrays
+        for name, code in FIELDS:
+            if name == "received":
+                value = received
+            elif name == "rssi":
+                value = rssi if rssi is not None else 0
+            else:
+                value = getattr(record, name)
+
+            values = arrays[name]
+            values[position] = value
+            values[position + self.capacity] = value
+
+        # Only counted once written, so that a window read from another thread never includes a half-written row
+        self.total += 1
+
+
+    # Latest 'count' values of field 'name' (all kept, if None), oldest first
+    # With NumPy this is a view: rows appended later may overwrite it once the history is full (copy it to keep it)
+    def window(self, name, count=None):
+        total = self.total
+        length = min(total, self.capacity)
+        count = length if count is None else max(0, min(count, length))
+
+        end = total % self.capacity + self.capacity if total >= self.capacity else total
+        return self.arrays[name][end - count:end]
+
+
+    # Values of field 'name' received in the last 'seconds' (counted back from the latest row), oldest first
+    def recent(self, name, seconds):
+        received = self.window("received")
+        if not len(received):
+            return self.window(name, 0)
+
+        first = bisect.bisect_left(received, received[-1] - seconds)
+        return self.window(name, len(received) - first)
+
+
+    # Latest value of field 'name' (None if empty)
+    def latest(self, name):
+        values = self.window(name, 1)
+        return values[0] if len(values) else None
+
+
+
+# History sized to hold 'hours' of sentences sent every 'interval' seconds
+def for_hours(hours=HOURS, interval=INTERVAL):
+    return TelemetryHistory(hours * 3600.0 / interval)
@@ -0,0 +1,268 @@
+'''
+Argo 2 Ground Station - Uplink
+
+Tomas Manterola
+
+Sends commands to the tracker without making reception (or the window) wait on the serial port, and checks that the
+tracker carried them out. Commands are queued and sent one at a time, right after a sentence is received from the
+tracker: it has just finished transmitting and is listening, and the next sentence is the furthest away.
+
+The next sentence shows whether the command got through. Its ACK field counts the commands the tracker accepted since
+its previous sentence, and its status field shows the settings most commands change. The status only confirms a command
+if the setting was different before the command was first sent: otherwise it shows nothing the tracker did. A command
+not confirmed by either is sent again in the next slot, up to a few times. The tracker never acknowledges a mode
+command (ID 4, a quirk of its firmware), so those are only confirmed by the state in the status field.
+
+'''
+
+
+import collections
+import Queue
+import threading
+import time
+
+import metrics
+
+
+# States of a command
+PENDING = "pending"     # Waiting for a slot to be sent in (again)
+SENT    = "sent"        # Written to the receiver, waiting for the tracker's next sentence
+ACKED   = "acked"       # Confirmed by the tracker
+FAILED  = "failed"      # Not confirmed after every attempt (or couldn't be written)
+
+# Commands (ID) whose value shows up in the status field ([STATE][TX_POWER][GPS_MODE][GPS_POWER][BUZZER]), as
+# (first, last) characters of the status holding it
+STATUS_FIELDS = {
+    "0": (1, 3),        # TX power
+    "1": (3, 4),        # GPS navigation mode
+    "2": (4, 5),        # GPS power mode
+    "3": (5, 6),        # Buzzer
+    "4": (0, 1),        # Tracker state
+}
+
+# Commands the tracker carries out but never acknowledges
+UNACKNOWLEDGED = ("4",)
+
+
+
+# Command sent to the tracker ([ID],[VALUE]), at 'tx_power' dBm
+class Command(object):
+    __slots__ = ("number", "tx_power", "message", "callsign", "state", "attempts", "queued", "sent_at", "detail",
+                 "status_before")
+
+    def __init__(self, number, tx_power, message, callsign=None, now=None):
+        self.number = number
+        self.tx_power = tx_power
+        self.message = message
+        self.callsign = callsign        # Payload expected to answer (any, if None)
+        self.state = PENDING
+        self.attempts = 0
+        self.queued = time.time() if now is None else now
+        self.sent_at = None
+        self.detail = ""                # How it was confirmed, or why it failed
+        self.status_before = None       # Status of the tracker when first sent (None: unknown)
+
+
+    # Whether 'record' (see 'telemetry.Parser') shows the command was carried out: acknowledged, or the setting in the
+    # status field changed to the command's value (from another one before the command was first sent)
+    def confirmed_by(self, record):
+        command_id, _, value = self.message.partition(",")
+
+        if command_id not in UNACKNOWLEDGED and record.ACK > 0:
+            return "acknowledged"
+
+        bounds = STATUS_FIELDS.get(command_id)
+        if bounds is not None and self.status_before is not None:
+            try:
+                if int(record.status[bounds[0]:bounds[1]]) == int(value) != int(self.status_before[bounds[0]:bounds[1]]):
+                    return "status " + self.status_before + " -> " + record.status
+            except ValueError:
+                pass
+        return None
+
+
+    # Why 'record' doesn't confirm the command
+    def unconfirmed(self, record):
+        command_id = self.message.partition(",")[0]
+        status = "status " + record.status
+        if command_id in STATUS_FIELDS:
+            if self.status_before is None:
+                status += " (unknown before sending)"
+            elif self.status_before == record.status:
+                status += " (unchanged)"
+        if command_id in UNACKNOWLEDGED:
+            return "never acknowledged, " + status
+        if command_id in STATUS_FIELDS:
+            return "not acknowledged, " + status
+        return "not acknowledged"
+
+
+    # One-line summary
+    def describe(self):
+        text = "Command #" + str(self.number) + " '" + self.message + "' (" + str(self.tx_power) + " dBm): " + self.state
+        if self.attempts > 1 or self.state == FAILED:
+            text += " after " + str(self.attempts) + " attempt" + ("s" if self.attempts != 1 else "")
+        if self.detail:
+            text += " (" + self.detail + ")"
+        return text
+
+
+
+# Queue of commands to the tracker, sent in the slot after each sentence received and sent again until confirmed
+# Commands are written with 'write(tx_power, message)' by a background thread. The rest runs in the thread calling
+# 'submit()', 'on_record()' and 'check()' (the ingest engine's), which gets the commands that changed state from each.
+# A command sent is given up on after 'max_attempts' attempts. If no sentence arrives within 'ack_timeout' seconds of
+# sending, that attempt counts as missed; if none arrives within 'slot_wait' seconds of queueing, it is sent anyway.
+class UplinkScheduler(object):
+
+    def __init__(self, write, max_attempts=3, ack_timeout=90, slot_wait=60, history=50):
+        self.write = write
+        self.max_attempts = max_attempts
+        self.ack_timeout = ack_timeout
+        self.slot_wait = slot_wait
+
+        self.queue = collections.deque()                # Commands waiting to be sent for the first time
+        self.current = None                             # Command being sent (one at a time)
+        self.finished = collections.deque(maxlen=history)
+        self.count = 0
+
+        self._statuses = {}                             # callsign -> status in the last sentence received
+        self._last_status = None                        # Status in the last sentence received from any payload
+        self._writes = Queue.Queue()
+        self._errors = Queue.Queue()                    # (command, error) of writes that failed
+        self._thread = None
+
+
+    def start(self):
+        self._thread = threading.Thread(target=self._work, name="UplinkWriter")
+        self._thread.daemon = True
+        self._thread.start()
+
+
+    # Stop writing (commands not written yet are dropped)
+    def stop(self, timeout=None):
+        if self._thread is not None:
+            self._writes.put(None)
+            self._thread.join(timeout)
+            self._thread = None
+
+
+    # Commands finished last, followed by those not finished yet
+    @property
+    def commands(self):
+        return list(self.finished) + ([self.current] if self.current is not None else []) + list(self.queue)
+
+
+    # Queue command 'message' ([ID],[VALUE]) to be sent at 'tx_power' dBm. Returns the Command
+    def submit(self, tx_power, message, callsign=None, now=None):
+        self.count += 1
+        command = Command(self.count, tx_power, message, callsign, now)
+        self.queue.append(command)
+        return command
+
+
+    # Check sentence 'record' (with a correct checksum) received at 'now' for the command sent, and send the next
+    # attempt or command in the slot after it. Returns commands that changed state
+    def on_record(self, record, now=None):
+        now = time.time() if now is None else now
+        changed = []
+        self._statuses[record.callsign] = self._last_status = record.status
+
+        command = self.current
+        if command is not None and command.callsign not in (None, record.callsign):
+            return changed
+
+        if command is not None and command.state == SENT:
+            detail = command.confirmed_by(record)
+            if detail:
+                self._finish(command, ACKED, detail, changed)
+            else:
+                self._retry(command, command.unconfirmed(record), now, changed)
+
+        self._send_next(now, changed)
+        return changed
+
+
+    # Handle failed writes, commands not answered in time and commands waiting too long for a slot
+    # Returns commands that changed state
+    def check(self, now=None):
+        now = time.time() if now is None else now
+        changed = []
+
+        while True:
+            try:
+                command, error = self._errors.get_nowait()
+            except Queue.Empty:
+                break
+            if command is self.current and command.state == SENT:
+                self._retry(command, "write failed: " + error, now, changed)
+
+        command = self.current
+        if command is not None and command.state == SENT and now - command.sent_at > self.ack_timeout:
+            self._retry(command, "no sentence received", now, changed)
+
+        # No sentence to send after: don't wait forever
+        waiting = self.current if self.current is not None else (self.queue[0] if self.queue else None)
+        if waiting is not None and waiting.state == PENDING and now - waiting.queued > self.slot_wait:
+            self._send_next(now, changed)
+
+        return changed
+
+
+    # Make 'command' pending again, or fail it once out of attempts. Returns whether it will be sent again
+    def _retry(self, command, reason, now, changed):
+        if command.attempts >= self.max_attempts:
+            self._finish(command, FAILED, reason, changed)
+            return False
+
+        command.state = PENDING
+        command.detail = reason
+        command.queued = now
+        if command not in changed:
+            changed.append(command)
+        return True
+
+
+    def _finish(self, command, state, detail, changed):
+        command.state = state
+        command.detail = detail
+        self.current = None
+        self.finished.append(command)
+        metrics.METRICS.count("commands_acked" if state == ACKED else "commands_failed")
+        changed.append(command)
+
+
+    # Send the current command again, or the next one queued
+    def _send_next(self, now, changed):
+        if self.current is None:
+            if not self.queue:
+                return
+            self.current = self.queue.popleft()
+
+        command = self.current
+        if command.state != PENDING:
+            return
+
+        # Settings before the command first went out, to tell its effect apart from settings the tracker already had
+        if not command.attempts:
+            command.status_before = self._statuses.get(command.callsign) if command.callsign is not None else self._last_status
+
+        command.state = SENT
+        command.attempts += 1
+        command.sent_at = now
+        self._writes.put(command)
+        metrics.METRICS.count("commands_sent")
+        if command not in changed:
+            changed.append(command)
+
+
+    # Writer loop
+    def _work(self):
+        while True:
+            command = self._writes.get()
+            if command is None:
+                break
+            try:
+                self.write(command.tx_power, command.message)
+            except Exception as e:
+                self._errors.put((command, str(e) or e.__class__.__name__))
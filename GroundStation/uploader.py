@@ -0,0 +1,287 @@
+'''
+Argo 2 Ground Station - Uploader
+
+Tomas Manterola
+
+Uploads sentences to the HabHub tracker in the background, so that reception and display never wait on the network.
+A small pool of workers keeps its HTTP connections open between uploads and retries failed uploads with increasing delays.
+
+To check uploads, retries and connection reuse against a local stand-in for HabHub (nothing is sent to HabHub):
+
+    python uploader.py
+
+'''
+
+
+import argparse
+import BaseHTTPServer
+import httplib
+import json
+import Queue
+import SocketServer
+import socket
+import sys
+import threading
+import time
+import urllib
+import urlparse
+
+import metrics
+
+
+HABHUB_URL = "http://habitat.habhub.org/transition/payload_telemetry"
+
+
+
+# Pool of worker threads uploading sentences to HabHub
+# Sentences are queued with 'submit()' (up to 'max_pending' at once) and the outcome of each upload is put on 'results'
+# as (callsign, sentence, ok, detail), where 'detail' is the server response or the last error.
+class HabHubUploader(object):
+
+    def __init__(self, url=HABHUB_URL, workers=2, max_pending=100, retries=3, backoff=0.5, timeout=10):
+        self.url = urlparse.urlsplit(url)
+        self.workers = workers
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+
+        self.pending = Queue.Queue(max_pending)
+        self.results = Queue.Queue()
+
+        self.sent = 0
+        self.failed = 0
+        self.dropped = 0
+
+        self._threads = []
+        self._lock = threading.Lock()
+        self._halt = threading.Event()
+
+
+    # Start worker threads
+    def start(self):
+        self._halt.clear()
+        for i in xrange(self.workers):
+            thread = threading.Thread(target=self._work, name="HabHubUploader-" + str(i))
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+
+    # Stop worker threads after their current upload (sentences still queued are not uploaded)
+    def stop(self, timeout=None):
+        self._halt.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+
+    # Queue sentence for upload. Returns False (and drops sentence) if too many uploads are pending
+    # 'metadata' (dict) is sent to HabHub along with the sentence (e.g. to mark it as repaired)
+    def submit(self, callsign, sentence, metadata=None):
+        try:
+            self.pending.put_nowait((callsign, sentence, metadata))
+            return True
+        except Queue.Full:
+            with self._lock:
+                self.dropped += 1
+            metrics.METRICS.count("uploads_dropped")
+            return False
+
+
+    # Worker loop: upload queued sentences over a single persistent connection
+    def _work(self):
+        conn = None
+
+        while not self._halt.is_set():
+            try:
+                callsign, sentence, metadata = self.pending.get(timeout=0.5)
+            except Queue.Empty:
+                continue
+
+            ok = False
+            detail = ""
+
+            for attempt in xrange(self.retries):
+                if self._halt.is_set():
+                    break
+                if attempt:
+                    time.sleep(self.backoff * 2 ** (attempt - 1))
+
+                try:
+                    if conn is None:
+                        conn = httplib.HTTPConnection(self.url.hostname, self.url.port, timeout=self.timeout)
+
+                    start = metrics.METRICS.start()
+                    detail = self._post(conn, callsign, sentence, metadata)
+                    metrics.METRICS.observe("upload", start)
+                    if "OK" in detail:
+                        ok = True
+                        break
+
+                except (httplib.HTTPException, socket.error) as e:
+                    detail = str(e) or e.__class__.__name__
+
+                    # Connection is unusable after an error, open a new one on the next attempt
+                    conn.close()
+                    conn = None
+
+            with self._lock:
+                if ok:
+                    self.sent += 1
+                else:
+                    self.failed += 1
+            metrics.METRICS.count("uploads_sent" if ok else "uploads_failed")
+
+            self.results.put((callsign, sentence, ok, detail))
+
+        if conn is not None:
+            conn.close()
+
+
+    # Send sentence through 'conn' and return the server's response
+    def _post(self, conn, callsign, sentence, metadata=None):
+        params = urllib.urlencode([
+            ("callsign", callsign),
+            ("string", "$$" + sentence + "\n"),
+            ("string_type", "ascii"),
+            ("metadata", json.dumps(metadata or {})),
+        ])
+        headers = {"Content-Type": "application/x-www-form-urlencoded"}
+
+        conn.request("POST", self.url.path, params, headers)
+        resp = conn.getresponse()
+        body = resp.read()
+
+        # Server will close the connection: don't reuse it
+        if resp.will_close:
+            conn.close()
+
+        return body
+
+
+
+# Local stand-in for HabHub used by 'check()': answers "OK", except for the first 'failures' attempts at each sentence
+# (an error, to make the uploader retry). Keeps the form fields and times of every attempt, and counts connections
+class CheckServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, failures=1):
+        BaseHTTPServer.HTTPServer.__init__(self, ("127.0.0.1", 0), CheckHandler)
+        self.failures = failures
+        self.connections = 0
+        self.attempts = {}          # string field -> [(time, form fields)]
+        self.lock = threading.Lock()
+
+
+    @property
+    def url(self):
+        return "http://127.0.0.1:" + str(self.server_address[1]) + "/transition/payload_telemetry"
+
+
+class CheckHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"   # Keep connections open, like HabHub
+    wbufsize = -1
+
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        with self.server.lock:
+            self.server.connections += 1
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        fields = dict(urlparse.parse_qsl(body, keep_blank_values=True))
+
+        with self.server.lock:
+            attempts = self.server.attempts.setdefault(fields.get("string"), [])
+            attempts.append((time.time(), fields))
+            ok = len(attempts) > self.server.failures
+
+        reply = "OK" if ok else "Try again later"
+        self.send_response(200 if ok else 500)
+        self.send_header("Content-Type", "text/plain")
+        self.send_header("Content-Length", str(len(reply)))
+        self.end_headers()
+        self.wfile.write(reply)
+
+    def log_message(self, format, *args):
+        return
+
+
+
+# Upload 'count' sentences (with characters that need escaping) to a local stand-in for HabHub that fails the first
+# 'failures' attempts at each, and check that every one got through intact, after retries with increasing delays,
+# over no more connections than there are workers. Returns list of problems found (empty if none)
+def check(count=20, failures=1, workers=2, backoff=0.1):
+    server = CheckServer(failures)
+    thread = threading.Thread(target=server.serve_forever, name="CheckServer")
+    thread.daemon = True
+    thread.start()
+
+    uploader = HabHubUploader(server.url, workers=workers, retries=failures + 1, backoff=backoff)
+    uploader.start()
+
+    metadata = {"repaired_bits": 1, "note": 'spaces, "quotes" & {braces}'}
+    sentences = ["CHECK,%d,12:00:00,a&b=c+d%%25 e*ABCD" % i for i in xrange(count)]
+    for sentence in sentences:
+        uploader.submit("CHECK", sentence, metadata)
+
+    problems = []
+    deadline = time.time() + 10 + count * failures * backoff * 2
+    results = []
+    while len(results) < count and time.time() < deadline:
+        try:
+            results.append(uploader.results.get(timeout=0.1))
+        except Queue.Empty:
+            continue
+
+    uploader.stop(1)
+    server.shutdown()
+    server.server_close()
+
+    if len(results) < count:
+        problems.append("only " + str(len(results)) + " of " + str(count) + " uploads finished")
+    for callsign, sentence, ok, detail in results:
+        if not ok:
+            problems.append("upload of '" + sentence + "' failed: " + detail)
+
+    for sentence in sentences:
+        attempts = server.attempts.get("$$" + sentence + "\n", [])
+        if len(attempts) != failures + 1:
+            problems.append("'" + sentence + "' arrived intact " + str(len(attempts)) + " times (expected " + str(failures + 1) + ")")
+            continue
+
+        fields = attempts[-1][1]
+        if fields.get("callsign") != "CHECK" or fields.get("string_type") != "ascii" or json.loads(fields.get("metadata", "null")) != metadata:
+            problems.append("fields of '" + sentence + "' arrived changed: " + repr(fields))
+
+        for i in xrange(1, len(attempts)):
+            delay = attempts[i][0] - attempts[i - 1][0]
+            if delay < backoff * 2 ** (i - 1) * 0.9:
+                problems.append("retry %d of '%s' after %.3f s (expected at least %.3f s)" % (i, sentence, delay, backoff * 2 ** (i - 1)))
+
+    if server.connections > workers:
+        problems.append(str(server.connections) + " connections opened for " + str(workers) + " workers (not kept open)")
+
+    return problems
+
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check uploads to a local stand-in for HabHub: escaping, retries with backoff and connection reuse.")
+    parser.add_argument("--count", type=int, default=20, help="sentences to upload (default: 20)")
+    parser.add_argument("--failures", type=int, default=1, help="attempts at each sentence the stand-in fails (default: 1)")
+    parser.add_argument("--workers", type=int, default=2, help="upload workers (default: 2)")
+    parser.add_argument("--backoff", type=float, default=0.1, help="seconds before the first retry, doubling for each one after it (default: 0.1)")
+    args = parser.parse_args()
+
+    problems = check(args.count, args.failures, args.workers, args.backoff)
+    for problem in problems:
+        print(problem)
+    if problems:
+        sys.exit(1)
+    print("Uploaded " + str(args.count) + " sentences, each after " + str(args.failures) + " failed attempt(s), over at most " + str(args.workers) + " connections: OK")
+
+
+
+if __name__ == '__main__':
+    main()